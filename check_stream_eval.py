@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+--dry_run --stream 的端到端自检：在临时目录生成几张页面图，宽度为奇数的页面让替身 pipeline（StubPipeline(loop=True)）
+模拟生成循环，经 eval.infer 流式推理（带结果缓存）两遍，核对：
+- 循环页面被 StreamGuard 提前结束：truncated 为 "repetition"，输出远短于替身的完整输出，修复后标签闭合；
+- 正常页面不带 truncated，输出与替身一致；
+- 缓存中保存的是提前结束并修复后的输出与 stop_reason，第二遍全部命中缓存（不再调用 pipeline）并还原 truncated。
+逐张（batch_size=1）与多张一批（batch_size=3）各跑一遍，任一不符时打印原因并以非零状态退出。
+
+用法: python check_stream_eval.py
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import tempfile
+
+from PIL import Image
+from lmdeploy import GenerationConfig
+
+from eval import StubPipeline, infer
+
+WIDTHS = (600, 601, 610, 611, 620, 621)
+HEIGHT = 800
+CLOSED_TAGS = ("table", "div", "body", "html")
+
+
+class CountingStub(StubPipeline):
+    """记录调用次数与实际被取走的输出字符数，用于确认循环被提前结束、第二遍全部命中缓存"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = 0
+        self.chars = 0
+
+    def stream_infer(self, messages, gen_config=None, chunk_size: int = 8):
+        self.calls += 1
+        for resp in super().stream_infer(messages, gen_config, chunk_size):
+            self.chars += len(resp.text)
+            yield resp
+
+
+def load_predictions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return {rec["image"]: rec for rec in map(json.loads, f) if rec}
+
+
+def check_run(root, batch_size):
+    """返回不符项的描述列表"""
+    img_dir = os.path.join(root, "img")
+    cache_path = os.path.join(root, f"cache-bs{batch_size}.sqlite")
+    failures = []
+    runs = []
+    for _ in range(2):
+        pipe = CountingStub(loop=True)
+        pred_path = os.path.join(root, f"predict-bs{batch_size}-{len(runs)}.jsonl")
+        infer(img_dir, pred_path, pipe, GenerationConfig(max_new_tokens=8192), num_threads=2,
+              batch_size=batch_size, stream=True, cache_path=cache_path, model_path=os.path.join(root, "model"))
+        runs.append((pipe, load_predictions(pred_path)))
+
+    (first_pipe, first), (second_pipe, second) = runs
+    # 没有提前结束时每张循环页面都要取完 max_chars 个字符
+    if first_pipe.chars >= first_pipe.max_chars:
+        failures.append(f"流式输出共取走 {first_pipe.chars} 个字符，循环没有在生成过程中被提前结束")
+    for w in WIDTHS:
+        name = f"w{w}.png"
+        rec = first.get(name)
+        if rec is None:
+            failures.append(f"{name}: 没有输出")
+            continue
+        answer = rec["answer"]
+        if "latency" not in rec:
+            failures.append(f"{name}: 缺少 latency")
+        if w % 2:
+            if rec.get("truncated") != "repetition":
+                failures.append(f"{name}: truncated={rec.get('truncated')!r}，期望 'repetition'")
+            if len(answer) > StubPipeline().max_chars // 10:
+                failures.append(f"{name}: 循环部分没有被截掉（输出 {len(answer)} 个字符）")
+            unclosed = [t for t in CLOSED_TAGS if answer.count(f"<{t}") != answer.count(f"</{t}>")]
+            if unclosed or not answer.endswith("</html>"):
+                failures.append(f"{name}: 修复后标签未闭合 {unclosed}")
+        else:
+            expected = f'<html><body><p data-bbox="0 0 {w} {HEIGHT}">{w}x{HEIGHT}</p></body></html>'
+            if "truncated" in rec or answer != expected:
+                failures.append(f"{name}: 正常页面输出被改动")
+        again = second.get(name, {})
+        if (again.get("answer"), again.get("truncated")) != (answer, rec.get("truncated")):
+            failures.append(f"{name}: 缓存命中后的结果与首次推理不一致")
+
+    if second_pipe.calls:
+        failures.append(f"第二遍调用了 {second_pipe.calls} 次 pipeline，期望全部命中缓存")
+    with sqlite3.connect(cache_path) as conn:
+        rows = conn.execute("SELECT answer, stop_reason FROM results").fetchall()
+    looping = sum(w % 2 for w in WIDTHS)
+    guarded = [answer for answer, reason in rows if reason == "repetition"]
+    if len(rows) != len(WIDTHS) or len(guarded) != looping:
+        failures.append(f"缓存中 {len(rows)} 条结果、{len(guarded)} 条 stop_reason='repetition'，"
+                        f"期望 {len(WIDTHS)} 条与 {looping} 条")
+    if any(not answer.endswith("</html>") for answer in guarded):
+        failures.append("缓存中提前结束的结果没有经过修复")
+    return failures
+
+
+def check():
+    """返回不符项个数"""
+    failed = 0
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(os.path.join(root, "img"))
+        os.makedirs(os.path.join(root, "model"))
+        with open(os.path.join(root, "model", "config.json"), "w") as f:
+            f.write("{}")
+        for w in WIDTHS:
+            Image.new("RGB", (w, HEIGHT), "white").save(os.path.join(root, "img", f"w{w}.png"))
+        for batch_size in (1, 3):
+            failures = check_run(root, batch_size)
+            for msg in failures:
+                print(f"❌ batch_size={batch_size} {msg}")
+            failed += len(failures)
+    print(f"[Check] {len(WIDTHS)} 张页面 × 2 种 batch_size，{failed} 处不符")
+    return failed
+
+
+def main():
+    if check():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
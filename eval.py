@@ -1,43 +1,32 @@
 import os
-import re
+import sys
 import json
 import time
+import heapq
+import queue
+import subprocess
+import threading
+import types
 import yaml
 import warnings
 import argparse
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from PIL import Image
 from tqdm import tqdm
 
 from lmdeploy import pipeline, GenerationConfig
+from qwen_vl_utils import smart_resize
 
-warnings.filterwarnings("ignore")
-
-def modify_bboxes(
-    text: str,
-    image_size: Tuple[int, int],
-    resized_size: Tuple[int, int],
-    attr_name: str = "data-bbox",
-) -> str:
-    """
-    将 HTML 中的 bbox (x1 y1 x2 y2) 从 resized_size 映射回 image_size
-    """
-    img_w, img_h = image_size
-    res_w, res_h = resized_size
-
-    def _replace(match: re.Match[str]) -> str:
-        x1, y1, x2, y2 = map(int, match.group(1).split())
-        bbox = np.array([x1, y1, x2, y2], dtype=float)
-        scale = np.array([img_w / res_w, img_h / res_h] * 2)
-        x1, y1, x2, y2 = (bbox * scale).round().astype(int)
-        return f'{attr_name}="{x1} {y1} {x2} {y2}"'
-
-    return re.sub(rf'{attr_name}=\"([^"]+)\"', _replace, text)
+from utils.bbox import rescale_bboxes
+from utils.result_cache import ResultCache, config_dict, file_sha256, model_fingerprint
+from utils.stream_guard import StreamGuard
 
+warnings.filterwarnings("ignore")
 
 def build_messages(pil_img: Image.Image, prompt: str) -> List[Dict[str, Any]]:
     """
@@ -58,25 +47,228 @@ def build_messages(pil_img: Image.Image, prompt: str) -> List[Dict[str, Any]]:
     ]
 
 
-def worker(
+def estimate_visual_tokens(
+    image_size: Tuple[int, int],
+    min_pixels: int,
+    max_pixels: int,
+    factor: int = 28,
+) -> int:
+    """
+    按 smart_resize 估算单张图片送入模型后的视觉 token 数
+    """
+    img_w, img_h = image_size
+    res_h, res_w = smart_resize(
+        img_h, img_w, factor=factor, min_pixels=min_pixels, max_pixels=max_pixels
+    )
+    return (res_h // factor) * (res_w // factor)
+
+
+def make_batches(
+    items: List[Tuple[Path, int]],
+    batch_size: int,
+    max_batch_tokens: int = 0,
+) -> List[List[Path]]:
+    """
+    按图片数量与视觉 token 预算切分 micro-batch（max_batch_tokens<=0 表示不限 token）
+    """
+    batches, cur, cur_tokens = [], [], 0
+    for img_path, n_tokens in items:
+        full = len(cur) >= batch_size or (
+            max_batch_tokens > 0 and cur_tokens + n_tokens > max_batch_tokens
+        )
+        if cur and full:
+            batches.append(cur)
+            cur, cur_tokens = [], 0
+        cur.append(img_path)
+        cur_tokens += n_tokens
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+def ink_density(img_path: Path, sample_side: int = 256) -> float:
+    """
+    在缩略图上估计页面墨迹占比（灰度 < 128 的像素比例），JPEG 借助 draft 在解码时直接降采样
+    """
+    with Image.open(img_path) as im:
+        im.draft("L", (sample_side, sample_side))
+        gray = im.convert("L")
+    gray.thumbnail((sample_side, sample_side))
+    return float((np.asarray(gray) < 128).mean())
+
+
+def load_latency_history(paths: List[str]) -> Dict[str, float]:
+    """
+    从历史 predict.jsonl 的 latency 字段读取每张图片的实测耗时（同名取最后一次）
+    """
+    history = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if rec.get("answer") and rec.get("latency") is not None:
+                    history[rec["image"]] = float(rec["latency"])
+    return history
+
+
+def estimate_costs(
+    names: List[str],
+    n_tokens: List[int],
+    inks: List[float],
+    history: Dict[str, float],
+) -> List[float]:
+    """
+    估计每页推理代价：代理值 = 视觉 token 数 × (0.25 + 墨迹占比)；
+    有历史耗时的页面直接用历史值，其余页面用两者比值的中位数把代理值换算到秒
+    """
+    proxy = np.asarray(n_tokens, dtype=float) * (0.25 + np.asarray(inks, dtype=float))
+    known = [(i, history[n]) for i, n in enumerate(names) if n in history]
+    if not known:
+        return proxy.tolist()
+
+    idx = np.array([i for i, _ in known])
+    lat = np.array([t for _, t in known])
+    valid = proxy[idx] > 0
+    scale = float(np.median(lat[valid] / proxy[idx][valid])) if valid.any() else 1.0
+    costs = proxy * scale
+    costs[idx] = lat
+    return costs.tolist()
+
+
+def partition_by_cost(names: List[str], costs: List[float], num_shards: int) -> List[int]:
+    """
+    贪心 LPT 划分：按代价从大到小（代价相同按文件名）依次分给当前总代价最小的分片（相同取编号小的），
+    返回每张图片的分片号；结果只取决于文件名与代价，各进程独立计算得到同样的划分
+    """
+    shard_of = [0] * len(names)
+    loads = [(0.0, k) for k in range(num_shards)]
+    for i in sorted(range(len(names)), key=lambda i: (-costs[i], names[i])):
+        load, k = heapq.heappop(loads)
+        shard_of[i] = k
+        heapq.heappush(loads, (load + costs[i], k))
+    return shard_of
+
+
+def select_shard(
+    img_paths: List[Path],
+    shard_index: int,
+    num_shards: int,
+    min_pixels: int = 200704,
+    max_pixels: int = 1003520,
+) -> List[Path]:
+    """
+    返回第 shard_index 个分片的图片。每个分片进程都要对全部图片算一遍划分，
+    因此代价只用视觉 token 数（只读图片头，不解码），不读历史耗时与已有输出，
+    保证各进程之间、断点续跑前后划分一致
+    """
+    n_tokens = []
+    for p in img_paths:
+        with Image.open(p) as im:
+            n_tokens.append(estimate_visual_tokens(im.size, min_pixels, max_pixels))
+    shard_of = partition_by_cost([p.name for p in img_paths], n_tokens, num_shards)
+    return [p for p, k in zip(img_paths, shard_of) if k == shard_index]
+
+
+def schedule_longest_first(
+    items: List[Tuple[Path, int]], costs: List[float]
+) -> List[Tuple[Path, int]]:
+    """
+    按估计代价从大到小排序（代价相同按文件名），长尾页面最先提交
+    """
+    order = sorted(range(len(items)), key=lambda i: (-costs[i], items[i][0].name))
+    return [items[i] for i in order]
+
+
+def load_image(
     img_path: Path,
+    pre_resize: bool = False,
+    min_pixels: int = 200704,
+    max_pixels: int = 1003520,
+) -> Dict[str, Any]:
+    """
+    解码图片并立即关闭文件句柄，返回送入推理阶段的条目；
+    pre_resize=True 时在 CPU 上按训练时相同的 smart_resize 网格缩放后再送入引擎；
+    读图与缩放耗时记入 item["timing"]
+    """
+    t0 = time.time()
+    with Image.open(img_path) as im:
+        img = im.convert("RGB")
+    orig_size = img.size
+    t1 = time.time()
+
+    if pre_resize:
+        # 与 trainer/dataset/preprocess.py 保持一致：factor=28，默认插值
+        res_h, res_w = smart_resize(
+            orig_size[1],
+            orig_size[0],
+            factor=28,
+            min_pixels=min_pixels,
+            max_pixels=max_pixels,
+        )
+        if (res_w, res_h) != orig_size:
+            img = img.resize((res_w, res_h))
+
+    return {
+        "name": img_path.name,
+        "image": img,
+        "orig_size": orig_size,
+        "sent_size": img.size,
+        "timing": {"load": t1 - t0, "preprocess": time.time() - t1},
+    }
+
+
+def postprocess(answer: str, item: Dict[str, Any]) -> str:
+    """
+    bbox 从送入模型的图像尺寸映射回原尺寸
+    """
+    return rescale_bboxes(answer, item["sent_size"], item["orig_size"])
+
+
+def note_timing(item: Dict[str, Any], **values) -> None:
+    """记录一张图的推理起止时间、token 数等，供 RequestTrace 汇总"""
+    item.setdefault("timing", {}).update(values)
+
+
+def timed_postprocess(answer: str, item: Dict[str, Any]) -> str:
+    t0 = time.time()
+    answer = postprocess(answer, item)
+    note_timing(item, postprocess=time.time() - t0)
+    return answer
+
+
+def worker(
+    item: Dict[str, Any],
     llm_pipe,
     gen_cfg: GenerationConfig,
     prompt: str = "QwenVL HTML",
+    cache: Optional[ResultCache] = None,
 ) -> Dict[str, Any]:
     """
-    对单张图片执行推理并返回结果字典
+    对单张已解码图片执行推理并返回结果字典；cache 非空时写入后处理之前的原始输出
     """
-    img_name = img_path.name
-    img_orig = Image.open(img_path)
+    img_name = item["name"]
 
     try:
         t0 = time.time()
-        resp = llm_pipe(build_messages(img_orig, prompt), gen_config=gen_cfg)
-        latency = round(time.time() - t0, 3)
+        resp = llm_pipe(build_messages(item["image"], prompt), gen_config=gen_cfg)
+        t1 = time.time()
+        latency = round(t1 - t0, 3)
+        note_timing(
+            item,
+            infer_start=t0,
+            infer_end=t1,
+            output_tokens=getattr(resp, "generate_token_len", None),
+            input_tokens=getattr(resp, "input_token_len", None),
+        )
         answer = resp.text if hasattr(resp, "text") else str(resp)
-        # bbox 映射回原尺寸
-        answer = modify_bboxes(answer, img_orig.size, img_orig.size)
+        if cache is not None:
+            cache.put(item["cache_key"], answer, item["sent_size"], item["orig_size"], latency)
+        answer = timed_postprocess(answer, item)
     except Exception as exc:
         print(f"[{img_name}] inference error: {exc}")
         return {"image": img_name, "prompt": prompt, "answer": ""}
@@ -84,32 +276,717 @@ def worker(
     return {"image": img_name, "prompt": prompt, "answer": answer, "latency": latency}
 
 
+def batch_worker(
+    items: List[Dict[str, Any]],
+    llm_pipe,
+    gen_cfg: GenerationConfig,
+    prompt: str = "QwenVL HTML",
+    cache: Optional[ResultCache] = None,
+) -> List[Dict[str, Any]]:
+    """
+    将一个 micro-batch 以列表形式一次提交给 pipeline，结果按图片名回填；
+    整批失败、返回条数与提交条数不一致或任一结果后处理出错时退回逐张推理，避免单张坏图拖垮整批。
+    每条结果的 latency 为整批耗时按张数分摊的单页耗时（与逐张推理的字段一致），整批耗时另记为 batch_latency
+    """
+    if len(items) == 1:
+        return [worker(items[0], llm_pipe, gen_cfg, prompt, cache)]
+
+    try:
+        t0 = time.time()
+        resps = llm_pipe(
+            [build_messages(it["image"], prompt) for it in items], gen_config=gen_cfg
+        )
+        t1 = time.time()
+        if len(resps) != len(items):
+            raise RuntimeError(f"pipeline returned {len(resps)} responses for {len(items)} images")
+        batch_latency = round(t1 - t0, 3)
+        latency = round((t1 - t0) / len(items), 3)
+
+        results = []
+        for it, resp in zip(items, resps):
+            note_timing(
+                it,
+                infer_start=t0,
+                infer_end=t1,
+                output_tokens=getattr(resp, "generate_token_len", None),
+                input_tokens=getattr(resp, "input_token_len", None),
+            )
+            answer = resp.text if hasattr(resp, "text") else str(resp)
+            if cache is not None:
+                cache.put(it["cache_key"], answer, it["sent_size"], it["orig_size"], latency)
+            results.append(
+                {
+                    "image": it["name"],
+                    "prompt": prompt,
+                    "answer": timed_postprocess(answer, it),
+                    "latency": latency,
+                    "batch_latency": batch_latency,
+                }
+            )
+    except Exception as exc:
+        print(f"[batch of {len(items)}] inference error: {exc}, retry one by one")
+        return [worker(it, llm_pipe, gen_cfg, prompt, cache) for it in items]
+    return results
+
+
+def stream_worker(
+    items: List[Dict[str, Any]],
+    llm_pipe,
+    gen_cfg: GenerationConfig,
+    prompt: str = "QwenVL HTML",
+    cache: Optional[ResultCache] = None,
+    guard_kwargs: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    以流式方式推理一个 micro-batch，每张图的输出增量送入 StreamGuard：
+    检测到重复循环或 </html> 之后继续生成时不再接收该图的输出，整批都结束后关闭生成流
+    （引擎不支持单条取消，batch_size=1 时才能真正省下剩余的生成）；
+    结果按结束原因修复 HTML，提前结束的结果带 "truncated" 字段；流式或后处理失败时退回 batch_worker。
+    latency 为每张图自己的耗时（从提交到该图结束），多张一批时另记整批耗时 batch_latency。
+    每张图的首个输出时间（TTFT）、结束时间与 token 数记入 item["timing"]
+    """
+    guards = [StreamGuard(**(guard_kwargs or {})) for _ in items]
+    finish = [None] * len(items)
+    done = [False] * len(items)
+    t0 = time.time()
+    for it in items:
+        note_timing(it, infer_start=t0, ttft=None, output_tokens=None, input_tokens=None)
+    try:
+        stream = llm_pipe.stream_infer(
+            [build_messages(it["image"], prompt) for it in items], gen_config=gen_cfg
+        )
+        try:
+            for resp in stream:
+                i = getattr(resp, "index", 0)
+                if done[i]:
+                    continue
+                timing = items[i]["timing"]
+                now = time.time()
+                if timing["ttft"] is None:
+                    timing["ttft"] = now - t0
+                # 流式返回的 token 数为累计值
+                timing["output_tokens"] = getattr(resp, "generate_token_len", None)
+                timing["input_tokens"] = getattr(resp, "input_token_len", None)
+                if guards[i].feed(resp.text or ""):
+                    done[i] = True
+                elif resp.finish_reason is not None:
+                    finish[i] = resp.finish_reason
+                    done[i] = True
+                if done[i]:
+                    timing["infer_end"] = now
+                if all(done):
+                    break
+        finally:
+            stream.close()
+        t1 = time.time()
+        batch_latency = round(t1 - t0, 3)
+
+        results = []
+        for it, guard, reason in zip(items, guards, finish):
+            it["timing"].setdefault("infer_end", t1)
+            latency = round(it["timing"]["infer_end"] - t0, 3)
+            answer = guard.finish(reason)
+            if cache is not None:
+                cache.put(it["cache_key"], answer, it["sent_size"], it["orig_size"], latency, guard.stop_reason)
+            res = {
+                "image": it["name"],
+                "prompt": prompt,
+                "answer": timed_postprocess(answer, it),
+                "latency": latency,
+            }
+            if len(items) > 1:
+                res["batch_latency"] = batch_latency
+            if guard.stop_reason:
+                res["truncated"] = guard.stop_reason
+            results.append(res)
+    except Exception as exc:
+        print(f"[batch of {len(items)}] stream error: {exc}, retry without streaming")
+        for it in items:
+            it["timing"]["ttft"] = None
+        return batch_worker(items, llm_pipe, gen_cfg, prompt, cache)
+    return results
+
+
+class StubPipeline:
+    """
+    不加载模型的替身 pipeline：每张图返回一个覆盖整页的段落，
+    用于在 CPU 上检查分片、合并与断点续跑（--dry_run）；
+    loop=True 时宽度为奇数的图片模拟生成循环：同一表格行不断重复，max_chars 个字符后以 "length" 结束，
+    用于检查流式推理的提前结束、HTML 修复与 stop_reason 的传递（--dry_run --stream --dry_run_loop）
+    """
+
+    def __init__(self, loop: bool = False, max_chars: int = 200000):
+        self.loop = loop
+        self.max_chars = max_chars
+
+    def __call__(self, messages, gen_config=None):
+        if messages and isinstance(messages[0], list):
+            return [self(m, gen_config) for m in messages]
+        w, h = messages[1]["content"][0]["image_url"]["url"].size
+        if self.loop and w % 2:
+            head = f'<html><body><div class="table" data-bbox="0 0 {w} {h}"><table>'
+            row = f"<tr><td>{w}x{h}</td><td>loop</td></tr>"
+            return (head + row * (self.max_chars // len(row)))[:self.max_chars]
+        return f'<html><body><p data-bbox="0 0 {w} {h}">{w}x{h}</p></body></html>'
+
+    def stream_infer(self, messages, gen_config=None, chunk_size: int = 8):
+        """与 __call__ 相同的输出，按 chunk_size 个字符分段流式返回；多张图的输出交错返回"""
+        texts = [self(m, gen_config) for m in messages]
+        for i in range(0, max(map(len, texts)), chunk_size):
+            for index, text in enumerate(texts):
+                if i >= len(text):
+                    continue
+                last = i + chunk_size >= len(text)
+                reason = ("stop" if text.endswith("</html>") else "length") if last else None
+                yield types.SimpleNamespace(text=text[i:i + chunk_size], index=index, finish_reason=reason)
+
+    def close(self) -> None:
+        pass
+
+
+class StageMetrics:
+    """
+    流水线各阶段的累计工作/阻塞时间与队列深度采样，用于判断瓶颈在哪个阶段：
+    推理阶段频繁等空队列说明解码跟不上，解码阶段频繁等满队列说明推理是瓶颈
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.busy = defaultdict(float)
+        self.blocked = defaultdict(float)
+        self.count = defaultdict(int)
+        self.depths = defaultdict(list)
+
+    def add(self, stage: str, busy: float = 0.0, blocked: float = 0.0, n: int = 0) -> None:
+        with self._lock:
+            self.busy[stage] += busy
+            self.blocked[stage] += blocked
+            self.count[stage] += n
+
+    def monitor(
+        self, queues: Dict[str, queue.Queue], stop: threading.Event, interval: float = 0.5
+    ) -> None:
+        while not stop.wait(interval):
+            for name, q in queues.items():
+                self.depths[name].append(q.qsize())
+
+    def report(self, wall: float, workers: Dict[str, int], capacity: Dict[str, int]) -> None:
+        print(f"[Pipeline] wall {wall:.1f}s")
+        for stage, n_workers in workers.items():
+            print(
+                f"  {stage:<6} workers {n_workers:>2}  items {self.count[stage]:>6}  "
+                f"busy {self.busy[stage]:8.1f}s  blocked {self.blocked[stage]:8.1f}s  "
+                f"utilization {self.busy[stage] / max(wall * n_workers, 1e-9):6.1%}"
+            )
+        for name, depths in self.depths.items():
+            if depths:
+                cap = capacity.get(name) or "inf"
+                print(
+                    f"  {name:<8} depth mean {np.mean(depths):5.1f}  "
+                    f"max {max(depths):>3}  capacity {cap}"
+                )
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    arr = np.asarray(values, dtype=float)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(arr.mean())}
+
+
+def busy_time(intervals: List[Tuple[float, float]]) -> float:
+    """区间并集的总长度"""
+    total, cur_start, cur_end = 0.0, None, None
+    for start, end in sorted(intervals):
+        if cur_end is None or start > cur_end:
+            if cur_end is not None:
+                total += cur_end - cur_start
+            cur_start, cur_end = start, end
+        else:
+            cur_end = max(cur_end, end)
+    if cur_end is not None:
+        total += cur_end - cur_start
+    return total
+
+
+class RequestTrace:
+    """
+    逐请求的耗时记录：读图、预处理、排队等待、首 token 时间（仅 --stream）、推理、输出 token 数、
+    解码速度（有 TTFT 时不含预填充）与后处理；结束时写出 JSONL trace 与汇总（各项 p50/p95/p99、吞吐），
+    GPU 空闲按没有任何请求在推理中的时间占比估计（各请求推理区间的并集），命中缓存的图片不计入
+    """
+
+    FIELDS = ("load", "preprocess", "queue_wait", "ttft", "infer", "output_tokens", "decode_tps", "postprocess")
+
+    def __init__(self, t_start: float):
+        self._lock = threading.Lock()
+        self.t_start = t_start
+        self.records: List[Dict[str, Any]] = []
+
+    def add(self, item: Dict[str, Any], result: Dict[str, Any], batch_size: int) -> None:
+        t = item.get("timing", {})
+        start, end = t.get("infer_start"), t.get("infer_end")
+        infer = end - start if start is not None and end is not None else None
+        ttft, tokens = t.get("ttft"), t.get("output_tokens")
+        decode = infer - ttft if infer is not None and ttft is not None else infer
+        rec = {
+            "image": item["name"],
+            "batch_size": batch_size,
+            "ok": bool(result.get("answer")),
+            "start": start - self.t_start if start is not None else None,
+            "end": end - self.t_start if end is not None else None,
+            "load": t.get("load"),
+            "preprocess": t.get("preprocess"),
+            "queue_wait": t.get("queue_wait"),
+            "ttft": ttft,
+            "infer": infer,
+            "output_tokens": tokens,
+            "input_tokens": t.get("input_tokens"),
+            "decode_tps": tokens / decode if tokens and decode else None,
+            "postprocess": t.get("postprocess"),
+        }
+        if "truncated" in result:
+            rec["truncated"] = result["truncated"]
+        rec = {k: round(v, 4) if isinstance(v, float) else v for k, v in rec.items()}
+        with self._lock:
+            self.records.append(rec)
+
+    def summary(self, wall: float) -> Dict[str, Any]:
+        spans = [(r["start"], r["end"]) for r in self.records if r["start"] is not None and r["end"] is not None]
+        tokens = sum(r["output_tokens"] or 0 for r in self.records)
+        summary = {
+            "requests": len(self.records),
+            "failed": sum(not r["ok"] for r in self.records),
+            "wall": wall,
+            "images_per_s": len(self.records) / max(wall, 1e-9),
+            "output_tokens_per_s": tokens / max(wall, 1e-9),
+            "gpu_idle": 1 - busy_time(spans) / max(wall, 1e-9) if spans else None,
+        }
+        for field in self.FIELDS:
+            values = [r[field] for r in self.records if r[field] is not None]
+            if values:
+                summary[field] = percentiles(values)
+        return summary
+
+    def report(self, wall: float, trace_path: Optional[str] = None) -> None:
+        summary = self.summary(wall)
+        idle = summary["gpu_idle"]
+        print(
+            f"[Trace] {summary['requests']} requests ({summary['failed']} failed)  "
+            f"{summary['images_per_s']:.2f} img/s  {summary['output_tokens_per_s']:.1f} tok/s  "
+            f"GPU idle {'n/a' if idle is None else f'{idle:.1%}'}"
+        )
+        for field in self.FIELDS:
+            if field in summary:
+                q = summary[field]
+                print(
+                    f"  {field:<13} p50 {q['p50']:9.3f}  p95 {q['p95']:9.3f}  "
+                    f"p99 {q['p99']:9.3f}  mean {q['mean']:9.3f}"
+                )
+        if trace_path:
+            with open(trace_path, "w", encoding="utf-8") as f:
+                for rec in sorted(self.records, key=lambda r: r["image"]):
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            summary_path = os.path.splitext(trace_path)[0] + ".summary.json"
+            with open(summary_path, "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            print(f"[Trace] {len(self.records)} records -> {trace_path}, summary -> {summary_path}")
+
+
+class ResultWriter:
+    """
+    追加写入 predict.jsonl，按条数/时间周期性 fsync，进程被抢占时最多丢失最近一小段结果
+    """
+
+    def __init__(self, output_path: str, fsync_every: int = 50, fsync_interval: float = 30.0):
+        self.fout = open(output_path, "a", encoding="utf-8")
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._pending = 0
+        self._last_sync = time.time()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self.fout.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._pending += 1
+        if (
+            self._pending >= self.fsync_every
+            or time.time() - self._last_sync >= self.fsync_interval
+        ):
+            self.sync()
+
+    def sync(self) -> None:
+        self.fout.flush()
+        os.fsync(self.fout.fileno())
+        self._pending = 0
+        self._last_sync = time.time()
+
+    def close(self) -> None:
+        self.sync()
+        self.fout.close()
+
+
+def truncate_partial_line(output_path: str) -> None:
+    """
+    截掉崩溃时写了一半的最后一行，保证后续追加写入的每一行都是完整 JSON
+    """
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        pos = size
+        while pos > 0:
+            step = min(1 << 16, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            idx = chunk.rfind(b"\n")
+            if idx >= 0:
+                pos = pos - step + idx + 1
+                break
+            pos -= step
+        if pos != size:
+            f.truncate(pos)
+
+
+def load_finished(output_path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    扫描已有输出，返回 answer 非空的记录（同名图片以最后一条为准）；
+    answer 为空的记录视为失败，会被重新调度
+    """
+    finished = {}
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if rec.get("answer"):
+                finished[rec["image"]] = rec
+            else:
+                finished.pop(rec.get("image"), None)
+    return finished
+
+
+def merge_outputs(input_paths: List[str], output_path: str) -> int:
+    """
+    依次读取 input_paths，去重并按图片名排序，先写临时文件再原子替换 output_path，返回最终记录数
+    """
+    records = {}
+    for path in input_paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                # 已有成功结果时不被后续失败记录覆盖
+                if rec.get("answer") or rec["image"] not in records:
+                    records[rec["image"]] = rec
+
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fout:
+        for name in sorted(records):
+            fout.write(json.dumps(records[name], ensure_ascii=False) + "\n")
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp_path, output_path)
+    return len(records)
+
+
+def finalize_output(output_path: str) -> int:
+    """
+    去重并按图片名排序后原子替换 output_path，返回最终记录数
+    """
+    return merge_outputs([output_path], output_path)
+
+
+def shard_output_path(output_path: str, shard_index: int, num_shards: int) -> str:
+    """predict.jsonl → predict.shard-01-of-04.jsonl"""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.shard-{shard_index:02d}-of-{num_shards:02d}{ext}"
+
+
+def merge_shards(output_path: str, num_shards: int) -> int:
+    """按分片编号顺序合并各分片输出为 output_path（缺失的分片跳过），返回最终记录数"""
+    paths = [shard_output_path(output_path, k, num_shards) for k in range(num_shards)]
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        print(f"[Merge] missing shard outputs: {missing}")
+    total = merge_outputs([p for p in paths if os.path.exists(p)], output_path)
+    print(f"[Saved] {total} records from {num_shards} shards -> {output_path}")
+    return total
+
+
+def launch_shards(num_shards: int, gpus: List[str], output_path: str) -> None:
+    """
+    以相同的命令行参数加 --shard_index 启动 num_shards 个子进程，第 k 个进程只看到 gpus[k % len(gpus)]，
+    各自加载模型并写出分片结果；全部结束后合并为 output_path
+    """
+    procs = []
+    for k in range(num_shards):
+        env = {key: v for key, v in os.environ.items() if key not in ("RANK", "LOCAL_RANK", "WORLD_SIZE")}
+        if gpus:
+            env["CUDA_VISIBLE_DEVICES"] = gpus[k % len(gpus)]
+        cmd = [sys.executable, os.path.abspath(__file__), *sys.argv[1:],
+               "--num_shards", str(num_shards), "--shard_index", str(k)]
+        print(f"[Launch] shard {k}/{num_shards} on GPU {env.get('CUDA_VISIBLE_DEVICES', '-')}")
+        procs.append(subprocess.Popen(cmd, env=env))
+    failed = [k for k, proc in enumerate(procs) if proc.wait() != 0]
+
+    merge_shards(output_path, num_shards)
+    if failed:
+        raise SystemExit(f"Shards {failed} failed, rerun with --resume to finish them")
+
+
+def clear_shard_markers(output_path: str, num_shards: int, rank: int) -> None:
+    """
+    torchrun 等外部启动器下各进程启动时调用：rank 0 删除上次运行留下的全部完成标记，
+    所有进程在屏障处等到删除完成后才继续，此后出现的标记一定来自本次运行
+    """
+    import torch.distributed as dist
+
+    if rank == 0:
+        for k in range(num_shards):
+            marker = shard_output_path(output_path, k, num_shards) + ".done"
+            if os.path.exists(marker):
+                os.remove(marker)
+    dist.init_process_group("gloo")
+    dist.barrier()
+    dist.destroy_process_group()
+
+
+def wait_for_shards(output_path: str, num_shards: int, interval: float = 10.0) -> None:
+    """torchrun 等外部启动器下由 rank 0 调用：等待所有分片写出完成标记"""
+    markers = [shard_output_path(output_path, k, num_shards) + ".done" for k in range(num_shards)]
+    while True:
+        pending = [m for m in markers if not os.path.exists(m)]
+        if not pending:
+            return
+        print(f"[Merge] waiting for {len(pending)} shards")
+        time.sleep(interval)
+
+
 def infer(
     image_dir: str,
     output_path: str,
     llm_pipe,
     gen_cfg: GenerationConfig,
     num_threads: int = 8,
+    batch_size: int = 1,
+    max_batch_tokens: int = 0,
+    min_pixels: int = 200704,
+    max_pixels: int = 1003520,
+    resume: bool = False,
+    schedule: str = "cost",
+    latency_history: List[str] = (),
+    decode_workers: int = 4,
+    queue_size: int = 0,
+    pre_resize: bool = False,
+    prompt: str = "QwenVL HTML",
+    cache_path: Optional[str] = None,
+    cache_max_bytes: int = 20 << 30,
+    model_path: Optional[str] = None,
+    shard_index: int = 0,
+    num_shards: int = 1,
+    stream: bool = False,
+    guard_kwargs: Optional[Dict[str, Any]] = None,
+    trace_path: Optional[str] = None,
 ) -> None:
     """
-    遍历 image_dir 下所有图片，多线程推理并写入 output_path
+    遍历 image_dir 下所有图片，按 micro-batch 流水线推理并追加写入 output_path；
+    resume=True 时跳过 output_path 中已成功的图片；
+    schedule="cost" 时按估计代价从大到小提交；
+    已解码但未推理的 batch 最多 queue_size 个（0 表示与 num_threads 相同）；
+    pre_resize=True 时解码线程先按 smart_resize 缩放，bbox 再按真实比例映射回原图；
+    cache_path 非空时先查结果缓存（需提供 model_path 计算模型指纹），命中的图片直接后处理写出、不再推理；
+    num_shards>1 时只处理按代价划分后的第 shard_index 个分片；
+    stream=True 时流式推理，按 guard_kwargs 检测重复循环并提前结束、修复 HTML；
+    逐请求的阶段耗时汇总打印，trace_path 非空时另写出 JSONL trace 与汇总
     """
     img_paths = sorted(
         p
         for p in Path(image_dir).glob("*")
         if p.suffix.lower() in {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
     )
+    if num_shards > 1:
+        img_paths = select_shard(img_paths, shard_index, num_shards, min_pixels, max_pixels)
+        print(f"[Shard {shard_index}/{num_shards}] {len(img_paths)} images")
+
+    # 历史耗时须在截断输出文件之前读取（可能就是本次的 output_path）
+    history = load_latency_history(list(latency_history)) if schedule == "cost" else {}
+
+    if resume:
+        truncate_partial_line(output_path)
+        finished = load_finished(output_path)
+        img_paths = [p for p in img_paths if p.name not in finished]
+        print(f"[Resume] {len(finished)} finished, {len(img_paths)} to run")
+    else:
+        open(output_path, "w").close()
+
+    cache, cache_keys, cached_results, pending = None, {}, [], img_paths
+    if cache_path:
+        if model_path is None:
+            raise ValueError("cache_path requires model_path for the model fingerprint")
+        cache = ResultCache(
+            cache_path,
+            {
+                "prompt": prompt,
+                "gen_config": config_dict(gen_cfg),
+                "model": model_fingerprint(model_path),
+                "resize": [min_pixels, max_pixels] if pre_resize else None,
+                "stream": (guard_kwargs or {}) if stream else None,
+            },
+            max_bytes=cache_max_bytes,
+        )
+        pending = []
+        for p in tqdm(img_paths, desc="Cache lookup"):
+            cache_keys[p.name] = cache.key(file_sha256(p))
+            cached = cache.get(cache_keys[p.name])
+            if cached is None:
+                pending.append(p)
+                continue
+            # 缓存的是原始输出，按当前的后处理重新生成结果
+            res = {"image": p.name, "prompt": prompt, "answer": postprocess(cached["answer"], cached)}
+            if cached["latency"] is not None:
+                res["latency"] = cached["latency"]
+            if cached["stop_reason"]:
+                res["truncated"] = cached["stop_reason"]
+            cached_results.append(res)
+        print(f"[Cache] {len(cached_results)} hits, {len(pending)} to run")
+
+    # 只读图片头获取尺寸，估算每张图的视觉 token 数
+    items = []
+    for p in pending:
+        with Image.open(p) as im:
+            items.append((p, estimate_visual_tokens(im.size, min_pixels, max_pixels)))
+    if schedule == "cost":
+        # 有历史耗时的页面直接用历史值，只对其余页面估计墨迹占比；缩略图解码放在线程池中并行，不阻塞首个请求太久
+        need_ink = [p for p, _ in items if p.name not in history]
+        with ThreadPoolExecutor(max_workers=max(1, decode_workers)) as pool:
+            ink_of = dict(zip((p.name for p in need_ink), pool.map(ink_density, need_ink)))
+        inks = [ink_of.get(p.name, 0.0) for p, _ in items]
+        costs = estimate_costs(
+            [p.name for p, _ in items], [n for _, n in items], inks, history
+        )
+        items = schedule_longest_first(items, costs)
+    batches = make_batches(items, batch_size, max_batch_tokens)
+
+    # 分阶段流水线：解码线程池 -> 有界队列 -> 推理线程 -> 写出线程，
+    # 解码与生成重叠，内存占用只取决于队列容量而与目录大小无关
+    queue_size = queue_size or num_threads
+    decode_q = queue.Queue(maxsize=queue_size)
+    result_q = queue.Queue()
+    metrics = StageMetrics()
+    batch_iter = iter(batches)
+    iter_lock = threading.Lock()
+
+    def decode_stage() -> None:
+        while True:
+            with iter_lock:
+                batch = next(batch_iter, None)
+            if batch is None:
+                return
+            t0 = time.time()
+            items = []
+            for p in batch:
+                try:
+                    item = load_image(p, pre_resize, min_pixels, max_pixels)
+                    item["cache_key"] = cache_keys.get(p.name)
+                    items.append(item)
+                except Exception as exc:
+                    print(f"[{p.name}] decode error: {exc}")
+                    result_q.put([{"image": p.name, "prompt": prompt, "answer": ""}])
+            t1 = time.time()
+            for item in items:
+                item["timing"]["queued"] = t1
+            if items:
+                decode_q.put(items)
+            metrics.add("decode", busy=t1 - t0, blocked=time.time() - t1, n=len(batch))
+
+    def infer_stage() -> None:
+        while True:
+            t0 = time.time()
+            items = decode_q.get()
+            t1 = time.time()
+            if items is None:
+                metrics.add("infer", blocked=t1 - t0)
+                return
+            for item in items:
+                item["timing"]["queue_wait"] = t1 - item["timing"]["queued"]
+            if stream:
+                results = stream_worker(items, llm_pipe, gen_cfg, prompt, cache, guard_kwargs)
+            else:
+                results = batch_worker(items, llm_pipe, gen_cfg, prompt, cache)
+            metrics.add("infer", busy=time.time() - t1, blocked=t1 - t0, n=len(items))
+            for item, res in zip(items, results):
+                trace.add(item, res, len(items))
+            result_q.put(results)
+
+    def write_stage(writer: ResultWriter) -> None:
+        with tqdm(total=len(img_paths)) as pbar:
+            while True:
+                t0 = time.time()
+                results = result_q.get()
+                t1 = time.time()
+                if results is None:
+                    metrics.add("write", blocked=t1 - t0)
+                    return
+                for res in results:
+                    writer.write(res)
+                    if "truncated" in res:
+                        truncated[res["truncated"]] += 1
+                pbar.update(len(results))
+                metrics.add("write", busy=time.time() - t1, blocked=t1 - t0, n=len(results))
+
+    truncated = defaultdict(int)
+    t_start = time.time()
+    trace = RequestTrace(t_start)
+    stop = threading.Event()
+    monitor = threading.Thread(
+        target=metrics.monitor,
+        args=({"decode_q": decode_q, "result_q": result_q}, stop),
+        daemon=True,
+    )
+    decoders = [threading.Thread(target=decode_stage) for _ in range(decode_workers)]
+    inferers = [threading.Thread(target=infer_stage) for _ in range(num_threads)]
+    writer = ResultWriter(output_path)
+    write_thread = threading.Thread(target=write_stage, args=(writer,))
+    if cached_results:
+        result_q.put(cached_results)
+    try:
+        for t in [monitor, write_thread, *inferers, *decoders]:
+            t.start()
+        for t in decoders:
+            t.join()
+        for _ in inferers:
+            decode_q.put(None)
+        for t in inferers:
+            t.join()
+        result_q.put(None)
+        write_thread.join()
+    finally:
+        stop.set()
+        writer.close()
 
-    with open(output_path, "w", encoding="utf-8") as fout, ThreadPoolExecutor(
-        max_workers=num_threads
-    ) as pool:
-        futures = [pool.submit(worker, p, llm_pipe, gen_cfg) for p in img_paths]
-        for f in tqdm(as_completed(futures), total=len(futures)):
-            res = f.result()
-            if res:
-                fout.write(json.dumps(res, ensure_ascii=False) + "\n")
+    wall = time.time() - t_start
+    metrics.report(
+        wall,
+        workers={"decode": decode_workers, "infer": num_threads, "write": 1},
+        capacity={"decode_q": queue_size},
+    )
+    if stream:
+        reasons = ", ".join(f"{k} {v}" for k, v in sorted(truncated.items())) or "none"
+        print(f"[Stream] stopped early: {reasons}")
+    trace.report(wall, trace_path)
+    if cache is not None:
+        cache.report()
+        cache.close()
 
-    print(f"[Saved] {len(img_paths)} records -> {output_path}")
+    total = finalize_output(output_path)
+    print(f"[Saved] {total} records -> {output_path}")
 
 
 def main() -> None:
@@ -127,30 +1004,199 @@ def main() -> None:
         "--local_rank",
         type=int,
         default=int(os.environ.get("LOCAL_RANK", 0)),
-        help="For distributed launcher (ignored here)",
+        help="GPU index on this node when started by torchrun (default: $LOCAL_RANK)",
+    )
+    parser.add_argument(
+        "--gpus",
+        nargs="*",
+        default=[],
+        help="CUDA_VISIBLE_DEVICES for each worker process, e.g. --gpus 0 1 2 3 or --gpus 0,1 2,3",
+    )
+    parser.add_argument(
+        "--num_shards",
+        type=int,
+        default=0,
+        help="Data-parallel worker processes (0 = one per --gpus entry, or $WORLD_SIZE)",
+    )
+    parser.add_argument(
+        "--shard_index",
+        type=int,
+        default=None,
+        help="Run a single shard in this process (set by the launcher)",
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Use a stub pipeline instead of the model (checks sharding and merging on CPU)",
+    )
+    parser.add_argument(
+        "--dry_run_loop",
+        action="store_true",
+        help="With --dry_run, make the stub loop on odd-width pages (checks the --stream guard on CPU)",
+    )
+    parser.add_argument(
+        "--num_threads", type=int, default=16, help="Concurrent batch submissions"
+    )
+    parser.add_argument(
+        "--batch_size", type=int, default=1, help="Max images per micro-batch"
+    )
+    parser.add_argument(
+        "--max_batch_tokens",
+        type=int,
+        default=0,
+        help="Visual token budget per micro-batch (0 = unlimited)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Keep existing predict.jsonl and only run missing/failed images",
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=["cost", "name"],
+        default="cost",
+        help="Submit longest pages first (cost) or in filename order (name)",
+    )
+    parser.add_argument(
+        "--latency_history",
+        nargs="*",
+        default=[],
+        help="Previous predict.jsonl files whose latency fields refine the cost model",
+    )
+    parser.add_argument(
+        "--decode_workers", type=int, default=4, help="Image decode threads"
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=0,
+        help="Max decoded batches waiting for inference (0 = num_threads)",
+    )
+    parser.add_argument(
+        "--pre_resize",
+        action="store_true",
+        help="Resize images to the smart_resize grid on CPU before sending them",
+    )
+    parser.add_argument(
+        "--min_pixels", type=int, default=200704, help="smart_resize min_pixels"
+    )
+    parser.add_argument(
+        "--max_pixels", type=int, default=1003520, help="smart_resize max_pixels"
+    )
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=None,
+        help="SQLite result cache shared across runs (disabled if not set)",
+    )
+    parser.add_argument(
+        "--cache_max_gb", type=float, default=20.0, help="Result cache size limit in GB"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream generation, stop repetition loops early and repair the HTML",
+    )
+    parser.add_argument(
+        "--repeat_min_repeats",
+        type=int,
+        default=10,
+        help="Repeats of one fragment that count as a loop (--stream)",
+    )
+    parser.add_argument(
+        "--repeat_min_span",
+        type=int,
+        default=1000,
+        help="Minimum repeated characters that count as a loop (--stream)",
+    )
+    parser.add_argument(
+        "--trace_path",
+        type=str,
+        default=None,
+        help="Per-request timing trace jsonl (default: <output_base_dir>/trace.jsonl)",
     )
     args = parser.parse_args()
 
     image_dir = args.image_dir
 
+    # 输出文件
+    os.makedirs(args.output_base_dir, exist_ok=True)
+    output_file = os.path.join(args.output_base_dir, "predict.jsonl")
+    trace_file = args.trace_path or os.path.join(args.output_base_dir, "trace.jsonl")
+
+    # 数据并行：torchrun 等启动器按 RANK/WORLD_SIZE 分片、LOCAL_RANK 选卡；
+    # 否则 num_shards>1 时由本进程启动各分片子进程并在结束后合并
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    external_launcher = args.shard_index is None and world_size > 1
+    if external_launcher:
+        args.shard_index = int(os.environ.get("RANK", args.local_rank))
+        args.num_shards = world_size
+        visible = os.environ.get("CUDA_VISIBLE_DEVICES", "")
+        devices = visible.split(",") if visible else []
+        os.environ["CUDA_VISIBLE_DEVICES"] = devices[args.local_rank % len(devices)] if devices else str(args.local_rank)
+    num_shards = args.num_shards or max(len(args.gpus), 1)
+    if args.shard_index is None:
+        if num_shards > 1:
+            launch_shards(num_shards, args.gpus, output_file)
+            return
+        if args.gpus:
+            os.environ["CUDA_VISIBLE_DEVICES"] = args.gpus[0]
+    else:
+        output_file = shard_output_path(output_file, args.shard_index, num_shards)
+        trace_file = shard_output_path(trace_file, args.shard_index, num_shards)
+    # 外部启动器下各分片结束时写完成标记，rank 0 据此等待后合并
+    done_marker = output_file + ".done"
+    if external_launcher:
+        clear_shard_markers(os.path.join(args.output_base_dir, "predict.jsonl"), num_shards, args.shard_index)
+
     # 初始化 LMDeploy pipeline
-    print(f"[Load model] {args.model_path}")
-    llm_pipe = pipeline(args.model_path)
+    if args.dry_run:
+        print("[Load model] stub pipeline (dry run)")
+        llm_pipe = StubPipeline(loop=args.dry_run_loop)
+    else:
+        print(f"[Load model] {args.model_path}")
+        llm_pipe = pipeline(args.model_path)
     gen_cfg = GenerationConfig(
         max_new_tokens=8192, temperature=0.1, top_p=0.001, top_k=1
         # max_new_tokens=4096, temperature=0.1, top_p=0.001, top_k=1
     )
 
-    # 输出文件
-    os.makedirs(args.output_base_dir, exist_ok=True)
-    output_file = os.path.join(args.output_base_dir, "predict.jsonl")
-    open(output_file, "w").close()
-
     # 推理
-    infer(image_dir, output_file, llm_pipe, gen_cfg, num_threads=16)
+    infer(
+        image_dir,
+        output_file,
+        llm_pipe,
+        gen_cfg,
+        num_threads=args.num_threads,
+        batch_size=args.batch_size,
+        max_batch_tokens=args.max_batch_tokens,
+        min_pixels=args.min_pixels,
+        max_pixels=args.max_pixels,
+        resume=args.resume,
+        schedule=args.schedule,
+        latency_history=args.latency_history,
+        decode_workers=args.decode_workers,
+        queue_size=args.queue_size,
+        pre_resize=args.pre_resize,
+        cache_path=None if args.dry_run else args.cache_path,
+        cache_max_bytes=int(args.cache_max_gb * (1 << 30)),
+        model_path=args.model_path,
+        shard_index=args.shard_index or 0,
+        num_shards=num_shards if args.shard_index is not None else 1,
+        stream=args.stream,
+        guard_kwargs={"min_repeats": args.repeat_min_repeats, "min_span": args.repeat_min_span},
+        trace_path=trace_file,
+    )
 
     llm_pipe.close()
 
+    if external_launcher:
+        open(done_marker, "w").close()
+        if args.shard_index == 0:
+            merged = os.path.join(args.output_base_dir, "predict.jsonl")
+            wait_for_shards(merged, num_shards)
+            merge_shards(merged, num_shards)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
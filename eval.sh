@@ -5,16 +5,20 @@
 IMAGE_DIR="/root/autodl-tmp/DocParse-Challenge/datasets/vlm-challenge-B-complete/image/test_B"    # 图片目录
 OUTPUT_BASE_DIR="/root/autodl-tmp/DocParse-Challenge/datasets/vlm-challenge-B-complete/image/test_result"    # jsonl结果保存目录
 MERGE_MODEL_PATH="/root/autodl-tmp/DocParse-Challenge/fine_tuned_Qwen2.5-VL-7B-Instruct/checkpoint-2000/merged_Qwen2.5-VL-7B-Instruct"  # 合并的模型权重路径
+CACHE_PATH="/root/autodl-tmp/DocParse-Challenge/cache/results.db"    # 推理结果缓存（跨测试集共享）
 
 LOG_FILE="./logs/eval.log"
 touch "$LOG_FILE"
 
+GPUS="0"    # 每张卡一个推理进程，多卡如 GPUS="0 1 2 3"，结果按图片名合并为 predict.jsonl
+
 # 运行推理脚本
-export CUDA_VISIBLE_DEVICES=0
 python eval.py \
   --model_path "${MERGE_MODEL_PATH}" \
   --output_base_dir "${OUTPUT_BASE_DIR}" \
   --image_dir "${IMAGE_DIR}" \
+  --cache_path "${CACHE_PATH}" \
+  --gpus ${GPUS} \
   > "${LOG_FILE}" 2>&1
 
 echo "Finished"
\ No newline at end of file
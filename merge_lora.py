@@ -1,21 +1,43 @@
-from peft import PeftModel
 import os
+import re
+import json
+import shutil
 import random
+import tempfile
 import torch
-from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor
+from safetensors import safe_open
+from safetensors.torch import save_file
 import warnings
 
 warnings.filterwarnings("ignore")
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
+SAFE_INDEX_NAME = "model.safetensors.index.json"
+SAFE_WEIGHTS_NAME = "model.safetensors"
+ADAPTER_WEIGHTS_NAME = "adapter_model.safetensors"
+ADAPTER_CONFIG_NAME = "adapter_config.json"
+
+# adapter 权重键：base_model.model.<模块名>.<lora 矩阵>[.<adapter 名>][.weight]（Embedding 的 LoRA 没有 .weight）
+LORA_KEY_RE = re.compile(
+    r"^(?:base_model\.model\.)?(?P<module>.+?)\.(?P<kind>lora_A|lora_B|lora_embedding_A|lora_embedding_B)"
+    r"(?:\.[^.]+)?(?:\.weight)?$"
+)
+MODULES_TO_SAVE_RE = re.compile(
+    r"^(?:base_model\.model\.)?(?P<module>.+?)\.modules_to_save(?:\.[^.]+)?\.(?P<param>weight|bias)$"
+)
+
+
+def merge_lora(base_model_path, ckpt_root, merged_model_path,
+               attn_implementation="flash_attention_2", device_map="auto"):
+    from peft import PeftModel
+    from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor
 
-def merge_lora(base_model_path, ckpt_root, merged_model_path):
     base_model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
         base_model_path,
         torch_dtype=torch.bfloat16,
-        attn_implementation="flash_attention_2",
-        device_map="auto"
+        attn_implementation=attn_implementation,
+        device_map=device_map
     )
     model_with_adapter = PeftModel.from_pretrained(base_model, ckpt_root)
     merged_model = model_with_adapter.merge_and_unload()
@@ -27,9 +49,194 @@ def merge_lora(base_model_path, ckpt_root, merged_model_path):
     print(f"Merged model saved to {merged_model_path}")
 
 
+def candidate_weight_keys(module):
+    """
+    adapter 中的模块名 → 基座 safetensors 中可能的权重名。
+    新版 transformers 的模块名为 model.language_model.* / model.visual.*，
+    而 Qwen2.5-VL 的权重文件仍是 model.* / visual.*，两种写法都尝试
+    """
+    names = [module]
+    if module.startswith("model.language_model."):
+        names.append("model." + module[len("model.language_model."):])
+    elif module.startswith("model.visual."):
+        names.append(module[len("model."):])
+    elif module.startswith("visual."):
+        names.append("model." + module)
+    elif module.startswith("model."):
+        names.append("model.language_model." + module[len("model."):])
+    return names
+
+
+def _pattern_value(module, patterns, default):
+    """按 PEFT 的规则匹配 rank_pattern / alpha_pattern：模块名以该模式结尾即命中"""
+    for pattern, value in patterns.items():
+        if re.match(rf"(.*\.)?{pattern}$", module):
+            return value
+    return default
+
+
+def load_adapter(ckpt_root, base_keys):
+    """
+    读取 adapter 配置与权重，返回：
+    - lora: 基座权重名 → (A, B, scale, 是否转置 ΔW)
+    - replaced: 基座权重名 → modules_to_save 中的完整权重
+    """
+    with open(os.path.join(ckpt_root, ADAPTER_CONFIG_NAME), "r", encoding="utf-8") as f:
+        config = json.load(f)
+    if config.get("use_dora"):
+        raise NotImplementedError("DoRA adapters are not supported by the streaming merge, "
+                                  "set USE_STREAMING_MERGE = False")
+
+    lora_alpha = config["lora_alpha"]
+    alpha_pattern = config.get("alpha_pattern") or {}
+    use_rslora = config.get("use_rslora", False)
+    fan_in_fan_out = config.get("fan_in_fan_out", False)
+
+    pairs, replaced = {}, {}
+    with safe_open(os.path.join(ckpt_root, ADAPTER_WEIGHTS_NAME), framework="pt", device="cpu") as f:
+        for key in f.keys():
+            m = None if key.endswith(".bias") else LORA_KEY_RE.match(key)
+            if m:
+                pairs.setdefault(m.group("module"), {})[m.group("kind")] = f.get_tensor(key)
+                continue
+            m = MODULES_TO_SAVE_RE.match(key)
+            if m:
+                replaced[(m.group("module"), m.group("param"))] = f.get_tensor(key)
+                continue
+            raise NotImplementedError(f"Unsupported adapter tensor {key}, set USE_STREAMING_MERGE = False")
+
+    def resolve(module, param="weight"):
+        for name in candidate_weight_keys(module):
+            if f"{name}.{param}" in base_keys:
+                return f"{name}.{param}"
+        raise ValueError(f"Adapter module {module} has no matching {param} in the base model")
+
+    lora = {}
+    for module, mats in pairs.items():
+        is_embedding = "lora_embedding_A" in mats
+        A = mats["lora_embedding_A" if is_embedding else "lora_A"]
+        B = mats["lora_embedding_B" if is_embedding else "lora_B"]
+        if A.dim() != 2:
+            raise NotImplementedError(f"Only Linear/Embedding LoRA can be streamed, got {module} "
+                                      f"with {A.dim()}-d weights")
+        # 实际秩取自 A 的形状，自动覆盖 rank_pattern
+        r = A.shape[0]
+        alpha = _pattern_value(module, alpha_pattern, lora_alpha)
+        scale = alpha / r ** 0.5 if use_rslora else alpha / r
+        lora[resolve(module)] = (A, B, scale, is_embedding or fan_in_fan_out)
+    replaced = {resolve(module, param): t for (module, param), t in replaced.items()}
+    return lora, replaced
+
+
+def lora_delta(A, B, scale, transpose, dtype):
+    """ΔW = (alpha / r) · B @ A，与 PEFT 在 CPU 上的做法一致：fp32 计算后转回权重精度"""
+    delta = B.float() @ A.float()
+    if transpose:
+        delta = delta.T
+    return (delta * scale).to(dtype)
+
+
+def merge_tensor(key, tensor, lora, replaced):
+    """返回合并 adapter 后的权重（不修改传入的 tensor）；未被 adapter 命中时原样返回"""
+    if key in replaced:
+        tensor = replaced[key].to(tensor.dtype)
+    if key in lora:
+        A, B, scale, transpose = lora[key]
+        tensor = tensor + lora_delta(A, B, scale, transpose, tensor.dtype)
+    return tensor
+
+
+def copy_non_weight_files(base_model_path, merged_model_path):
+    """分片划分与基座相同，索引、config、tokenizer、processor 等非权重文件直接复制"""
+    for name in os.listdir(base_model_path):
+        src = os.path.join(base_model_path, name)
+        if name.endswith(".safetensors") or not os.path.isfile(src):
+            continue
+        shutil.copy2(src, os.path.join(merged_model_path, name))
+
+
+def base_shards(base_model_path):
+    """返回 (分片文件名列表, 权重名 → 分片文件名)"""
+    index_path = os.path.join(base_model_path, SAFE_INDEX_NAME)
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            weight_map = json.load(f)["weight_map"]
+        return sorted(set(weight_map.values())), weight_map
+
+    with safe_open(os.path.join(base_model_path, SAFE_WEIGHTS_NAME), framework="pt", device="cpu") as f:
+        weight_map = {key: SAFE_WEIGHTS_NAME for key in f.keys()}
+    return [SAFE_WEIGHTS_NAME], weight_map
+
+
+def streaming_merge_lora(base_model_path, ckpt_root, merged_model_path):
+    """
+    逐分片合并 LoRA：通过 mmap 读取基座的一个 safetensors 分片，
+    只对 adapter 命中的权重执行 W += (alpha/r) · B @ A，写出同名分片后再处理下一个。
+    峰值内存约为一个分片，不需要 GPU，也不需要实例化整个模型
+    """
+    shards, weight_map = base_shards(base_model_path)
+    lora, replaced = load_adapter(ckpt_root, set(weight_map))
+    os.makedirs(merged_model_path, exist_ok=True)
+
+    merged = set()
+    for shard in shards:
+        tensors = {}
+        with safe_open(os.path.join(base_model_path, shard), framework="pt", device="cpu") as f:
+            metadata = f.metadata() or {}
+            for key in f.keys():
+                tensors[key] = merge_tensor(key, f.get_tensor(key), lora, replaced).contiguous()
+                if key in lora or key in replaced:
+                    merged.add(key)
+        save_file(tensors, os.path.join(merged_model_path, shard), metadata={**metadata, "format": "pt"})
+        print(f"[Merged] {shard}: {sum(k in merged for k in tensors)} tensors updated")
+        del tensors
+
+    missing = (set(lora) | set(replaced)) - merged
+    if missing:
+        raise ValueError(f"{len(missing)} adapter targets were not found in any shard, e.g. {sorted(missing)[:3]}")
+
+    copy_non_weight_files(base_model_path, merged_model_path)
+
+    print(f"Merged model saved to {merged_model_path}")
+
+
+def compare_with_peft(base_model_path, ckpt_root, merged_model_path, atol=0.0):
+    """
+    校验流式合并结果与 PEFT merge_and_unload 一致（在 CPU 上运行，建议使用小尺寸随机权重模型）。
+    返回各权重的最大绝对误差
+    """
+    with tempfile.TemporaryDirectory() as peft_dir:
+        merge_lora(base_model_path, ckpt_root, peft_dir, attn_implementation="eager", device_map="cpu")
+        _, peft_map = base_shards(peft_dir)
+        _, stream_map = base_shards(merged_model_path)
+        if set(peft_map) != set(stream_map):
+            raise ValueError(f"Weight names differ: {sorted(set(peft_map) ^ set(stream_map))[:5]}")
+
+        diffs = {}
+        for key in sorted(peft_map):
+            with safe_open(os.path.join(peft_dir, peft_map[key]), framework="pt", device="cpu") as f:
+                expected = f.get_tensor(key)
+            with safe_open(os.path.join(merged_model_path, stream_map[key]), framework="pt", device="cpu") as f:
+                actual = f.get_tensor(key)
+            diffs[key] = (expected.float() - actual.float()).abs().max().item() if expected.numel() else 0.0
+
+    worst = max(diffs, key=diffs.get)
+    print(f"Compared {len(diffs)} tensors, max abs diff {diffs[worst]:.3g} ({worst})")
+    if diffs[worst] > atol:
+        raise AssertionError(f"Streaming merge differs from PEFT on {worst}: {diffs[worst]}")
+    return diffs
+
+
 if __name__ == "__main__":
     BASE_MODEL_PATH = "/root/autodl-tmp/DocParse-Challenge/base_models/Qwen2.5-VL-7B-Instruct"  # 基座模型路径
     ADAPTER_PATH = "/root/autodl-tmp/DocParse-Challenge/fine_tuned_Qwen2.5-VL-7B-Instruct/checkpoint-2000"  # 模型checkpoint路径
     MERGED_MODEL_PATH = "/root/autodl-tmp/DocParse-Challenge/fine_tuned_Qwen2.5-VL-7B-Instruct/checkpoint-2000/merged_Qwen2.5-VL-7B-Instruct"  # 合并模型输出路径
+    USE_STREAMING_MERGE = True  # True: 逐分片流式合并（仅需 CPU 与约一个分片的内存）；False: 加载整个模型用 PEFT 合并
+    VERIFY_WITH_PEFT = False  # 合并后再用 PEFT 合并一遍并逐权重比对（会加载整个模型，适合小模型验证）
 
-    merge_lora(BASE_MODEL_PATH, ADAPTER_PATH, MERGED_MODEL_PATH)
\ No newline at end of file
+    if USE_STREAMING_MERGE:
+        streaming_merge_lora(BASE_MODEL_PATH, ADAPTER_PATH, MERGED_MODEL_PATH)
+        if VERIFY_WITH_PEFT:
+            compare_with_peft(BASE_MODEL_PATH, ADAPTER_PATH, MERGED_MODEL_PATH)
+    else:
+        merge_lora(BASE_MODEL_PATH, ADAPTER_PATH, MERGED_MODEL_PATH)
@@ -0,0 +1,77 @@
+"""
+本地评测：按图片名对齐 predict.jsonl（eval.py 输出）与带标注的 eval.jsonl（image/prefix/suffix），逐页计算
+- 文本：非表格/图片块的文本按阅读顺序拼接后的归一化编辑距离（越小越好）；
+- 表格：预测表格与标注表格按 bbox IoU 匹配后的 TEDS（未匹配的标注表格记 0）；
+- 版面：bbox IoU 贪心一对一匹配的 precision/recall/F1，匹配块的类别准确率、平均 IoU 与块级文本编辑距离。
+逐页打分与汇总见 utils/page_score.py（与 utils/page_diff.py 共用），这里负责对齐、多进程并行，输出逐页报告（jsonl）与汇总。
+"""
+
+import os
+import json
+import argparse
+from multiprocessing import Pool
+from typing import Any, Dict, Optional
+
+from tqdm import tqdm
+
+from utils.page_score import load_records, score_page, summarize
+
+def evaluate(
+    pred_path: str,
+    label_path: str,
+    num_workers: int = os.cpu_count(),
+    iou_threshold: float = 0.5,
+    normalize: bool = True,
+    page_report: Optional[str] = None,
+) -> Dict[str, Any]:
+    """对齐并逐页打分，返回汇总；page_report 非空时写出逐页结果"""
+    preds = load_records(pred_path, "answer")
+    labels = load_records(label_path, "suffix")
+    tasks = [(image, preds.get(image, ""), gt, iou_threshold, normalize) for image, gt in sorted(labels.items())]
+
+    if num_workers > 1 and len(tasks) > 1:
+        with Pool(min(num_workers, len(tasks))) as pool:
+            pages = list(tqdm(pool.imap(score_page, tasks, chunksize=4), total=len(tasks), desc="Scoring"))
+    else:
+        pages = [score_page(t) for t in tqdm(tasks, desc="Scoring")]
+
+    if page_report:
+        with open(page_report, "w", encoding="utf-8") as f:
+            for page in pages:
+                f.write(json.dumps(page, ensure_ascii=False) + "\n")
+
+    summary = summarize(pages)
+    summary["extra_predictions"] = len(set(preds) - set(labels))
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Score predict.jsonl against a labeled eval.jsonl")
+    parser.add_argument("--pred_path", required=True, type=str, help="predict.jsonl written by eval.py")
+    parser.add_argument("--label_path", required=True, type=str, help="Labeled eval.jsonl (image/prefix/suffix)")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(), help="Scoring processes")
+    parser.add_argument("--iou_threshold", type=float, default=0.5, help="IoU threshold for block matching")
+    parser.add_argument("--no_normalize", action="store_true",
+                        help="Score raw HTML instead of clean_jsonl-normalized HTML")
+    parser.add_argument("--page_report", type=str, default=None, help="Write per-page scores to this jsonl")
+    parser.add_argument("--output", type=str, default=None, help="Write the summary to this json file")
+    args = parser.parse_args()
+
+    summary = evaluate(
+        args.pred_path,
+        args.label_path,
+        num_workers=args.num_workers,
+        iou_threshold=args.iou_threshold,
+        normalize=not args.no_normalize,
+        page_report=args.page_report,
+    )
+    for key, value in summary.items():
+        print(f"{key:<18} {value:.4f}" if isinstance(value, float) else f"{key:<18} {value}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"[Saved] summary -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+多 checkpoint 合并 + 评测扫描：
+1. 基座 safetensors 权重只加载一次，常驻内存且不被修改；
+2. 对每个 checkpoint-*，用基座权重 + 该 adapter 的 ΔW 生成合并分片，写入同一个临时模型目录；
+3. 用 eval.infer 推理，按标注打分，关闭 pipeline 释放显存后处理下一个 checkpoint；
+4. 输出每个 checkpoint 的指标与耗时表格（同时写入 sweep.jsonl）。
+注意：每个 checkpoint 都要重新构建一次 LMDeploy pipeline（读入合并后的权重、初始化引擎与 KV cache），
+这通常是除推理本身外最大的单项开销；LMDeploy 的 pipeline 没有稳定的原地替换权重接口，这里不做复用，
+构建耗时单独记为 load_s。
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+import warnings
+from typing import Any, Dict, List
+
+import numpy as np
+from safetensors import safe_open
+from safetensors.torch import save_file
+from lmdeploy import pipeline, GenerationConfig
+
+from eval import infer
+from merge_lora import base_shards, copy_non_weight_files, load_adapter, merge_tensor
+from score import evaluate
+
+warnings.filterwarnings("ignore")
+
+
+def find_checkpoints(ckpt_root: str, steps: List[int] = ()) -> List[str]:
+    """按步数排序列出 ckpt_root 下的 checkpoint-* 目录；steps 非空时只保留指定步数"""
+    found = []
+    for name in os.listdir(ckpt_root):
+        m = re.fullmatch(r"checkpoint-(\d+)", name)
+        if m and os.path.isdir(os.path.join(ckpt_root, name)):
+            found.append((int(m.group(1)), os.path.join(ckpt_root, name)))
+    if steps:
+        found = [(step, path) for step, path in found if step in set(steps)]
+    return [path for _, path in sorted(found)]
+
+
+def load_base_weights(base_model_path: str):
+    """一次性读入基座全部权重，返回 (分片列表, 权重名 → 分片, 权重名 → tensor)"""
+    shards, weight_map = base_shards(base_model_path)
+    tensors = {}
+    for shard in shards:
+        with safe_open(os.path.join(base_model_path, shard), framework="pt", device="cpu") as f:
+            for key in f.keys():
+                tensors[key] = f.get_tensor(key)
+    print(f"[Load base] {len(tensors)} tensors from {len(shards)} shards")
+    return shards, weight_map, tensors
+
+
+def write_merged(base, weight_map, shards, ckpt_path, merged_dir):
+    """基座权重 + adapter ΔW → merged_dir 下的同名分片；基座 tensor 不被修改，无需恢复"""
+    lora, replaced = load_adapter(ckpt_path, set(weight_map))
+    keys_of = {shard: [] for shard in shards}
+    for key, shard in weight_map.items():
+        keys_of[shard].append(key)
+    for shard in shards:
+        tensors = {key: merge_tensor(key, base[key], lora, replaced).contiguous() for key in keys_of[shard]}
+        save_file(tensors, os.path.join(merged_dir, shard), metadata={"format": "pt"})
+        del tensors
+    return len(lora) + len(replaced)
+
+
+def load_jsonl(path: str, key: str = "image") -> Dict[str, Dict[str, Any]]:
+    records = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                records[rec[key]] = rec
+    return records
+
+
+def latency_stats(pred_path: str) -> Dict[str, float]:
+    """predict.jsonl 中逐页 latency 的统计（整批耗时 batch_latency 不混入）"""
+    records = load_jsonl(pred_path).values()
+    latencies = np.array([rec["latency"] for rec in records if rec.get("latency") is not None])
+    if not len(latencies):
+        return {"pages": 0, "latency_mean": 0.0, "latency_p95": 0.0}
+    return {"pages": int(len(latencies)), "latency_mean": float(latencies.mean()),
+            "latency_p95": float(np.percentile(latencies, 95))}
+
+
+def trace_stats(trace_path: str) -> Dict[str, float]:
+    """eval.infer 写出的 trace 汇总（<trace>.summary.json）：吞吐、GPU 空闲占比与逐请求推理耗时分位数"""
+    summary_path = os.path.splitext(trace_path)[0] + ".summary.json"
+    summary = {}
+    if os.path.exists(summary_path):
+        with open(summary_path, "r", encoding="utf-8") as f:
+            summary = json.load(f)
+    infer = summary.get("infer", {})
+    return {"img_per_s": summary.get("images_per_s"), "gpu_idle": summary.get("gpu_idle"),
+            "infer_p50": infer.get("p50"), "infer_p95": infer.get("p95")}
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    columns = list(rows[0].keys())
+    cells = [[f"{row[c]:.4f}" if isinstance(row[c], float) else str(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Merge and evaluate a sweep of LoRA checkpoints")
+    parser.add_argument("--base_model_path", required=True, type=str, help="Base model directory")
+    parser.add_argument("--ckpt_root", required=True, type=str, help="Training output dir with checkpoint-*")
+    parser.add_argument("--steps", type=int, nargs="*", default=[], help="Only evaluate these steps")
+    parser.add_argument("--image_dir", required=True, type=str, help="Directory with images")
+    parser.add_argument("--label_path", type=str, default=None, help="Labeled eval.jsonl (image/prefix/suffix)")
+    parser.add_argument("--output_base_dir", required=True, type=str, help="Per-checkpoint predictions and summary")
+    parser.add_argument("--merged_dir", type=str, default=None,
+                        help="Scratch dir for the merged model (default: <output_base_dir>/merged)")
+    parser.add_argument("--num_threads", type=int, default=16, help="Concurrent batch submissions")
+    parser.add_argument("--batch_size", type=int, default=8, help="Max images per micro-batch")
+    parser.add_argument("--max_batch_tokens", type=int, default=10240, help="Visual token budget per micro-batch")
+    parser.add_argument("--pre_resize", action="store_true", help="Resize images on CPU before sending them")
+    parser.add_argument("--resume", action="store_true", help="Reuse existing per-checkpoint predictions")
+    args = parser.parse_args()
+
+    checkpoints = find_checkpoints(args.ckpt_root, args.steps)
+    if not checkpoints:
+        raise SystemExit(f"No checkpoint-* found in {args.ckpt_root}")
+    print(f"[Sweep] {len(checkpoints)} checkpoints: {[os.path.basename(c) for c in checkpoints]}")
+
+    merged_dir = args.merged_dir or os.path.join(args.output_base_dir, "merged")
+    os.makedirs(merged_dir, exist_ok=True)
+    copy_non_weight_files(args.base_model_path, merged_dir)
+    shards, weight_map, base = load_base_weights(args.base_model_path)
+
+    gen_cfg = GenerationConfig(max_new_tokens=8192, temperature=0.1, top_p=0.001, top_k=1)
+    summary_path = os.path.join(args.output_base_dir, "sweep.jsonl")
+    rows = []
+    for ckpt in checkpoints:
+        name = os.path.basename(ckpt)
+        out_dir = os.path.join(args.output_base_dir, name)
+        os.makedirs(out_dir, exist_ok=True)
+        pred_path = os.path.join(out_dir, "predict.jsonl")
+        trace_path = os.path.join(out_dir, "trace.jsonl")
+
+        t0 = time.time()
+        n_targets = write_merged(base, weight_map, shards, ckpt, merged_dir)
+        merge_s = time.time() - t0
+        print(f"[Merged] {name}: {n_targets} adapter targets in {merge_s:.1f}s")
+
+        # 每个 checkpoint 都重建引擎（见模块说明），耗时单独统计
+        t0 = time.time()
+        llm_pipe = pipeline(merged_dir)
+        load_s = time.time() - t0
+        print(f"[Load model] {name}: engine built in {load_s:.1f}s")
+
+        t0 = time.time()
+        try:
+            infer(
+                args.image_dir,
+                pred_path,
+                llm_pipe,
+                gen_cfg,
+                num_threads=args.num_threads,
+                batch_size=args.batch_size,
+                max_batch_tokens=args.max_batch_tokens,
+                resume=args.resume,
+                pre_resize=args.pre_resize,
+                trace_path=trace_path,
+            )
+        finally:
+            llm_pipe.close()
+        infer_s = time.time() - t0
+
+        row = {"checkpoint": name}
+        if args.label_path:
+            summary = evaluate(pred_path, args.label_path,
+                               page_report=os.path.join(out_dir, "score_pages.jsonl"))
+            row.update({k: summary[k] for k in ("overall", "text_ned", "table_teds", "layout_f1")})
+        row.update(latency_stats(pred_path))
+        row.update(trace_stats(trace_path))
+        row.update({"merge_s": merge_s, "load_s": load_s, "infer_s": infer_s})
+        rows.append(row)
+        with open(summary_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    print_table(rows)
+    print(f"[Saved] sweep summary -> {summary_path}")
+    if args.merged_dir is None:
+        shutil.rmtree(merged_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,16 @@ import argparse
 
 from peft import LoraConfig, TaskType, get_peft_model
 from trainer.dataset.preprocess import JSONLDataset
+from trainer.dataset.cache import CachedJSONLDataset
+from trainer.dataset.sampler import LengthGroupedBatchSampler, TokenBudgetCollator, load_lengths
+from torch.utils.data import DataLoader
 from swift.llm import (
     get_model_tokenizer, get_template, LazyLLMDataset
 )
 from swift.utils import get_logger, get_model_parameter_info
 from swift.tuners import LoraConfig
 from swift.trainers import TrainingArguments, Trainer
+from transformers import TrainerCallback
 
 warnings.filterwarnings("ignore")
 
@@ -72,23 +76,30 @@ logger.info(f'加载完 LoRA 后模型结构: {model}')
 model_parameter_info = get_model_parameter_info(model)
 logger.info(f'模型参数信息: {model_parameter_info}')
 
-# 加载数据集
-train_dataset = JSONLDataset(
-    data_path=config["dataset"]["train_data_path"],
-    jsonl_file_path=config["dataset"]["train_json_path"],
-    config_path=config_path,
-    format = "swift",
-    attr_name='data-bbox'
-)
-eval_dataset = JSONLDataset(
-    data_path=config["dataset"]["valid_data_path"],
-    jsonl_file_path=config["dataset"]["valid_json_path"],
-    config_path=config_path,
-    format = "swift",
-    attr_name='data-bbox'
-)
-train_dataset = LazyLLMDataset(train_dataset, template.encode, random_state=data_seed)
-eval_dataset = LazyLLMDataset(eval_dataset, template.encode, random_state=data_seed)
+# 加载数据集（配置了 *_cache_dir 时读取 trainer/dataset/cache.py 预先构建的编码缓存）
+def load_dataset(split):
+    cache_dir = config["dataset"].get(f"{split}_cache_dir")
+    if cache_dir:
+        return CachedJSONLDataset(
+            data_path=config["dataset"][f"{split}_data_path"],
+            jsonl_file_path=config["dataset"][f"{split}_json_path"],
+            config_path=config_path,
+            cache_dir=cache_dir,
+            template=template,
+            attr_name='data-bbox'
+        )
+    dataset = JSONLDataset(
+        data_path=config["dataset"][f"{split}_data_path"],
+        jsonl_file_path=config["dataset"][f"{split}_json_path"],
+        config_path=config_path,
+        format = "swift",
+        attr_name='data-bbox'
+    )
+    return LazyLLMDataset(dataset, template.encode, random_state=data_seed)
+
+
+train_dataset = load_dataset("train")
+eval_dataset = load_dataset("valid")
 
 training_args = TrainingArguments(
     num_train_epochs=config["hparams"]["num_train_epochs"],
@@ -126,13 +137,63 @@ training_args = TrainingArguments(
 
 model.enable_input_require_grads()
 
-trainer = Trainer(
+
+class BucketedTrainer(Trainer):
+    """训练集按 token 长度分桶、按 token 预算组 batch 的 Trainer"""
+
+    def __init__(self, *args, train_batch_sampler=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.train_batch_sampler = train_batch_sampler
+
+    def get_train_dataloader(self):
+        if self.train_batch_sampler is None:
+            return super().get_train_dataloader()
+        dataloader = DataLoader(
+            self.train_dataset,
+            batch_sampler=self.train_batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
+
+
+class SamplerEpochCallback(TrainerCallback):
+    """每个 epoch 开始时调用分桶采样器的 set_epoch（采样顺序只由 seed + epoch 决定）"""
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.sampler.set_epoch(int(state.epoch or 0))
+
+
+# 按长度分桶：需要 CachedJSONLDataset 的长度或 dataset.train_lengths_path 侧车文件
+data_collator = template.data_collator
+train_batch_sampler = None
+if config["hparams"].get("group_by_length"):
+    lengths = load_lengths(train_dataset, config["dataset"].get("train_lengths_path"))
+    if lengths is None:
+        raise ValueError("group_by_length requires dataset.train_cache_dir or dataset.train_lengths_path")
+    train_batch_sampler = LengthGroupedBatchSampler(
+        lengths,
+        max_tokens=config["hparams"].get("max_tokens_per_batch") or config["generate"]["max_length"],
+        max_batch_size=config["hparams"].get("max_batch_size", 64),
+        pad_multiple_of=config["hparams"]["pad_multiple_of"],
+        seed=data_seed,
+    )
+    data_collator = TokenBudgetCollator(template, pad_multiple_of=config["hparams"]["pad_multiple_of"])
+    logger.info(f'长度分桶: {train_batch_sampler.stats()}')
+
+trainer = BucketedTrainer(
     model=model,
     args=training_args,
-    data_collator=template.data_collator,
+    data_collator=data_collator,
     train_dataset=train_dataset,
     eval_dataset=eval_dataset,
     template=template,
+    train_batch_sampler=train_batch_sampler,
+    callbacks=[SamplerEpochCallback(train_batch_sampler)] if train_batch_sampler is not None else None,
 )
 
 trainer.train()
\ No newline at end of file
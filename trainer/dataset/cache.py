@@ -0,0 +1,318 @@
+import io
+import os
+import json
+import hashlib
+import argparse
+
+import numpy as np
+import yaml
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+
+from trainer.dataset.preprocess import JSONLDataset
+
+# 图像以无损 PNG 存储（压缩级别 1：编码快，体积约为原始 RGB 的 1/3~1/10，文档页面留白多时更小）
+IMAGE_FORMAT = "png"
+PNG_COMPRESS_LEVEL = 1
+
+# 索引中每条样本的记录：内容键、所在分片、图像/ token 在分片文件中的偏移与尺寸
+INDEX_DTYPE = np.dtype([
+    ("key", "S16"),
+    ("shard", "<i4"),
+    ("img_offset", "<i8"),
+    ("img_bytes", "<i8"),
+    ("height", "<i4"),
+    ("width", "<i4"),
+    ("tok_offset", "<i8"),
+    ("length", "<i4"),
+])
+
+
+def cache_fingerprint(config, template_name):
+    """缓存指纹：像素范围、max_length、模板与图像存储格式任一变化都会使整个缓存失效"""
+    payload = {
+        "min_pixels": config["generate"]["min_pixels"],
+        "max_pixels": config["generate"]["max_pixels"],
+        "max_length": config["generate"]["max_length"],
+        "template": template_name,
+        "image_format": IMAGE_FORMAT,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def image_stamp(data_path, line):
+    """jsonl 行所指图片的大小与修改时间（纳秒）；图片缺失时为 "missing"，该样本不会命中缓存"""
+    try:
+        st = os.stat(os.path.join(data_path, json.loads(line)["image"]))
+    except (OSError, ValueError, KeyError):
+        return b"missing"
+    return f"{st.st_size}:{st.st_mtime_ns}".encode()
+
+
+def line_key(fingerprint, line, stamp=b""):
+    """单条样本的内容键：缓存指纹 + jsonl 原始行 + 图片大小与修改时间（同名图片被替换时失效）"""
+    return hashlib.sha256(fingerprint.encode() + line.rstrip(b"\r\n") + b"\0" + stamp).digest()[:16]
+
+
+def read_line_keys(jsonl_file_path, fingerprint, data_path):
+    # 与 JSONLDataset 的 mmap 索引一致：跳过空行
+    with open(jsonl_file_path, "rb") as f:
+        return [line_key(fingerprint, line, image_stamp(data_path, line)) for line in f if line.rstrip(b"\n")]
+
+
+def encode_image(image):
+    """缩放后的 RGB 图像 → PNG 字节"""
+    buf = io.BytesIO()
+    image.save(buf, format=IMAGE_FORMAT, compress_level=PNG_COMPRESS_LEVEL)
+    return buf.getvalue()
+
+
+def _shard_path(cache_dir, kind, shard):
+    return os.path.join(cache_dir, f"{kind}-{shard:05d}.bin")
+
+
+def _identity(sample):
+    return sample
+
+
+class _EncodeDataset(Dataset):
+    """在 DataLoader worker 中完成 resize + bbox 改写 + template.encode"""
+
+    def __init__(self, dataset, template):
+        self.dataset = dataset
+        self.template = template
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        sample = self.dataset[idx]
+        encoded = self.template.encode(sample)
+        image = sample["images"][0].convert("RGB")
+        return (
+            idx,
+            encode_image(image),
+            image.size,
+            np.asarray(encoded["input_ids"], dtype=np.int32),
+            np.asarray(encoded["labels"], dtype=np.int32),
+        )
+
+
+def build_cache(data_path, jsonl_file_path, config_path, template, cache_dir,
+                shard_size=1000, num_workers=0, attr_name='data-bbox'):
+    """
+    离线物化训练样本：缩放后的图像（PNG）与编码后的 input_ids/labels 追加写入分片文件，
+    index.npy 记录每条样本的偏移，meta.json 记录缓存指纹
+    """
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    fingerprint = cache_fingerprint(config, template.template_meta.template_type)
+    keys = read_line_keys(jsonl_file_path, fingerprint, data_path)
+
+    dataset = JSONLDataset(
+        data_path=data_path,
+        jsonl_file_path=jsonl_file_path,
+        config_path=config_path,
+        format="swift",
+        attr_name=attr_name,
+    )
+    loader = DataLoader(
+        _EncodeDataset(dataset, template),
+        batch_size=None,
+        num_workers=num_workers,
+        collate_fn=_identity,
+    )
+
+    os.makedirs(cache_dir, exist_ok=True)
+    index = np.zeros(len(dataset), dtype=INDEX_DTYPE)
+    files = {}
+    img_offset = tok_offset = 0
+    shard = -1
+    img_total = 0
+    for n, (idx, png, (width, height), input_ids, labels) in enumerate(loader):
+        if n % shard_size == 0:
+            for fh in files.values():
+                fh.close()
+            shard += 1
+            files = {
+                kind: open(_shard_path(cache_dir, kind, shard), "wb")
+                for kind in ("images", "input_ids", "labels")
+            }
+            img_offset = tok_offset = 0
+
+        files["images"].write(png)
+        files["input_ids"].write(input_ids.tobytes())
+        files["labels"].write(labels.tobytes())
+        index[idx] = (keys[idx], shard, img_offset, len(png), height, width,
+                      tok_offset, len(input_ids))
+        img_offset += len(png)
+        img_total += len(png)
+        tok_offset += len(input_ids)
+    for fh in files.values():
+        fh.close()
+
+    np.save(os.path.join(cache_dir, "index.npy"), index)
+    # 按 jsonl 行序的 token 长度侧车文件，供 LengthGroupedBatchSampler 使用
+    np.save(os.path.join(cache_dir, "lengths.npy"), index["length"].astype(np.int64))
+    meta = {
+        "fingerprint": fingerprint,
+        "jsonl_file_path": os.path.abspath(jsonl_file_path),
+        "num_samples": len(dataset),
+        "num_shards": shard + 1,
+        "shard_size": shard_size,
+    }
+    with open(os.path.join(cache_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    raw = int((index["height"].astype(np.int64) * index["width"] * 3).sum())
+    print(f"Cached {len(dataset)} samples in {shard + 1} shards -> {cache_dir} "
+          f"(images {img_total / 2**30:.2f} GiB as PNG, {raw / 2**30:.2f} GiB as raw RGB)")
+
+
+class CachedJSONLDataset(Dataset):
+    """
+    读取 build_cache 生成的缓存，直接返回已编码样本（无需再套 LazyLLMDataset）。
+    每条 jsonl 行按内容键查找缓存；缺失或过期的行退回 JSONLDataset + template.encode 在线计算
+    """
+
+    def __init__(self,
+                data_path: str,
+                jsonl_file_path: str,
+                config_path: str,
+                cache_dir: str,
+                template,
+                attr_name='data-bbox',
+    ):
+        self.data_path = data_path
+        self.jsonl_file_path = jsonl_file_path
+        self.config_path = config_path
+        self.cache_dir = cache_dir
+        self.template = template
+        self.attr_name = attr_name
+
+        with open(config_path, "r", encoding="utf-8") as f:
+            self.config = yaml.safe_load(f)
+        with open(os.path.join(cache_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        fingerprint = cache_fingerprint(self.config, template.template_meta.template_type)
+        if meta["fingerprint"] != fingerprint:
+            raise ValueError(
+                f"Cache {cache_dir} was built with a different pixels/max_length/template "
+                f"configuration or image format, rebuild it with trainer/dataset/cache.py"
+            )
+
+        self.index = np.load(os.path.join(cache_dir, "index.npy"))
+        row_of_key = {key: row for row, key in enumerate(self.index["key"].tolist())}
+        keys = read_line_keys(jsonl_file_path, fingerprint, data_path)
+        self.rows = np.array([row_of_key.get(key, -1) for key in keys], dtype=np.int64)
+
+        self.num_stale = int((self.rows < 0).sum())
+        if self.num_stale:
+            print(f"{self.num_stale}/{len(self.rows)} samples missing or stale in "
+                  f"{cache_dir}, they will be encoded on the fly")
+        self._fallback = None
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def lengths(self):
+        """每条样本的 token 长度；过期样本用已缓存长度的中位数代替"""
+        lengths = np.where(self.rows >= 0, self.index["length"][self.rows], -1)
+        if self.num_stale:
+            known = lengths[lengths >= 0]
+            lengths[lengths < 0] = int(np.median(known)) if len(known) else 0
+        return lengths
+
+    def _memmap(self, kind, shard, dtype):
+        # 在各 DataLoader worker 内按需打开，避免把 memmap 对象 pickle 到子进程
+        key = (kind, shard)
+        if key not in self._shards:
+            self._shards[key] = np.memmap(_shard_path(self.cache_dir, kind, shard),
+                                          dtype=dtype, mode="r")
+        return self._shards[key]
+
+    def _encode_fallback(self, idx):
+        if self._fallback is None:
+            self._fallback = JSONLDataset(
+                data_path=self.data_path,
+                jsonl_file_path=self.jsonl_file_path,
+                config_path=self.config_path,
+                format="swift",
+                attr_name=self.attr_name,
+            )
+        return self.template.encode(self._fallback[idx])
+
+    def __getitem__(self, idx: int):
+        if idx < 0 or idx >= len(self.rows):
+            raise IndexError("Index out of range")
+
+        row = self.rows[idx]
+        if row < 0:
+            return self._encode_fallback(idx)
+
+        rec = self.index[row]
+        n = int(rec["length"])
+        img_offset, img_bytes, tok_offset = int(rec["img_offset"]), int(rec["img_bytes"]), int(rec["tok_offset"])
+        images = self._memmap("images", int(rec["shard"]), np.uint8)
+        with Image.open(io.BytesIO(images[img_offset:img_offset + img_bytes].tobytes())) as im:
+            image = np.asarray(im.convert("RGB"))
+        input_ids = self._memmap("input_ids", int(rec["shard"]), np.int32)
+        labels = self._memmap("labels", int(rec["shard"]), np.int32)
+
+        # 图像已在 smart_resize 网格上，处理器只做归一化与切 patch
+        image_inputs = self.template.processor.image_processor(images=[image], return_tensors="pt")
+        return {
+            "input_ids": input_ids[tok_offset:tok_offset + n].tolist(),
+            "labels": labels[tok_offset:tok_offset + n].tolist(),
+            "pixel_values": image_inputs["pixel_values"],
+            "image_grid_thw": image_inputs["image_grid_thw"],
+        }
+
+
+def main():
+    from swift.llm import get_model_tokenizer, get_template
+
+    parser = argparse.ArgumentParser(description="Build the offline training cache")
+    parser.add_argument("--config", type=str, required=True, help="Path to YAML config file")
+    parser.add_argument("--shard_size", type=int, default=1000, help="Samples per shard")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+
+    # 只需要 tokenizer/processor，不加载模型权重
+    _, processor = get_model_tokenizer(
+        config["model"]["model_path"],
+        load_model=False,
+        MIN_PIXELS=config["generate"]["min_pixels"],
+        MAX_PIXELS=config["generate"]["max_pixels"]
+    )
+    template = get_template(
+        processor.model_meta.template,
+        processor,
+        default_system="You are a helpful assistant.",
+        max_length=config["generate"]["max_length"],
+        truncation_strategy='right',
+        max_pixels=config["generate"]["max_pixels"]
+    )
+    template.set_mode('train')
+
+    for split in ("train", "valid"):
+        cache_dir = config["dataset"].get(f"{split}_cache_dir")
+        if not cache_dir:
+            continue
+        build_cache(
+            data_path=config["dataset"][f"{split}_data_path"],
+            jsonl_file_path=config["dataset"][f"{split}_json_path"],
+            config_path=args.config,
+            template=template,
+            cache_dir=cache_dir,
+            shard_size=args.shard_size,
+            num_workers=config["max_workers"],
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+LengthGroupedBatchSampler 与 TokenBudgetCollator 的 CPU 自检：用随机长度与一个只做补齐的玩具 template，
+核对每个 epoch 恰好覆盖全部样本一次、每个 batch 补齐后不超过 token 预算与样本数上限、最长样本在首个 batch、
+同一 epoch 重复迭代顺序不变而 set_epoch 换 epoch 后顺序改变，以及 collator 输出长度对齐到 pad_multiple_of。
+任一不符时打印原因并以非零状态退出。
+
+用法: python check_sampler.py [样本数]
+"""
+
+import sys
+
+import numpy as np
+import torch
+
+from sampler import LengthGroupedBatchSampler, TokenBudgetCollator, padded_tokens
+
+
+class ToyTemplate:
+    """只把 input_ids 右补齐到 padding_to 的玩具 template，接口与 swift template.data_collator 一致"""
+
+    pad_token_id = 0
+
+    def data_collator(self, batch, padding_to=None):
+        max_len = padding_to or max(len(x["input_ids"]) for x in batch)
+        input_ids = torch.full((len(batch), max_len), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), max_len), dtype=torch.long)
+        for row, x in enumerate(batch):
+            input_ids[row, :len(x["input_ids"])] = torch.tensor(x["input_ids"], dtype=torch.long)
+            attention_mask[row, :len(x["input_ids"])] = 1
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+def check(n=1000, max_tokens=8192, max_batch_size=16, pad_multiple_of=16, seed=0):
+    """返回不符的检查项个数"""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(50, 4000, size=n)
+    sampler = LengthGroupedBatchSampler(lengths, max_tokens=max_tokens, max_batch_size=max_batch_size,
+                                        pad_multiple_of=pad_multiple_of, seed=seed)
+    failed = 0
+
+    def expect(ok, msg):
+        nonlocal failed
+        if not ok:
+            failed += 1
+            print(f"❌ {msg}")
+
+    epoch0 = list(sampler)
+    flat = sorted(i for b in epoch0 for i in b)
+    expect(flat == list(range(n)), "一个 epoch 没有恰好覆盖全部样本一次")
+    expect(len(sampler) == len(epoch0), f"len(sampler)={len(sampler)}，实际 {len(epoch0)} 个 batch")
+    over = [b for b in epoch0 if len(b) > 1
+            and padded_tokens(int(lengths[b].max()), len(b), pad_multiple_of) > max_tokens]
+    expect(not over, f"{len(over)} 个 batch 补齐后超过 max_tokens={max_tokens}")
+    expect(max(len(b) for b in epoch0) <= max_batch_size, f"batch 样本数超过 max_batch_size={max_batch_size}")
+    expect(int(np.argmax(lengths)) in epoch0[0], "全局最长样本不在首个 batch")
+
+    expect(list(sampler) == epoch0, "未调用 set_epoch 时重复迭代的顺序发生了变化")
+    sampler.set_epoch(1)
+    epoch1 = list(sampler)
+    expect(epoch1 != epoch0, "set_epoch(1) 后顺序没有变化")
+    sampler.set_epoch(0)
+    expect(list(sampler) == epoch0, "set_epoch(0) 没有复现第 0 个 epoch 的顺序")
+
+    collator = TokenBudgetCollator(ToyTemplate(), pad_multiple_of=pad_multiple_of)
+    for b in epoch1[:20]:
+        out = collator([{"input_ids": list(range(1, int(lengths[i]) + 1))} for i in b])
+        width = out["input_ids"].shape[1]
+        expect(width % pad_multiple_of == 0 and width >= int(lengths[b].max()),
+               f"collator 输出长度 {width} 未对齐到 {pad_multiple_of} 或短于最长样本")
+        expect(int(out["attention_mask"].sum()) == int(lengths[b].sum()), "attention_mask 与样本长度不符")
+
+    stats = sampler.stats()
+    print(f"[Check] {n} 条样本 → {stats['num_batches']} 个 batch，有效 token 占比 {stats['efficiency']:.1%}，"
+          f"{failed} 项不符")
+    return failed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    if check(n):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import io
 import os
 import re
 import json
+import mmap
 import random
 from PIL import Image
 import numpy as np
@@ -14,6 +15,8 @@ import yaml
 import torch
 import torch.distributed as dist
 
+from utils.bbox import rescale_bboxes
+
 class JSONLDataset(Dataset):
     def __init__(self, 
                 data_path: str,
@@ -22,10 +25,18 @@ class JSONLDataset(Dataset):
                 return_image_path = False, 
                 format = "normal", 
                 attr_name='data-bbox',
+                index_mode = "mmap",
     ):  
         self.data_path = data_path
         self.jsonl_file_path = jsonl_file_path
-        self.entries = self._load_entries()
+        self.index_mode = index_mode
+        self._mm = None
+        if index_mode == "mmap":
+            # 只保存每行的字节偏移，__getitem__ 时再解析，DataLoader worker 之间不会因引用计数触发写时复制
+            self.entries = None
+            self.offsets, self.ends = self._build_offsets()
+        else:
+            self.entries = self._load_entries()
         self.return_image_path = return_image_path
         self.format = format
         self.SYSTEM_MESSAGE = """You are a helpful assistant"""
@@ -44,14 +55,45 @@ class JSONLDataset(Dataset):
 
         return entries
 
+    def _build_offsets(self, chunk_size=64 << 20):
+        """用 NumPy 在 mmap 上按 chunk_size 分块定位换行符（临时数组只有一块大小），返回非空行的起止字节偏移数组"""
+        with open(self.jsonl_file_path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size == 0:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            parts = []
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for pos in range(0, size, chunk_size):
+                    buf = np.frombuffer(mm, dtype=np.uint8, count=min(chunk_size, size - pos), offset=pos)
+                    parts.append(np.flatnonzero(buf == ord('\n')) + pos)
+                    del buf
+            newlines = np.concatenate(parts)
+
+        starts = np.concatenate(([0], newlines + 1)).astype(np.int64)
+        ends = np.concatenate((newlines, [size])).astype(np.int64)
+        keep = ends > starts
+        return starts[keep], ends[keep]
+
+    def _read_entry(self, idx):
+        # mmap 不能被 pickle，在各 DataLoader worker 内首次访问时再打开
+        if self._mm is None:
+            with open(self.jsonl_file_path, 'rb') as file:
+                self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return json.loads(self._mm[self.offsets[idx]:self.ends[idx]])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mm'] = None
+        return state
+
     def __len__(self):
-        return len(self.entries)
+        return len(self.offsets) if self.entries is None else len(self.entries)
 
     def __getitem__(self, idx: int):
-        if idx < 0 or idx >= len(self.entries):
+        if idx < 0 or idx >= len(self):
             raise IndexError("Index out of range")
 
-        entry = self.entries[idx]
+        entry = self._read_entry(idx) if self.entries is None else self.entries[idx]
         image_name = entry['image'] 
         image_path = os.path.join(self.data_path, image_name)
         image = Image.open(image_path)  
@@ -71,7 +113,7 @@ class JSONLDataset(Dataset):
         
         try:
             # 按照图像相同缩放比例缩放data-bbox
-            text = self.modify_bboxes(text, (orig_width, orig_height), (resized_width, resized_height), attr_name=self.attr_name)
+            text = rescale_bboxes(text, (orig_width, orig_height), (resized_width, resized_height), attr_name=self.attr_name, rounding="trunc")
         except Exception as e:
             print(f"Failed to modify bboxes: {e}")
 
@@ -79,24 +121,6 @@ class JSONLDataset(Dataset):
         data = self.swift_format_data(image, entry, text, prompt) if self.format == "swift" else self.format_data(image, entry, text, prompt)
         return (data, image_path) if self.return_image_path else data
     
-    def modify_bboxes(self, input_str, image_size, resized_image_size, attr_name='data-bbox'):
-        """将 HTML 中的 bbox 位置按缩放比例调整"""
-        img_w, img_h = image_size
-        resized_w, resized_h = resized_image_size
-        def repl(match):
-            # 提取匹配到的四个数字
-            x1, y1, x2, y2 = map(int, match.group(1).split())
-
-            bbox = [x1, y1, x2, y2]
-            new_bbox = bbox / np.array([img_w, img_h, img_w, img_h]) * np.array([resized_w, resized_h, resized_w, resized_h])
-            x1, y1, x2, y2 = new_bbox
-
-            # 返回修改后的字符串
-            return f'{attr_name}=\"{int(x1)} {int(y1)} {int(x2)} {int(y2)}\"'
-
-        # 使用正则表达式查找所有符合模式的部分并进行替换
-        return re.sub(rf'{attr_name}=\"([^"]+)\"', repl, input_str)
-    
     def swift_format_data(self, image, entry, text, prompt):
         return {
                 "messages": [
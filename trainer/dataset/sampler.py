@@ -0,0 +1,120 @@
+import math
+import random
+
+import numpy as np
+from torch.utils.data import Sampler
+
+
+def load_lengths(dataset, lengths_path=None):
+    """
+    读取每条样本的 token 长度：优先使用数据集自带的 lengths（CachedJSONLDataset），
+    否则读取 .npy 侧车文件（如缓存目录下的 lengths.npy）
+    """
+    lengths = getattr(dataset, "lengths", None)
+    if lengths is None and lengths_path:
+        lengths = np.load(lengths_path)
+    if lengths is None:
+        return None
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if len(lengths) != len(dataset):
+        raise ValueError(f"Got {len(lengths)} lengths for a dataset of {len(dataset)} samples")
+    return lengths
+
+
+def padded_tokens(max_len, n, pad_multiple_of=1):
+    """一个 batch 按最长样本补齐（并对齐到 pad_multiple_of）后的总 token 数"""
+    return math.ceil(max_len / pad_multiple_of) * pad_multiple_of * n
+
+
+class LengthGroupedBatchSampler(Sampler):
+    """
+    按长度分桶的动态 batch 采样器：
+    1. 每个 epoch 用 seed + epoch 打乱全部样本，切成 mega_batch_size 大小的组；
+    2. 组内按长度降序排列，贪心装入 batch，补齐后的 token 数不超过 max_tokens、样本数不超过 max_batch_size；
+    3. 打乱 batch 顺序，但把包含全局最长样本的 batch 放在最前，尽早暴露显存峰值。
+    长度相近的样本落在同一 batch，补齐浪费小，每步 token 数也更稳定。
+    与 DistributedSampler 相同，顺序只由 seed + epoch 决定，迭代本身不改变 epoch，换 epoch 需调用 set_epoch
+    """
+
+    def __init__(self, lengths, max_tokens, max_batch_size=64, mega_batch_size=256,
+                 pad_multiple_of=1, shuffle=True, seed=42):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.mega_batch_size = mega_batch_size
+        self.pad_multiple_of = pad_multiple_of
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._batches = None
+
+    def set_epoch(self, epoch):
+        if epoch != self.epoch:
+            self.epoch = epoch
+            self._batches = None
+
+    def _build_batches(self):
+        rng = random.Random(self.seed + self.epoch)
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(indices)
+
+        batches = []
+        for start in range(0, len(indices), self.mega_batch_size):
+            group = sorted(indices[start:start + self.mega_batch_size],
+                           key=lambda i: -self.lengths[i])
+            batch, batch_max = [], 0
+            for i in group:
+                new_max = max(batch_max, int(self.lengths[i]))
+                over_budget = padded_tokens(new_max, len(batch) + 1, self.pad_multiple_of) > self.max_tokens
+                if batch and (over_budget or len(batch) >= self.max_batch_size):
+                    batches.append(batch)
+                    batch, new_max = [], int(self.lengths[i])
+                batch.append(i)
+                batch_max = new_max
+            if batch:
+                batches.append(batch)
+
+        if self.shuffle and batches:
+            longest = max(range(len(batches)), key=lambda b: self.lengths[batches[b][0]])
+            first = batches.pop(longest)
+            rng.shuffle(batches)
+            batches.insert(0, first)
+        return batches
+
+    def __iter__(self):
+        if self._batches is None:
+            self._batches = self._build_batches()
+        yield from self._batches
+
+    def __len__(self):
+        if self._batches is None:
+            self._batches = self._build_batches()
+        return len(self._batches)
+
+    def stats(self):
+        """补齐后的 token 总数与有效 token 占比，用于评估分桶效果"""
+        batches = self._batches if self._batches is not None else self._build_batches()
+        real = int(self.lengths.sum())
+        padded = sum(
+            padded_tokens(int(self.lengths[b].max()), len(b), self.pad_multiple_of)
+            for b in batches
+        )
+        return {"num_batches": len(batches), "tokens": real, "padded_tokens": padded,
+                "efficiency": real / padded if padded else 1.0}
+
+
+class TokenBudgetCollator:
+    """
+    配合 LengthGroupedBatchSampler 使用：把按 token 预算装好的动态 batch 交给 template.data_collator，
+    序列长度补齐到 pad_multiple_of 的倍数，减少不同形状 batch 带来的 kernel / 显存分配抖动
+    """
+
+    def __init__(self, template, pad_multiple_of=16):
+        self.template = template
+        self.pad_multiple_of = pad_multiple_of
+
+    def __call__(self, batch):
+        max_len = max(len(x["input_ids"]) for x in batch)
+        padding_to = math.ceil(max_len / self.pad_multiple_of) * self.pad_multiple_of
+        return self.template.data_collator(batch, padding_to=padding_to)
@@ -0,0 +1,193 @@
+"""
+HTML 中 bbox 属性（如 data-bbox="x1 y1 x2 y2"）的工具：
+- 批量缩放，训练数据预处理（trainer/dataset/preprocess.py）与推理后处理（eval.py）共用；
+- 版面块扫描与 IoU 匹配，本地评测（score.py）使用。
+"""
+
+import re
+import html
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+_NUM = r"\s*(-?\d+(?:\.\d*)?)"
+
+TAG_RE = re.compile(r"<(/?)([A-Za-z][\w-]*)([^>]*?)(/?)>")
+CLASS_RE = re.compile(r'class="([^"]*)"')
+VOID_TAGS = {"br", "hr", "img", "input", "meta", "link", "col", "area", "base", "wbr", "source"}
+
+
+@lru_cache(maxsize=None)
+def _bbox_pattern(attr_name: str) -> "re.Pattern[str]":
+    """按属性名缓存编译好的正则，只匹配恰好包含 4 个数字的 bbox"""
+    return re.compile(rf'{re.escape(attr_name)}="{_NUM}{_NUM}{_NUM}{_NUM}\s*"')
+
+
+def rescale_bboxes(
+    text: str,
+    src_size: Tuple[int, int],
+    dst_size: Tuple[int, int],
+    attr_name: str = "data-bbox",
+    rounding: str = "round",
+    clamp: bool = False,
+) -> str:
+    """
+    将 text 中所有 bbox 从 src_size (w, h) 坐标系缩放到 dst_size (w, h) 坐标系。
+
+    一次正则扫描取出全部 bbox，作为 (N, 4) 数组统一缩放后再拼回字符串：
+    - rounding="round"：四舍五入（与 NumPy 一致，.5 取偶）；"trunc"：向零截断（等价于 int()）
+    - clamp=True（可选，默认关闭，与原 modify_bboxes 一致）：缩放结果裁剪到 [0, dst_w] × [0, dst_h]
+    - 不是 4 个数字的 bbox 属性原样保留
+    """
+    if f'{attr_name}="' not in text:
+        return text
+
+    matches = list(_bbox_pattern(attr_name).finditer(text))
+    if not matches:
+        return text
+
+    src_w, src_h = src_size
+    dst_w, dst_h = dst_size
+    boxes = np.array([m.groups() for m in matches], dtype=np.float64)
+    boxes = boxes / np.array([src_w, src_h] * 2) * np.array([dst_w, dst_h] * 2)
+
+    if rounding == "round":
+        boxes = np.rint(boxes)
+    elif rounding == "trunc":
+        boxes = np.trunc(boxes)
+    else:
+        raise ValueError(f"Unknown rounding mode: {rounding}")
+    if clamp:
+        boxes = np.clip(boxes, 0, [dst_w, dst_h, dst_w, dst_h])
+    boxes = boxes.astype(np.int64).tolist()
+
+    pieces, last = [], 0
+    for m, (x1, y1, x2, y2) in zip(matches, boxes):
+        pieces.append(text[last:m.start()])
+        pieces.append(f'{attr_name}="{x1} {y1} {x2} {y2}"')
+        last = m.end()
+    pieces.append(text[last:])
+    return "".join(pieces)
+
+
+def iter_blocks(text: str, attr_name: str = "data-bbox") -> List[Dict[str, Any]]:
+    """
+    扫描 <body> 的直接子元素（没有 <body> 时为顶层元素）中带 bbox 属性的版面块，按出现顺序返回：
+    {"category": 标签名或 div 的 class（如 "p"、"h2"、"table"）, "bbox": [x1, y1, x2, y2] 或 None,
+     "html": 块内 HTML, "text": 去掉标签后的文本}
+    """
+    attr_re = _bbox_pattern(attr_name)
+    blocks = []
+    base_depth = 0
+    depth = 0
+    start = None
+    for m in TAG_RE.finditer(text):
+        closing, tag, attrs, self_closing = m.group(1), m.group(2).lower(), m.group(3), m.group(4)
+        if tag == "body":
+            depth = max(depth - 1, 0) if closing else depth + 1
+            base_depth = depth
+            continue
+        if tag in VOID_TAGS or self_closing:
+            if depth == base_depth and attr_name in attrs:
+                blocks.append(_make_block(tag, attrs, "", attr_re))
+            continue
+        if closing:
+            depth = max(depth - 1, 0)
+            if start is not None and depth == base_depth:
+                open_tag, open_attrs, inner_start = start
+                blocks.append(_make_block(open_tag, open_attrs, text[inner_start:m.start()], attr_re))
+                start = None
+        else:
+            if depth == base_depth and start is None and attr_name in attrs:
+                start = (tag, attrs, m.end())
+            depth += 1
+    return blocks
+
+
+def _make_block(tag, attrs, inner, attr_re):
+    bbox = attr_re.search(attrs)
+    cls = CLASS_RE.search(attrs)
+    return {
+        "category": cls.group(1).split()[0] if tag == "div" and cls and cls.group(1).strip() else tag,
+        "bbox": [float(v) for v in bbox.groups()] if bbox else None,
+        "html": inner,
+        "text": html.unescape(TAG_RE.sub("", inner)).strip(),
+    }
+
+
+def iter_tag_boxes(
+    text: str,
+    tags: Tuple[str, ...] = ("h2", "p", "div"),
+    attr_names: Tuple[str, ...] = ("data-bbox", "db"),
+) -> List[Tuple[str, List[float], bool]]:
+    """
+    不构建 DOM，扫描任意深度的指定标签，按开始标签出现顺序返回 [(类别, [x1, y1, x2, y2], 是否含文本)]；
+    类别为标签名或 div 的第一个 class，没有 bbox 属性的标签跳过；用于可视化时快速画框
+    """
+    patterns = [_bbox_pattern(name) for name in attr_names]
+    boxes, stack = [], []
+
+    def has_text(inner):
+        return bool(html.unescape(TAG_RE.sub("", inner)).strip())
+
+    for m in TAG_RE.finditer(text):
+        closing, tag, attrs, self_closing = m.group(1), m.group(2).lower(), m.group(3), m.group(4)
+        if tag in VOID_TAGS or self_closing:
+            continue
+        if not closing:
+            entry = None
+            if tag in tags:
+                bbox = next((b for b in (p.search(attrs) for p in patterns) if b), None)
+                if bbox:
+                    cls = CLASS_RE.search(attrs)
+                    category = cls.group(1).split()[0] if tag == "div" and cls and cls.group(1).strip() else tag
+                    entry = len(boxes)
+                    boxes.append([category, [float(v) for v in bbox.groups()], False])
+            stack.append((tag, entry, m.end()))
+            continue
+        # 弹出到最近的同名开始标签，容忍未闭合的子标签
+        for k in range(len(stack) - 1, -1, -1):
+            if stack[k][0] == tag:
+                for _, entry, start in stack[k:]:
+                    if entry is not None:
+                        boxes[entry][2] = has_text(text[start:m.start()])
+                del stack[k:]
+                break
+    for _, entry, start in stack:
+        if entry is not None:
+            boxes[entry][2] = has_text(text[start:])
+    return [tuple(b) for b in boxes]
+
+
+def iou_matrix(boxes_a, boxes_b) -> np.ndarray:
+    """(N, 4) 与 (M, 4) 的 x1y1x2y2 框两两 IoU，返回 (N, M) 矩阵"""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    if not len(a) or not len(b):
+        return np.zeros((len(a), len(b)))
+    ix1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    iy2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area_a = np.clip(a[:, 2] - a[:, 0], 0, None) * np.clip(a[:, 3] - a[:, 1], 0, None)
+    area_b = np.clip(b[:, 2] - b[:, 0], 0, None) * np.clip(b[:, 3] - b[:, 1], 0, None)
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def match_boxes(iou: np.ndarray, threshold: float = 0.5) -> List[Tuple[int, int]]:
+    """按 IoU 从大到小贪心一对一匹配，返回 IoU ≥ threshold 的 (行, 列) 对"""
+    if not iou.size:
+        return []
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind="stable")
+    used_rows, used_cols, pairs = set(), set(), []
+    for k in order:
+        r, c = int(rows[k]), int(cols[k])
+        if r not in used_rows and c not in used_cols:
+            used_rows.add(r)
+            used_cols.add(c)
+            pairs.append((r, c))
+    return pairs
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+对比 clean_jsonl 的单遍实现 normalize_html 与多遍参照实现 clean_text_multipass：
+1. 逐条校验两者输出逐字节一致（不一致时打印首个差异位置并以非零状态退出；固定期望输出的 golden 用例见 check_clean_jsonl.py）；
+2. 分别统计吞吐（MB/s、条/s）。
+
+用法: python bench_clean_jsonl.py 输入文件 [字段名]
+      python bench_clean_jsonl.py --synthetic 条数   # 生成含大表格的合成数据
+"""
+
+import json
+import random
+import sys
+import time
+
+from clean_jsonl import clean_text_multipass, normalize_html
+
+
+def synthetic_records(n, seed=0):
+    """生成含段落、Markdown 标记与大小不一表格的合成页面"""
+    rng = random.Random(seed)
+    words = ["中文", "文本", "Hello", "world", "123", "，", "。", "（注）", " ", "**粗体**", "# 标题", "1. ", "&nbsp;"]
+    records = []
+    for i in range(n):
+        parts = []
+        for _ in range(rng.randint(2, 10)):
+            if rng.random() < 0.3:
+                rows = []
+                for _ in range(rng.randint(2, 40)):
+                    cells = "".join(
+                        f"<{tag}>{rng.choice(words) if rng.random() < 0.8 else ' '}</{tag}>"
+                        for tag in rng.choices(["td", "th"], [9, 1], k=rng.randint(2, 12))
+                    )
+                    rows.append(f"<tr>{cells}</tr>")
+                parts.append(f'<div class="table" data-bbox="1 2 3 4"><table><thead>{rows[0]}</thead>'
+                             f'<tbody>{"".join(rows[1:])}</tbody></table></div>')
+            else:
+                text = "".join(rng.choice(words) for _ in range(rng.randint(5, 60)))
+                parts.append(f'<p data-bbox="1 2 3 4">{text}</p>')
+        records.append("<body>" + "".join(parts) + "</body>")
+    return records
+
+
+def first_diff(a, b):
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return min(len(a), len(b))
+
+
+def bench(fn, texts):
+    t0 = time.perf_counter()
+    outputs = [fn(t) for t in texts]
+    return outputs, time.perf_counter() - t0
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    if sys.argv[1] == "--synthetic":
+        texts = synthetic_records(int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
+    else:
+        field = sys.argv[2] if len(sys.argv) > 2 else "suffix"
+        texts = []
+        with open(sys.argv[1], "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    value = json.loads(line).get(field)
+                    if isinstance(value, str):
+                        texts.append(value)
+
+    total_mb = sum(len(t.encode("utf-8")) for t in texts) / 1e6
+    golden, t_multi = bench(clean_text_multipass, texts)
+    fast, t_single = bench(normalize_html, texts)
+
+    mismatches = 0
+    for i, (a, b) in enumerate(zip(golden, fast)):
+        if a != b:
+            mismatches += 1
+            if mismatches <= 3:
+                pos = first_diff(a, b)
+                print(f"第 {i} 条不一致（位置 {pos}）:")
+                print(f"  multipass: {a[max(0, pos - 60):pos + 40]!r}")
+                print(f"  single   : {b[max(0, pos - 60):pos + 40]!r}")
+
+    print(f"记录数 {len(texts)}，共 {total_mb:.1f} MB")
+    for name, seconds in (("multipass", t_multi), ("single", t_single)):
+        print(f"  {name:<10} {seconds:7.2f}s  {total_mb / seconds:7.2f} MB/s  {len(texts) / seconds:9.0f} 条/s")
+    print(f"  加速比 {t_multi / t_single:.2f}x，不一致 {mismatches} 条")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
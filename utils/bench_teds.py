@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+TEDS 性能基准：在规模递增的合成表格上比较加速版 tree_edit_distance 与朴素 Zhang-Shasha 参照实现。
+1. 逐表校验两者距离一致（不一致时以非零状态退出）；
+2. 打印各规模下的耗时与加速比，观察随单元格数增长的曲线。
+朴素实现在大表格上很慢，超过 --max_reference_cells 个单元格时只计时加速版。
+
+用法: python bench_teds.py [--sizes 5x5 10x8 20x10 30x10 50x10 80x12] [--noise 0.1] [--max_reference_cells 300]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from teds import parse_table, tree_edit_distance, tree_edit_distance_reference
+
+WORDS = ["营业收入", "净利润", "合计", "-", "0", "12.5%", "(3,210)", "", "1,024.00", "其他"]
+
+
+def synthetic_table(rows, cols, rng, noise=0.0, base=None):
+    """
+    生成财报风格的表格：首行表头（含合并单元格），其余为数值。
+    base 非空时在 base 的基础上按 noise 比例改写单元格、删除或插入行，模拟模型预测
+    """
+    if base is None:
+        header = "<tr><td></td>" + "".join(
+            f'<td colspan="2">{rng.choice(WORDS)}{c}</td>' for c in range(max(cols // 2, 1))
+        ) + "</tr>"
+        body = [
+            [f"{rng.choice(WORDS)}{r}"] + [f"{rng.randint(0, 99999):,}.{rng.randint(0, 99):02d}" for _ in range(cols - 1)]
+            for r in range(rows - 1)
+        ]
+        return header, body
+
+    header, body = base
+    new_body = []
+    for row in body:
+        if rng.random() < noise / 4:
+            continue
+        new_body.append([cell + "1" if rng.random() < noise else cell for cell in row])
+        if rng.random() < noise / 4:
+            new_body.append([rng.choice(WORDS) for _ in row])
+    return header, new_body
+
+
+def to_html(table):
+    header, body = table
+    rows = "".join("<tr>" + "".join(f"<td>{c}</td>" for c in row) + "</tr>" for row in body)
+    return f"<table>{header}{rows}</table>"
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TEDS tree edit distance")
+    parser.add_argument("--sizes", nargs="+", default=["5x5", "10x8", "20x10", "30x10", "50x10", "80x12"],
+                        help="Table sizes as ROWSxCOLS")
+    parser.add_argument("--noise", type=float, default=0.1, help="Fraction of perturbed cells in the prediction")
+    parser.add_argument("--repeat", type=int, default=3, help="Tables per size")
+    parser.add_argument("--max_reference_cells", type=int, default=300,
+                        help="Skip the naive reference above this many cells")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    mismatches = 0
+    print(f"{'size':>8} {'cells':>6} {'fast':>9} {'reference':>10} {'speedup':>8}")
+    for size in args.sizes:
+        rows, cols = (int(v) for v in size.lower().split("x"))
+        t_fast = t_ref = 0.0
+        checked = True
+        for _ in range(args.repeat):
+            gt = synthetic_table(rows, cols, rng)
+            pred = synthetic_table(rows, cols, rng, args.noise, base=gt)
+            t_gt, t_pred = parse_table(to_html(gt)), parse_table(to_html(pred))
+
+            fast, seconds = timed(tree_edit_distance, t_pred, t_gt)
+            t_fast += seconds
+            if rows * cols <= args.max_reference_cells:
+                ref, seconds = timed(tree_edit_distance_reference, t_pred, t_gt)
+                t_ref += seconds
+                if abs(fast - ref) > 1e-9:
+                    mismatches += 1
+                    print(f"  {size}: fast {fast} != reference {ref}")
+            else:
+                checked = False
+
+        ref_text = f"{t_ref / args.repeat:9.3f}s" if checked else f"{'-':>10}"
+        speedup = f"{t_ref / t_fast:7.1f}x" if checked and t_fast else f"{'-':>8}"
+        print(f"{size:>8} {rows * cols:>6} {t_fast / args.repeat:8.3f}s {ref_text} {speedup}")
+
+    print(f"不一致 {mismatches} 处")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+clean_jsonl 的 golden 用例校验：clean_jsonl_cases.jsonl 每行 {name, input, expected}，expected 为固定的期望输出，
+覆盖 thead/tbody/tfoot 删除、th→td、空单元格合并、表格内换行、Markdown 标记、中英文空格、全角标点与 HTML 实体等。
+逐条核对多遍参照实现 clean_text_multipass 与单遍实现 normalize_html，任一不符时打印首个差异位置并以非零状态退出。
+吞吐对比见 bench_clean_jsonl.py。
+
+用法: python check_clean_jsonl.py [用例文件]
+"""
+
+import json
+import os
+import sys
+
+from clean_jsonl import clean_text_multipass, normalize_html
+
+CASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clean_jsonl_cases.jsonl")
+
+
+def first_diff(a, b):
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return min(len(a), len(b))
+
+
+def check(path=CASES_PATH):
+    """返回不符的 (用例, 实现) 个数"""
+    with open(path, "r", encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    failed = 0
+    for case in cases:
+        for fn in (clean_text_multipass, normalize_html):
+            out = fn(case["input"])
+            if out == case["expected"]:
+                continue
+            failed += 1
+            pos = first_diff(out, case["expected"])
+            print(f"❌ {case['name']} / {fn.__name__}：第 {pos} 个字符起不一致")
+            print(f"   期望：{case['expected'][max(0, pos - 40):pos + 40]!r}")
+            print(f"   实际：{out[max(0, pos - 40):pos + 40]!r}")
+    print(f"[Check] {len(cases)} 条用例 × 2 个实现，{failed} 处不一致")
+    return failed
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else CASES_PATH
+    if check(path):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
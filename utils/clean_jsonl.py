@@ -1,7 +1,52 @@
 #!/usr/bin/env python3
 import json
+import os
 import re
+import shutil
 import sys
+import tempfile
+from multiprocessing import Pool
+
+# 预编译的正则（逐条记录调用时不再重复查找正则缓存）
+TABLE_RE = re.compile(r"<table.*?</table>", re.DOTALL | re.IGNORECASE)
+TABLE_SECTION_RE = re.compile(r"</?(thead|tbody|tfoot)>", re.IGNORECASE)
+TH_OPEN_RE = re.compile(r"<\s*th(\s|>)", re.IGNORECASE)
+TH_CLOSE_RE = re.compile(r"</\s*th\s*>", re.IGNORECASE)
+ADJACENT_TAGS_RE = re.compile(r"><")
+EMPTY_TD_RE = re.compile(r"<td([^>]*)>(?:\s|&nbsp;)*</td>", re.IGNORECASE)
+NEWLINES_RE = re.compile(r"\n+")
+
+TAG_SPLIT_RE = re.compile(r'(<[^>]+>)')
+MD_HEADING_RE = re.compile(r'\s*#{1,6}\s*')
+MD_LIST_RE = re.compile(r'^\s*([-*+]\s+|\d+\.\s+)')
+MD_BOLD_RE = re.compile(r'(\*\*|__)(.*?)\1')
+MD_ITALIC_RE = re.compile(r'(\*|_)(.*?)\1')
+
+CJK_CJK_SPACE_RE = re.compile(r'([\u4e00-\u9fff])\s+([\u4e00-\u9fff])')
+CJK_ALNUM_SPACE_RE = re.compile(r'([\u4e00-\u9fff])\s+([A-Za-z0-9])')
+ALNUM_CJK_SPACE_RE = re.compile(r'([A-Za-z0-9])\s+([\u4e00-\u9fff])')
+PUNCT_SPACE_RE = re.compile(r'\s*([,.;:!?()\[\]{}，。；：！？（）【】])\s*')
+
+# 全角标点到半角标点映射（不包括“。”），合成一张 str.translate 表一次完成替换
+PUNCT_MAP = {
+    '，': ',',
+    '；': ';',
+    '：': ':',
+    '？': '?',
+    '！': '!',
+    '（': '(',
+    '）': ')',
+    '【': '[',
+    '】': ']',
+}
+PUNCT_TABLE = str.maketrans(PUNCT_MAP)
+
+# 单遍规范化使用的模式
+TAG_RE = re.compile(r'<[^>]+>')
+TH_PREFIX_RE = re.compile(r'<\s*th(?=[\s>])', re.IGNORECASE)
+BLANK_CELL_RE = re.compile(r'(?:\s|&nbsp;)*')
+MD_HINT_RE = re.compile(r'[#*_]|^\s*(?:[-+]|\d+\.)\s')
+TABLE_SECTION_TAGS = {"<thead>", "</thead>", "<tbody>", "</tbody>", "<tfoot>", "</tfoot>"}
 
 
 def format_html_table(html: str) -> str:
@@ -16,15 +61,30 @@ def format_html_table(html: str) -> str:
 
     def process_table(match):
         table_html = match.group(0)
-        table_html = re.sub(r"</?(thead|tbody|tfoot)>", "", table_html, flags=re.IGNORECASE)
-        table_html = re.sub(r"<\s*th(\s|>)", r"<td\1", table_html, flags=re.IGNORECASE)
-        table_html = re.sub(r"</\s*th\s*>", "</td>", table_html, flags=re.IGNORECASE)
-        table_html = re.sub(r"><", ">\n<", table_html)
-        table_html = re.sub(r"<td([^>]*)>(?:\s|&nbsp;)*</td>", r"<td\1></td>", table_html, flags=re.IGNORECASE)
-        table_html = re.sub(r"\n+", "\n", table_html)
+        table_html = TABLE_SECTION_RE.sub("", table_html)
+        table_html = TH_OPEN_RE.sub(r"<td\1", table_html)
+        table_html = TH_CLOSE_RE.sub("</td>", table_html)
+        table_html = ADJACENT_TAGS_RE.sub(">\n<", table_html)
+        table_html = EMPTY_TD_RE.sub(r"<td\1></td>", table_html)
+        table_html = NEWLINES_RE.sub("\n", table_html)
         return table_html.strip()
 
-    return re.sub(r"<table.*?</table>", process_table, html, flags=re.DOTALL | re.IGNORECASE)
+    return TABLE_RE.sub(process_table, html)
+
+
+def remove_md_in_text(text: str) -> str:
+    """删除一段纯文本（不含 HTML 标签）中的 Markdown 标记符"""
+    # 删除标题符号
+    text = MD_HEADING_RE.sub('', text)
+
+    # 删除列表标记
+    text = MD_LIST_RE.sub('', text)
+
+    # 删除粗体与斜体
+    text = MD_BOLD_RE.sub(r'\2', text)  # **text** / __text__
+    text = MD_ITALIC_RE.sub(r'\2', text)  # *text* / _text_
+
+    return text
 
 
 def clean_markdown_inside_html(html: str) -> str:
@@ -34,22 +94,8 @@ def clean_markdown_inside_html(html: str) -> str:
     - 列表符号 (-, *, +, 1.)
     - 粗体、斜体 (**text**, *text*, __text__, _text_)
     """
-
-    def remove_md_in_text(text):
-        # 删除标题符号
-        text = re.sub(r'\s*#{1,6}\s*', '', text)
-
-        # 删除列表标记
-        text = re.sub(r'^\s*([-*+]\s+|\d+\.\s+)', '', text)
-
-        # 删除粗体与斜体
-        text = re.sub(r'(\*\*|__)(.*?)\1', r'\2', text)  # **text** / __text__
-        text = re.sub(r'(\*|_)(.*?)\1', r'\2', text)  # *text* / _text_
-
-        return text
-
     # 对每段 HTML 以外的文本执行清理
-    segments = re.split(r'(<[^>]+>)', html)
+    segments = TAG_SPLIT_RE.split(html)
     cleaned_segments = [
         remove_md_in_text(seg) if not seg.startswith('<') else seg
         for seg in segments
@@ -67,69 +113,194 @@ def normalize_text(text: str) -> str:
     """
 
     # 删除中文与中文之间的空格
-    text = re.sub(r'([\u4e00-\u9fff])\s+([\u4e00-\u9fff])', r'\1\2', text)
+    text = CJK_CJK_SPACE_RE.sub(r'\1\2', text)
 
     # 删除中文与英文/数字之间的空格
-    text = re.sub(r'([\u4e00-\u9fff])\s+([A-Za-z0-9])', r'\1\2', text)
-    text = re.sub(r'([A-Za-z0-9])\s+([\u4e00-\u9fff])', r'\1\2', text)
-
-    # 全角标点到半角标点映射（不包括“。”）
-    punct_map = {
-        '，': ',',
-        '；': ';',
-        '：': ':',
-        '？': '?',
-        '！': '!',
-        '（': '(',
-        '）': ')',
-        '【': '[',
-        '】': ']',
-    }
-    for cn_punct, en_punct in punct_map.items():
-        text = text.replace(cn_punct, en_punct)
+    text = CJK_ALNUM_SPACE_RE.sub(r'\1\2', text)
+    text = ALNUM_CJK_SPACE_RE.sub(r'\1\2', text)
+
+    # 全角标点到半角标点
+    text = text.translate(PUNCT_TABLE)
 
     # 删除所有中英文标点符号前后的空格
-    text = re.sub(r'\s*([,.;:!?()\[\]{}，。；：！？（）【】])\s*', r'\1', text)
+    text = PUNCT_SPACE_RE.sub(r'\1', text)
 
     return text
 
 
-def clean_jsonl(input_file, output_file, field="suffix"):
+def clean_text_multipass(text: str) -> str:
+    """逐步调用上面各函数的多遍清理流程，是 normalize_html 的参照实现"""
+    text = text.replace("\n", "")
+
+    # 表格格式化
+    if "<table" in text and "</table>" in text:
+        text = format_html_table(text)
+
+    # 删除 HTML 内部 Markdown 符号
+    text = clean_markdown_inside_html(text)
+
+    # 文本规范化
+    return normalize_text(text)
+
+
+def normalize_html(text: str) -> str:
     """
-    清理 JSONL 文件中指定字段的 HTML、Markdown 和文本内容。
+    单遍清理：只对标签/文本做一次切分，遍历时同时完成表格展平（删除 thead/tbody/tfoot、
+    th→td、相邻标签换行、空单元格合并）与 Markdown 删除，最后对拼好的结果做文本规范化。
+    输出与 clean_text_multipass 逐字节一致；文本中出现不成对的 “<” 时无法保证切分一致，退回多遍实现。
     """
-    with open(input_file, "r", encoding="utf-8") as f_in, \
-            open(output_file, "w", encoding="utf-8") as f_out:
-        for line in f_in:
-            if not line.strip():
-                continue
-            data = json.loads(line)
-            if field in data and isinstance(data[field], str):
-                text = data[field].replace("\n", "")
+    text = text.replace("\n", "")
+    tags = list(TAG_RE.finditer(text))
+    if text.count("<") != len(tags):
+        return clean_text_multipass(text)
+
+    # 表格区域从 <table 开头的标签到其后第一个 </table>，没有闭合标签的 <table 不处理
+    last_close = -1
+    if "<table" in text and "</table>" in text:
+        for k, m in enumerate(tags):
+            if m.group().lower() == "</table>":
+                last_close = k
+
+    out = []
+    pending = []  # 尚未输出的文本（表格内删掉的标签两侧文本需要合并后再处理）
+    in_table = False
+    td_open = -1  # 表格内上一个输出的标签若是 <td...>，记录其在 out 中的位置
+    pos = 0
+
+    for k, m in enumerate(tags):
+        if m.start() > pos:
+            pending.append(text[pos:m.start()])
+        pos = m.end()
+        tag = m.group()
+
+        if not in_table:
+            seg = "".join(pending)
+            pending.clear()
+            out.append(remove_md_in_text(seg) if MD_HINT_RE.search(seg) else seg)
+            out.append(tag)
+            if k < last_close and tag[:6].lower() == "<table":
+                in_table = True
+                td_open = -1
+            continue
+
+        lower = tag.lower()
+        if lower in TABLE_SECTION_TAGS:
+            continue
+        if TH_CLOSE_RE.fullmatch(tag):
+            tag = lower = "</td>"
+        else:
+            th = TH_PREFIX_RE.match(tag)
+            if th:
+                tag = "<td" + tag[th.end():]
+                lower = tag.lower()
+
+        seg = "".join(pending)
+        pending.clear()
+        if not seg or seg[-1] == ">":
+            seg += "\n"
+        if lower == "</td>" and td_open >= 0 and BLANK_CELL_RE.fullmatch(seg):
+            out[td_open] = "<td" + out[td_open][3:]
+            seg, tag = "", "</td>"
+        out.append(remove_md_in_text(seg) if MD_HINT_RE.search(seg) else seg)
+        out.append(tag)
+
+        td_open = len(out) - 1 if lower[:3] == "<td" else -1
+        if lower == "</table>":
+            in_table = False
+
+    seg = text[pos:] if not pending else "".join(pending) + text[pos:]
+    out.append(remove_md_in_text(seg) if MD_HINT_RE.search(seg) else seg)
+
+    # 规范化规则都不跨越 “<”/“>”，对整串执行一次即可
+    return normalize_text("".join(out))
 
-                # 表格格式化
-                if "<table" in text and "</table>" in text:
-                    text = format_html_table(text)
 
-                # 删除 HTML 内部 Markdown 符号
-                text = clean_markdown_inside_html(text)
+def clean_text(text: str) -> str:
+    """单个字段的完整清理流程：去换行 → 表格格式化 → 删除 Markdown → 文本规范化"""
+    return normalize_html(text)
 
-                # 文本规范化
-                text = normalize_text(text)
 
-                data[field] = text
+def clean_line(line: str, field: str = "suffix"):
+    """清理一行 JSONL，空行返回 None"""
+    if not line.strip():
+        return None
+    data = json.loads(line)
+    if field in data and isinstance(data[field], str):
+        data[field] = clean_text(data[field])
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+def split_byte_ranges(path, num_parts):
+    """按字节把文件切成 num_parts 段，每段边界对齐到行首"""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, num_parts):
+            f.seek(max(size * i // num_parts, bounds[-1]))
+            if f.tell() > 0:
+                f.seek(f.tell() - 1)
+                f.readline()
+            bounds.append(max(f.tell(), bounds[-1]))
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(num_parts) if bounds[i] < bounds[i + 1]]
+
+
+def _clean_range(args):
+    """子进程：清理 [start, end) 字节范围内的行，写入独立的分段文件"""
+    input_file, start, end, part_file, field = args
+    count = 0
+    with open(input_file, "rb") as f_in, open(part_file, "w", encoding="utf-8") as f_out:
+        f_in.seek(start)
+        while f_in.tell() < end:
+            line = f_in.readline()
+            if not line:
+                break
+            out = clean_line(line.decode("utf-8"), field)
+            if out is not None:
+                f_out.write(out)
+                count += 1
+    return count
+
+
+def clean_jsonl(input_file, output_file, field="suffix", num_workers=1):
+    """
+    清理 JSONL 文件中指定字段的 HTML、Markdown 和文本内容。
+    num_workers > 1 时按字节范围切分输入、多进程并行清理，再按原顺序拼接输出。
+    """
+    if num_workers <= 1:
+        with open(input_file, "r", encoding="utf-8") as f_in, \
+                open(output_file, "w", encoding="utf-8") as f_out:
+            for line in f_in:
+                out = clean_line(line, field)
+                if out is not None:
+                    f_out.write(out)
+        return
+
+    ranges = split_byte_ranges(input_file, num_workers)
+    out_dir = os.path.dirname(os.path.abspath(output_file))
+    with tempfile.TemporaryDirectory(dir=out_dir) as tmp_dir:
+        tasks = [
+            (input_file, start, end, os.path.join(tmp_dir, f"part-{i:05d}.jsonl"), field)
+            for i, (start, end) in enumerate(ranges)
+        ]
+        with Pool(min(num_workers, len(tasks)) or 1) as pool:
+            pool.map(_clean_range, tasks)
 
-            f_out.write(json.dumps(data, ensure_ascii=False) + "\n")
+        with open(output_file, "wb") as f_out:
+            for task in tasks:
+                with open(task[3], "rb") as f_part:
+                    shutil.copyfileobj(f_part, f_out)
 
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("用法: python clean_jsonl.py 输入文件 输出文件 [字段名]")
+        print("用法: python clean_jsonl.py 输入文件 输出文件 [字段名] [进程数]")
         sys.exit(1)
 
     input_file = sys.argv[1]
     output_file = sys.argv[2]
     field = sys.argv[3] if len(sys.argv) > 3 else "suffix"
+    num_workers = int(sys.argv[4]) if len(sys.argv) > 4 else os.cpu_count()
 
-    clean_jsonl(input_file, output_file, field)
+    clean_jsonl(input_file, output_file, field, num_workers)
     print(f"处理完成！已生成 {output_file}")
@@ -36,34 +36,39 @@ def convert_item(item):
         return f'<p data-bbox="{x1} {y1} {x2} {y2}">{text}</p>'
 
 
+def convert_record(obj):
+    """将一条 dots.ocr 推理结果转换为 {image, prefix, suffix}"""
+    image = obj["file"]
+    try:
+        response = json.loads(obj["response"])
+    except Exception:
+        response = []
+
+    html_parts = [convert_item(item) for item in response]
+    html_body = "<body>" + "".join(html_parts) + "</body>"
+
+    new_obj = {
+        "image": image,
+        "prefix": "QwenVL HTML",
+        "suffix": html_body
+    }
+
+    # new_obj = {
+    #     "image": image,
+    #     "prompt": "QwenVL HTML",
+    #     "answer": html_body,
+    #     "latency": obj["latency"]
+    # }
+
+    return new_obj
+
+
 def process_file(src_path, out_path):
     with open(src_path, "r", encoding="utf-8") as fin, \
             open(out_path, "w", encoding="utf-8") as fout:
 
         for line in fin:
-            obj = json.loads(line)
-            image = obj["file"]
-            try:
-                response = json.loads(obj["response"])
-            except Exception:
-                response = []
-
-            html_parts = [convert_item(item) for item in response]
-            html_body = "<body>" + "".join(html_parts) + "</body>"
-
-            new_obj = {
-                "image": image,
-                "prefix": "QwenVL HTML",
-                "suffix": html_body
-            }
-
-            # new_obj = {
-            #     "image": image,
-            #     "prompt": "QwenVL HTML",
-            #     "answer": html_body,
-            #     "latency": obj["latency"]
-            # }
-
+            new_obj = convert_record(json.loads(line))
             fout.write(json.dumps(new_obj, ensure_ascii=False) + "\n")
 
 
@@ -1,5 +1,7 @@
+import argparse
 import json
 import re
+from multiprocessing import Pool
 
 # 输入输出文件路径
 src_file = "../datasets/OmniDocBench/OmniDocBench.json"
@@ -25,6 +27,9 @@ CATEGORY_TO_HTML = {
     "reference": "p",  # 参考文献类
 }
 
+# 流式解析每次读取的字符数
+READ_CHUNK_SIZE = 1 << 20
+
 # 若 order 为 None 或非法值，映射到这个很大的哨兵值（排到最后）
 ORDER_SENTINEL = 10 ** 9
 
@@ -89,43 +94,147 @@ def convert_block(det):
         return None
 
 
-def convert_and_save(src_file, tgt_file):
-    with open(src_file, "r", encoding="utf-8") as f_src, \
-            open(tgt_file, "w", encoding="utf-8") as f_tgt:
-        src_data = json.load(f_src)
+def convert_page(page):
+    """把单个页面转换为 {image, prefix, suffix}；没有 image_path 或没有可用 block 时返回 None"""
+    image_path = page.get("page_info", {}).get("image_path", "")
+    if not image_path:
+        # 若没有 image_path，可以选择跳过或写空；这里跳过
+        return None
 
-        for page in src_data:
-            image_path = page.get("page_info", {}).get("image_path", "")
-            if not image_path:
-                # 若没有 image_path，可以选择跳过或写空；这里跳过
-                continue
+    # 按 order 排序 layout_dets（None/Null 会被视为 ORDER_SENTINEL，排到最后）
+    sorted_dets = sorted(page.get("layout_dets", []), key=order_key)
 
-            # 按 order 排序 layout_dets（None/Null 会被视为 ORDER_SENTINEL，排到最后）
-            sorted_dets = sorted(page.get("layout_dets", []), key=order_key)
+    html_blocks = []
+    for det in sorted_dets:
+        html = convert_block(det)
+        if html:
+            html_blocks.append(html)
 
-            html_blocks = []
-            for det in sorted_dets:
-                html = convert_block(det)
-                if html:
-                    html_blocks.append(html)
+    if not html_blocks:
+        return None
 
-            if not html_blocks:
+    # 单行 <body>（确保内部无换行）
+    html_body = "<body>" + "".join(html_blocks) + "</body>"
+
+    return {
+        "image": image_path,
+        "prefix": "QwenVL HTML",
+        "suffix": html_body
+    }
+
+
+def iter_json_array(f, chunk_size=READ_CHUNK_SIZE):
+    """
+    流式迭代顶层 JSON 数组中的元素：按块读取，用 raw_decode 逐个解码，
+    内存中只保留当前缓冲区与正在解析的元素
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill(size):
+        # 丢弃已解析部分再追加新数据
+        nonlocal buf, pos, eof
+        data = f.read(size)
+        eof = not data
+        buf = buf[pos:] + data
+        pos = 0
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill(chunk_size)
+
+    skip(" \t\r\n")
+    if pos >= len(buf) or buf[pos] != "[":
+        raise ValueError("Expected a top-level JSON array")
+    pos += 1
+
+    read_size = chunk_size
+    while True:
+        skip(" \t\r\n,")
+        if pos >= len(buf):
+            raise ValueError("Unterminated JSON array")
+        if buf[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # 元素跨越缓冲区边界：读入更多数据后重试，读取量翻倍避免超大元素反复重解析
+            fill(read_size)
+            read_size *= 2
+            continue
+        # 元素之后必须是 "," 或 "]"：数字等元素可能恰好被缓冲区截断（[123456] 只读入 "[12" 或 "[1.5" 只读入 "[1."），
+        # 此时 raw_decode 会返回一个更短的值，读入更多数据后重新解码
+        nxt = end
+        while nxt < len(buf) and buf[nxt] in " \t\r\n":
+            nxt += 1
+        if nxt == len(buf) or buf[nxt] not in ",]":
+            if not eof:
+                fill(read_size)
+                read_size *= 2
                 continue
-
-            # 单行 <body>（确保内部无换行）
-            html_body = "<body>" + "".join(html_blocks) + "</body>"
-
-            item = {
-                "image": image_path,
-                "prefix": "QwenVL HTML",
-                "suffix": html_body
-            }
-
-            # 逐条写入（即时落盘）
-            f_tgt.write(json.dumps(item, ensure_ascii=False) + "\n")
+            if nxt < len(buf):
+                raise ValueError(f"Expected ',' or ']' after an array element, got {buf[nxt]!r}")
+        read_size = chunk_size
+        pos = end
+        yield item
+
+
+def _convert_page_line(page):
+    """子进程：转换单个页面并序列化为一行 JSON，页面被跳过时返回 None"""
+    item = convert_page(page)
+    return None if item is None else json.dumps(item, ensure_ascii=False) + "\n"
+
+
+def _batched(iterable, size):
+    batch = []
+    for x in iterable:
+        batch.append(x)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def convert_and_save(src_file, tgt_file, num_workers=1, chunk_size=READ_CHUNK_SIZE):
+    """
+    流式转换：逐个解析页面并即时写出，内存占用与文件大小无关。
+    num_workers > 1 时按窗口把页面分发到进程池，结果仍按输入顺序写出
+    """
+    with open(src_file, "r", encoding="utf-8") as f_src, \
+            open(tgt_file, "w", encoding="utf-8") as f_tgt:
+        pages = iter_json_array(f_src, chunk_size)
+
+        if num_workers <= 1:
+            for page in pages:
+                line = _convert_page_line(page)
+                if line is not None:
+                    # 逐条写入（即时落盘）
+                    f_tgt.write(line)
+        else:
+            # 每个窗口只持有 num_workers * 16 个页面，Pool.imap 会一次性读完整个输入，这里不用它
+            with Pool(num_workers) as pool:
+                for window in _batched(pages, num_workers * 16):
+                    for line in pool.map(_convert_page_line, window, chunksize=4):
+                        if line is not None:
+                            f_tgt.write(line)
 
     print(f"✅ 转换完成（按阅读顺序并处理 None order），结果逐条写入: {tgt_file}")
 
 
 if __name__ == "__main__":
-    convert_and_save(src_file, tgt_file)
+    parser = argparse.ArgumentParser(description="Convert OmniDocBench.json to Qwen2.5-VL HTML jsonl")
+    parser.add_argument("--src", type=str, default=src_file, help="OmniDocBench.json 路径")
+    parser.add_argument("--tgt", type=str, default=tgt_file, help="输出 jsonl 路径")
+    parser.add_argument("--num_workers", type=int, default=1, help="转换进程数")
+    parser.add_argument("--chunk_size", type=int, default=READ_CHUNK_SIZE, help="流式解析每次读取的字符数")
+    args = parser.parse_args()
+
+    convert_and_save(args.src, args.tgt, args.num_workers, args.chunk_size)
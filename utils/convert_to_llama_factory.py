@@ -9,16 +9,42 @@
    - train.jsonl → vlm-challenge-update/image/train
    - eval.jsonl 或 val.jsonl → vlm-challenge-update/image/eval
    - 其他情况 → vlm-challenge-update/image/other
-4. 结构完全符合 LLaMA Factory 多模态训练数据格式。
+4. 结构完全符合 LLaMA Factory 多模态训练数据格式；
+5. 样本 id 为 <输入文件名>-<该行的字节偏移>，重复的行也各不相同，与是否多进程、如何分片无关；
+6. 单遍流式读取，按字节显示进度，缺失字段等告警汇总输出；可多进程并行、一次转换多个文件。
+
+用法：
+  python convert_to_llama_factory.py <input.jsonl> <output.jsonl> [image_root]
+  python convert_to_llama_factory.py --inputs train.jsonl eval.jsonl --output_dir <目录> [--num_workers N]
 """
 
+import argparse
 import json
+import os
+import shutil
 import sys
+import tempfile
+from collections import Counter, defaultdict
+from multiprocessing import Pool
 from pathlib import Path
 from tqdm import tqdm
 
+from clean_jsonl import split_byte_ranges
+
+# image 根目录的默认前缀，其下按 train / eval / other 区分
+IMAGE_BASE = "/root/autodl-tmp/LLaMA-Factory/data/vlm-challenge-update/image"
+
+# 每类告警最多记录的行号个数
+MAX_WARN_LINES = 5
+
+WARNING_MESSAGES = {
+    "invalid_json": "无法解析 JSON，已跳过",
+    "missing_prefix": "缺少 prefix 字段，已使用空字符串",
+    "missing_suffix": "缺少 suffix 字段，已使用空字符串",
+}
+
 
-def infer_image_root(input_path: Path) -> str:
+def infer_image_root(input_path: Path, base: str = IMAGE_BASE) -> str:
     """根据文件名自动推断 image 根目录路径"""
     name = input_path.stem.lower()
     if "train" in name:
@@ -27,10 +53,111 @@ def infer_image_root(input_path: Path) -> str:
         subset = "eval"
     else:
         subset = "other"
-    return f"/root/autodl-tmp/LLaMA-Factory/data/vlm-challenge-update/image/{subset}"
+    return f"{base.rstrip('/')}/{subset}"
+
+
+def sample_id(stem: str, offset: int) -> str:
+    """样本 id：输入文件名（不含扩展名）+ 该行在输入文件中的字节偏移"""
+    return f"{stem}-{offset}"
+
+
+def build_sample(obj, image_root, sample_id):
+    """把一条 {image, prefix, suffix} 记录转换为 LLaMA Factory 多模态样本"""
+    image = obj.get("image", "")
+    prefix = obj.get("prefix", "")
+    suffix = obj.get("suffix", "")
+
+    # 拼接 image 路径前缀
+    if image:
+        image = f"{image_root.rstrip('/')}/{image.lstrip('/')}"
+
+    return {
+        "id": sample_id,
+        "image": image,
+        "conversations": [
+            {
+                "from": "human",
+                "value": f"<image>请解析该文档图像，输出符合要求的{prefix}结构。"
+            },
+            {
+                "from": "gpt",
+                "value": suffix
+            }
+        ]
+    }
+
+
+class WarningCounter:
+    """按类型汇总告警，每类只保留前 MAX_WARN_LINES 个出错位置"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.examples = defaultdict(list)
+
+    def add(self, kind, location):
+        self.counts[kind] += 1
+        if len(self.examples[kind]) < MAX_WARN_LINES:
+            self.examples[kind].append(location)
+
+    def update(self, other):
+        self.counts.update(other.counts)
+        for kind, locations in other.examples.items():
+            room = MAX_WARN_LINES - len(self.examples[kind])
+            self.examples[kind].extend(locations[:room])
+
+    def report(self):
+        for kind, message in WARNING_MESSAGES.items():
+            if self.counts[kind]:
+                where = "、".join(self.examples[kind])
+                print(f"⚠️ {self.counts[kind]} 行{message}（如 {where}）")
+
+
+def convert_line(line, image_root, warnings, location, sid):
+    """
+    转换一行 JSONL，返回输出行（含换行符）；空行或解析失败返回 None。
+    warnings: WarningCounter；location: 告警中显示的位置（行号或字节偏移）；sid: 样本 id
+    """
+    line = line.strip()
+    if not line:
+        return None
+
+    try:
+        obj = json.loads(line)
+    except Exception:
+        warnings.add("invalid_json", location)
+        return None
+
+    if not obj.get("prefix", ""):
+        warnings.add("missing_prefix", location)
+    if not obj.get("suffix", ""):
+        warnings.add("missing_suffix", location)
+
+    sample = build_sample(obj, image_root, sid)
+    return json.dumps(sample, ensure_ascii=False) + "\n"
+
+
+def _convert_range(args):
+    """子进程：转换 [start, end) 字节范围内的行，写入独立的分段文件，返回 (字节数, 成功条数, 告警计数)"""
+    input_path, start, end, part_file, image_root = args
+    stem = Path(input_path).stem
+    warnings = WarningCounter()
+    success = 0
+    with open(input_path, "rb") as fin, open(part_file, "w", encoding="utf-8") as fout:
+        fin.seek(start)
+        while fin.tell() < end:
+            offset = fin.tell()
+            line = fin.readline()
+            if not line:
+                break
+            out = convert_line(line.decode("utf-8"), image_root, warnings, f"byte {offset}",
+                               sample_id(stem, offset))
+            if out is not None:
+                fout.write(out)
+                success += 1
+    return end - start, success, warnings
 
 
-def convert_file(input_path, output_path, image_root=None):
+def convert_file(input_path, output_path, image_root=None, num_workers=1, image_base=IMAGE_BASE):
     input_path = Path(input_path)
     output_path = Path(output_path)
 
@@ -40,76 +167,82 @@ def convert_file(input_path, output_path, image_root=None):
 
     # 自动推断 image 路径前缀
     if image_root is None:
-        image_root = infer_image_root(input_path)
+        image_root = infer_image_root(input_path, image_base)
         print(f"📁 自动检测 image 根目录：{image_root}")
 
     image_root = image_root.rstrip("/")
 
-    total = sum(1 for _ in open(input_path, "r", encoding="utf-8"))
-    success, fail = 0, 0
-
-    with open(input_path, "r", encoding="utf-8") as fin, \
-            open(output_path, "w", encoding="utf-8") as fout:
-
-        for line_no, line in enumerate(tqdm(fin, total=total, desc="Converting"), start=1):
-            line = line.strip()
-            if not line:
-                continue
-
-            try:
-                obj = json.loads(line)
-            except Exception as e:
-                print(f"⚠️ 跳过第 {line_no} 行：无法解析 JSON ({e})")
-                fail += 1
-                continue
-
-            image = obj.get("image", "")
-            prefix = obj.get("prefix", "")
-            suffix = obj.get("suffix", "")
-
-            # 拼接 image 路径前缀
-            if image:
-                image = f"{image_root}/{image.lstrip('/')}"
-
-            if not prefix:
-                print(f"⚠️ 第 {line_no} 行缺少 prefix 字段，已使用空字符串")
-            if not suffix:
-                print(f"⚠️ 第 {line_no} 行缺少 suffix 字段，已使用空字符串")
-
-            sample = {
-                "id": f"sample-{success + 1:04d}",
-                "image": image,
-                "conversations": [
-                    {
-                        "from": "human",
-                        "value": f"<image>请解析该文档图像，输出符合要求的{prefix}结构。"
-                    },
-                    {
-                        "from": "gpt",
-                        "value": suffix
-                    }
-                ]
-            }
-
-            fout.write(json.dumps(sample, ensure_ascii=False) + "\n")
-            success += 1
-
-    print(f"\n✅ 转换完成：成功 {success} 条，跳过 {fail} 条")
+    size = os.path.getsize(input_path)
+    warnings = WarningCounter()
+    success = 0
+    progress = tqdm(total=size, unit="B", unit_scale=True, desc=f"Converting {input_path.name}")
+
+    if num_workers <= 1:
+        offset = 0
+        with open(input_path, "rb") as fin, open(output_path, "w", encoding="utf-8") as fout:
+            for line_no, line in enumerate(fin, start=1):
+                progress.update(len(line))
+                out = convert_line(line.decode("utf-8"), image_root, warnings, f"第 {line_no} 行",
+                                   sample_id(input_path.stem, offset))
+                offset += len(line)
+                if out is not None:
+                    fout.write(out)
+                    success += 1
+    else:
+        # 切得比进程数更细，进度条更新更平滑；分段文件按原顺序拼接
+        ranges = split_byte_ranges(input_path, num_workers * 4)
+        out_dir = os.path.dirname(os.path.abspath(output_path))
+        with tempfile.TemporaryDirectory(dir=out_dir) as tmp_dir:
+            tasks = [
+                (str(input_path), start, end, os.path.join(tmp_dir, f"part-{i:05d}.jsonl"), image_root)
+                for i, (start, end) in enumerate(ranges)
+            ]
+            with Pool(min(num_workers, len(tasks)) or 1) as pool:
+                for n_bytes, n_ok, part_warnings in pool.imap_unordered(_convert_range, tasks):
+                    progress.update(n_bytes)
+                    success += n_ok
+                    warnings.update(part_warnings)
+
+            with open(output_path, "wb") as fout:
+                for task in tasks:
+                    with open(task[3], "rb") as f_part:
+                        shutil.copyfileobj(f_part, fout)
+    progress.close()
+
+    warnings.report()
+    print(f"\n✅ 转换完成：成功 {success} 条，跳过 {warnings.counts['invalid_json']} 条")
     print(f"📄 输出文件：{output_path.resolve()}")
 
 
 def main():
-    if len(sys.argv) < 3:
-        print("用法：python convert_to_llama_factory.py <input.jsonl> <output.jsonl> [image_root]")
-        print("说明：若未指定 image_root，将自动根据输入文件名推断 train / eval / other")
+    parser = argparse.ArgumentParser(
+        description="将 image + prefix + suffix 格式的 jsonl 转换为 LLaMA Factory 多模态格式",
+        epilog="说明：若未指定 image_root，将自动根据输入文件名推断 train / eval / other",
+    )
+    parser.add_argument("input", nargs="?", help="输入 jsonl")
+    parser.add_argument("output", nargs="?", help="输出 jsonl")
+    parser.add_argument("image_root", nargs="?", default=None, help="image 路径前缀")
+    parser.add_argument("--inputs", nargs="+", default=[], help="一次转换多个文件（如 train.jsonl eval.jsonl）")
+    parser.add_argument("--output_dir", type=str, default=None, help="--inputs 的输出目录，文件名与输入相同")
+    parser.add_argument("--image_base", type=str, default=IMAGE_BASE, help="自动推断 image_root 时使用的根目录")
+    parser.add_argument("--num_workers", type=int, default=1, help="并行转换的进程数")
+    args = parser.parse_args()
+
+    if args.inputs:
+        if not args.output_dir:
+            parser.error("--inputs 需要同时指定 --output_dir")
+        os.makedirs(args.output_dir, exist_ok=True)
+        for input_path in args.inputs:
+            output_path = os.path.join(args.output_dir, Path(input_path).name)
+            if os.path.abspath(output_path) == os.path.abspath(input_path):
+                parser.error(f"输出会覆盖输入文件：{input_path}")
+            convert_file(input_path, output_path, None, args.num_workers, args.image_base)
+    elif args.input and args.output:
+        convert_file(args.input, args.output, args.image_root, args.num_workers, args.image_base)
+    else:
+        parser.print_help()
         sys.exit(1)
 
-    input_path = sys.argv[1]
-    output_path = sys.argv[2]
-    image_root = sys.argv[3] if len(sys.argv) >= 4 else None
-
-    convert_file(input_path, output_path, image_root)
-
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,143 @@
+"""
+预测与标注的逐页对比，供可视化工具（visualization.py）的对比模式使用，也可单独运行列出最差页面：
+- 按 bbox IoU 对齐预测块与标注块（全部块对一次性算出 IoU 矩阵后贪心一对一匹配），得到匹配 / 漏检 / 误检；
+- 匹配块的文本差异渲染为 HTML；
+- 逐页打分调用与 score.py 共用的 page_score.score_page / summarize（1 - 文本归一化编辑距离、表格 TEDS、版面 F1 的平均），
+  与本地评测口径一致；多进程计算整个数据集并按分数从低到高排序。
+
+用法: python page_diff.py --label_path eval.jsonl --pred_path predict.jsonl [--top 20] [--output worst.jsonl]
+"""
+
+import os
+import html
+import json
+import difflib
+import argparse
+from multiprocessing import Pool
+from typing import Any, Dict, List
+
+from tqdm import tqdm
+
+from bbox import iter_blocks, iou_matrix, match_boxes
+from clean_jsonl import clean_text
+from page_score import load_records, score_page, summarize
+
+
+def page_metrics(page: Dict[str, Any]) -> Dict[str, Any]:
+    """score_page 的逐页结果 → 页面分数：按本地评测的汇总口径（page_score.summarize）只汇总这一页"""
+    summary = summarize([page])
+    return {
+        "score": summary["overall"],
+        "text_ned": page["text_ned"],
+        "layout_f1": summary["layout_f1"],
+        "table_teds": page["table_teds"],
+    }
+
+
+def align_page(pred_html: str, gt_html: str, iou_threshold: float = 0.5, normalize: bool = True) -> Dict[str, Any]:
+    """
+    对齐一页的预测与标注，返回：
+    pred_blocks / gt_blocks（iter_blocks 的结果）、matches [(预测块下标, 标注块下标, IoU)]（按标注顺序）、
+    missed（未匹配的标注块下标）、spurious（未匹配的预测块下标），以及 page_score.score_page 给出的各项指标与页面分数
+    """
+    metrics = page_metrics(score_page(("", pred_html, gt_html, iou_threshold, normalize)))
+    if normalize:
+        pred_html, gt_html = clean_text(pred_html), clean_text(gt_html)
+    pred_blocks, gt_blocks = iter_blocks(pred_html), iter_blocks(gt_html)
+    pred_boxed = [i for i, b in enumerate(pred_blocks) if b["bbox"]]
+    gt_boxed = [j for j, b in enumerate(gt_blocks) if b["bbox"]]
+
+    # 与 score_page 的版面块匹配相同，用于在图上标出匹配 / 漏检 / 误检
+    iou = iou_matrix([pred_blocks[i]["bbox"] for i in pred_boxed], [gt_blocks[j]["bbox"] for j in gt_boxed])
+    pairs = match_boxes(iou, iou_threshold)
+    matches = sorted(((pred_boxed[i], gt_boxed[j], float(iou[i, j])) for i, j in pairs), key=lambda m: m[1])
+    matched_pred = {i for i, _, _ in matches}
+    matched_gt = {j for _, j, _ in matches}
+
+    return {
+        "pred_blocks": pred_blocks,
+        "gt_blocks": gt_blocks,
+        "matches": matches,
+        "missed": [j for j in gt_boxed if j not in matched_gt],
+        "spurious": [i for i in pred_boxed if i not in matched_pred],
+        **metrics,
+    }
+
+
+def page_summary(args) -> Dict[str, Any]:
+    """子进程：一页的打分摘要（score_page 结果，不含块内容，便于回传与展示）"""
+    image, pred_html, gt_html, iou_threshold = args
+    page = score_page((image, pred_html, gt_html, iou_threshold, True))
+    metrics = page_metrics(page)
+    return {
+        "image": image,
+        "score": metrics["score"],
+        "text_ned": metrics["text_ned"],
+        "layout_f1": metrics["layout_f1"],
+        "table_teds": float(sum(page["table_teds"]) / len(page["table_teds"])) if page["table_teds"] else None,
+        "matched": page["n_matched"],
+        "missed": page["n_gt"] - page["n_matched"],
+        "spurious": page["n_pred"] - page["n_matched"],
+        "missing_pred": page["missing"],
+    }
+
+
+def rank_pages(
+    label_path: str,
+    pred_path: str,
+    num_workers: int = os.cpu_count(),
+    iou_threshold: float = 0.5,
+    progress: bool = True,
+) -> List[Dict[str, Any]]:
+    """多进程计算标注集中每页的打分摘要，按分数从低到高（同分按文件名）排序"""
+    labels = load_records(label_path, "suffix")
+    preds = load_records(pred_path, "answer")
+    tasks = [(image, preds.get(image, ""), gt, iou_threshold) for image, gt in sorted(labels.items())]
+    if num_workers > 1 and len(tasks) > 1:
+        with Pool(min(num_workers, len(tasks))) as pool:
+            pages = list(tqdm(pool.imap(page_summary, tasks, chunksize=8), total=len(tasks),
+                              desc="Aligning", disable=not progress))
+    else:
+        pages = [page_summary(t) for t in tqdm(tasks, desc="Aligning", disable=not progress)]
+    pages.sort(key=lambda p: (p["score"], p["image"]))
+    return pages
+
+
+def text_diff_html(pred: str, gt: str) -> str:
+    """字符级差异：标注中有、预测中缺的用删除线标红，预测多出的用下划线标绿"""
+    sm = difflib.SequenceMatcher(None, gt, pred, autojunk=False)
+    parts = []
+    for op, i1, i2, j1, j2 in sm.get_opcodes():
+        if op == "equal":
+            parts.append(html.escape(gt[i1:i2]))
+            continue
+        if i2 > i1:
+            parts.append(f"<del style='color:red;'>{html.escape(gt[i1:i2])}</del>")
+        if j2 > j1:
+            parts.append(f"<ins style='color:green;'>{html.escape(pred[j1:j2])}</ins>")
+    return "".join(parts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rank pages by prediction quality against labels")
+    parser.add_argument("--label_path", required=True, type=str, help="Labeled jsonl (image/prefix/suffix)")
+    parser.add_argument("--pred_path", required=True, type=str, help="predict.jsonl written by eval.py")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(), help="Alignment processes")
+    parser.add_argument("--iou_threshold", type=float, default=0.5, help="IoU threshold for block matching")
+    parser.add_argument("--top", type=int, default=20, help="Print the N worst pages")
+    parser.add_argument("--output", type=str, default=None, help="Write all ranked pages to this jsonl")
+    args = parser.parse_args()
+
+    pages = rank_pages(args.label_path, args.pred_path, args.num_workers, args.iou_threshold)
+    for p in pages[:args.top]:
+        print(f"{p['score']:.4f}  ned {p['text_ned']:.4f}  f1 {p['layout_f1']:.4f}  "
+              f"missed {p['missed']:>3}  spurious {p['spurious']:>3}  {p['image']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for p in pages:
+                f.write(json.dumps(p, ensure_ascii=False) + "\n")
+        print(f"[Saved] {len(pages)} pages -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+逐页打分与汇总，score.py（本地评测）与 page_diff.py（逐页对比 / 最差页面排序）共用，保证两者口径一致：
+- 文本：非表格/图片块的文本按阅读顺序拼接后的归一化编辑距离（越小越好）；
+- 表格：预测表格与标注表格按 bbox IoU 匹配后的 TEDS（未匹配的标注表格记 0）；
+- 版面：bbox IoU 贪心一对一匹配的 precision/recall/F1，匹配块的类别准确率、平均 IoU 与块级文本编辑距离。
+"""
+
+import os
+import json
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# 与导入方使用同一份 bbox / clean_jsonl / teds 模块：从仓库根目录作为 utils.page_score 导入时用包内相对导入，
+# 在 utils/ 下作为脚本的同级模块导入时直接按模块名导入
+if __package__:
+    from .bbox import iter_blocks, iou_matrix, match_boxes
+    from .clean_jsonl import clean_text
+    from .teds import normalized_edit_distance, teds
+else:
+    from bbox import iter_blocks, iou_matrix, match_boxes
+    from clean_jsonl import clean_text
+    from teds import normalized_edit_distance, teds
+
+# 不参与文本编辑距离的块类别
+NON_TEXT_CATEGORIES = {"table", "image", "formula"}
+
+
+def load_records(path: str, field: str) -> Dict[str, str]:
+    """读取 jsonl，返回 图片文件名 → 指定字段"""
+    records = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                records[os.path.basename(rec["image"])] = rec.get(field) or ""
+    return records
+
+
+def page_text(blocks: List[Dict[str, Any]]) -> str:
+    return "\n".join(b["text"] for b in blocks if b["category"] not in NON_TEXT_CATEGORIES)
+
+
+def match_tables(pred_tables, gt_tables, iou_threshold):
+    """标注表格 → 预测表格：先按 IoU 匹配，剩下的按出现顺序配对"""
+    pairs = dict((j, i) for i, j in match_boxes(
+        iou_matrix([b["bbox"] or [0, 0, 0, 0] for b in pred_tables],
+                   [b["bbox"] or [0, 0, 0, 0] for b in gt_tables]),
+        iou_threshold,
+    ))
+    free_pred = [i for i in range(len(pred_tables)) if i not in pairs.values()]
+    for j in range(len(gt_tables)):
+        if j not in pairs and free_pred:
+            pairs[j] = free_pred.pop(0)
+    return pairs
+
+
+def score_page(args) -> Dict[str, Any]:
+    image, pred_html, gt_html, iou_threshold, normalize = args
+    if normalize:
+        pred_html, gt_html = clean_text(pred_html), clean_text(gt_html)
+    pred_blocks, gt_blocks = iter_blocks(pred_html), iter_blocks(gt_html)
+
+    result = {
+        "image": image,
+        "missing": not pred_html,
+        "text_ned": normalized_edit_distance(page_text(pred_blocks), page_text(gt_blocks)),
+    }
+
+    # 表格 TEDS（逐表格）
+    pred_tables = [b for b in pred_blocks if b["category"] == "table"]
+    gt_tables = [b for b in gt_blocks if b["category"] == "table"]
+    table_pairs = match_tables(pred_tables, gt_tables, iou_threshold)
+    result["table_teds"] = [
+        teds(pred_tables[table_pairs[j]]["html"], gt["html"]) if j in table_pairs else 0.0
+        for j, gt in enumerate(gt_tables)
+    ]
+
+    # 版面块匹配
+    pred_boxed = [b for b in pred_blocks if b["bbox"]]
+    gt_boxed = [b for b in gt_blocks if b["bbox"]]
+    iou = iou_matrix([b["bbox"] for b in pred_boxed], [b["bbox"] for b in gt_boxed])
+    pairs = match_boxes(iou, iou_threshold)
+    result.update({
+        "n_pred": len(pred_boxed),
+        "n_gt": len(gt_boxed),
+        "n_matched": len(pairs),
+        "category_hits": sum(pred_boxed[i]["category"] == gt_boxed[j]["category"] for i, j in pairs),
+        "iou_sum": float(sum(iou[i, j] for i, j in pairs)),
+        "block_text_ned": [
+            normalized_edit_distance(pred_boxed[i]["text"], gt_boxed[j]["text"])
+            for i, j in pairs if gt_boxed[j]["category"] not in NON_TEXT_CATEGORIES
+        ],
+    })
+    return result
+
+
+def _mean(values) -> Optional[float]:
+    return float(np.mean(values)) if len(values) else None
+
+
+def summarize(pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """逐页结果 → 汇总：文本为页面平均，TEDS 为表格平均，版面指标为全部块的微平均"""
+    n_pred = sum(p["n_pred"] for p in pages)
+    n_gt = sum(p["n_gt"] for p in pages)
+    n_matched = sum(p["n_matched"] for p in pages)
+    precision = n_matched / n_pred if n_pred else 0.0
+    recall = n_matched / n_gt if n_gt else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    tables = [s for p in pages for s in p["table_teds"]]
+    text_ned = _mean([p["text_ned"] for p in pages])
+
+    summary = {
+        "pages": len(pages),
+        "missing": sum(p["missing"] for p in pages),
+        "text_ned": text_ned,
+        "table_teds": _mean(tables),
+        "tables": len(tables),
+        "layout_precision": precision,
+        "layout_recall": recall,
+        "layout_f1": f1,
+        "category_acc": sum(p["category_hits"] for p in pages) / n_matched if n_matched else None,
+        "mean_iou": sum(p["iou_sum"] for p in pages) / n_matched if n_matched else None,
+        "block_text_ned": _mean([s for p in pages for s in p["block_text_ned"]]),
+    }
+    # 综合分：文本相似度、表格 TEDS、版面 F1 的平均，便于挑选 checkpoint
+    parts = [1 - text_ned if text_ned is not None else None, summary["table_teds"], f1]
+    summary["overall"] = _mean([v for v in parts if v is not None])
+    return summary
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量数据准备流水线：转换（OmniDocBench / dots.ocr）→ 清理（clean_jsonl）→ LLaMA Factory 格式。
+
+每个阶段在 work_dir/.manifest/<阶段名>.json 中记录：
+1. 阶段版本：阶段所用模块源码 + 参数的哈希，代码或参数变化时该阶段全部重算；
+2. 每条输入记录的内容哈希 → 该记录的输出。
+重新运行时只重算内容哈希未命中的记录，其余直接复用，修改少量标注后几秒即可完成。
+
+用法:
+  python prepare_data.py --source omnidoc --input ../datasets/OmniDocBench/OmniDocBench.json \\
+      --work_dir ../datasets/OmniDocBench/prepared
+  python prepare_data.py --source dotsocr --input ../dataset/vlm-challenge-B-complete/label/train_dotsocr_generated.jsonl \\
+      --work_dir ../dataset/vlm-challenge-B-complete/prepared --image_root <image 根目录>
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import time
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+
+import clean_jsonl
+import convert_dotsocr_to_qwen25
+import convert_omnidoc_to_qwen25
+import convert_to_llama_factory
+
+MANIFEST_DIR = ".manifest"
+
+
+def record_hash(record: str) -> str:
+    """单条记录的内容哈希"""
+    return hashlib.sha1(record.encode("utf-8")).hexdigest()
+
+
+def stage_version(modules, params):
+    """阶段版本：模块源码 + 参数的哈希"""
+    h = hashlib.sha1()
+    for module in modules:
+        h.update(inspect.getsource(module).encode("utf-8"))
+    h.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _convert_omnidoc(record):
+    item = convert_omnidoc_to_qwen25.convert_page(json.loads(record))
+    return None if item is None else json.dumps(item, ensure_ascii=False)
+
+
+def _convert_dotsocr(record):
+    return json.dumps(convert_dotsocr_to_qwen25.convert_record(json.loads(record)), ensure_ascii=False)
+
+
+def _clean(record, field):
+    out = clean_jsonl.clean_line(record, field)
+    return None if out is None else out.rstrip("\n")
+
+
+def _to_llama_factory(record, image_root):
+    # id 与记录位置有关，由 assign_sample_ids 统一填写，这里的输出只取决于记录内容，可按内容哈希复用
+    sample = convert_to_llama_factory.build_sample(json.loads(record), image_root, None)
+    return json.dumps(sample, ensure_ascii=False)
+
+
+def assign_sample_ids(samples, inputs, stem):
+    """
+    按输入记录在上一阶段输出文件（每条一行）中的字节偏移填写样本 id，
+    与 convert_to_llama_factory 转换同一文件时的 id 规则一致（前缀为源数据文件名）
+    """
+    if len(samples) != len(inputs):
+        raise ValueError(f"llama_factory 阶段输出 {len(samples)} 条，与输入 {len(inputs)} 条不一一对应")
+    offset, outputs = 0, []
+    for sample, record in zip(samples, inputs):
+        obj = json.loads(sample)
+        obj["id"] = convert_to_llama_factory.sample_id(stem, offset)
+        outputs.append(json.dumps(obj, ensure_ascii=False))
+        offset += len(record.encode("utf-8")) + 1
+    return outputs
+
+
+class Stage:
+    """流水线中的一个阶段：fn 把一条 JSON 记录（字符串）映射为一条输出记录或 None（丢弃）"""
+
+    def __init__(self, name, fn, modules, params=None):
+        self.name = name
+        self.fn = fn
+        self.params = params or {}
+        self.version = stage_version(modules, self.params)
+
+
+def build_stages(source, field="suffix", image_root=""):
+    if source == "omnidoc":
+        convert = Stage("converted", _convert_omnidoc, [convert_omnidoc_to_qwen25])
+    elif source == "dotsocr":
+        convert = Stage("converted", _convert_dotsocr, [convert_dotsocr_to_qwen25])
+    else:
+        raise ValueError(f"Unknown source: {source}")
+    return [
+        convert,
+        Stage("cleaned", partial(_clean, field=field), [clean_jsonl], {"field": field}),
+        Stage("llama_factory", partial(_to_llama_factory, image_root=image_root),
+              [convert_to_llama_factory], {"image_root": image_root}),
+    ]
+
+
+def read_source(source, input_path):
+    """读取源数据，统一为 JSON 字符串列表（OmniDocBench 的每个页面序列化为一条记录）"""
+    with open(input_path, "r", encoding="utf-8") as f:
+        if source == "omnidoc":
+            return [json.dumps(page, ensure_ascii=False, sort_keys=True)
+                    for page in convert_omnidoc_to_qwen25.iter_json_array(f)]
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_manifest(path, version):
+    """读取阶段清单；版本不一致（代码或参数变化）时视为空"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != version:
+        return {}
+    return manifest["records"]
+
+
+def write_atomic(path, lines):
+    """先写临时文件再替换，避免中断时留下半个文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line + "\n")
+    os.replace(tmp_path, path)
+
+
+def run_stage(stage, records, work_dir, num_workers=1, force=False):
+    """运行一个阶段：命中清单的记录直接复用，其余重新计算；返回按输入顺序排列的输出记录"""
+    t0 = time.time()
+    manifest_path = os.path.join(work_dir, MANIFEST_DIR, f"{stage.name}.json")
+    cached = {} if force else load_manifest(manifest_path, stage.version)
+
+    keys = [record_hash(r) for r in records]
+    todo = {}
+    for key, record in zip(keys, records):
+        if key not in cached and key not in todo:
+            todo[key] = record
+
+    computed = {}
+    if todo:
+        pending = list(todo.values())
+        if num_workers > 1 and len(pending) > num_workers:
+            with Pool(num_workers) as pool:
+                outputs = pool.map(stage.fn, pending, chunksize=max(1, len(pending) // (num_workers * 8)))
+        else:
+            outputs = [stage.fn(r) for r in pending]
+        computed = dict(zip(todo, outputs))
+
+    # 新清单只保留本次输入涉及的记录，已删除的记录随之清除
+    results = {}
+    outputs = []
+    for key in keys:
+        out = cached[key] if key in cached else computed[key]
+        results[key] = out
+        if out is not None:
+            outputs.append(out)
+
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"stage": stage.name, "version": stage.version, "params": stage.params,
+                   "records": results}, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+    print(f"[{stage.name}] 输入 {len(records)} 条，复用 {sum(k in cached for k in keys)} 条，"
+          f"重算 {len(todo)} 条，输出 {len(outputs)} 条，耗时 {time.time() - t0:.2f}s")
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental data preparation pipeline")
+    parser.add_argument("--source", choices=["omnidoc", "dotsocr"], required=True, help="源数据格式")
+    parser.add_argument("--input", type=str, required=True, help="源数据文件")
+    parser.add_argument("--work_dir", type=str, required=True, help="各阶段输出与清单所在目录")
+    parser.add_argument("--field", type=str, default="suffix", help="需要清理的字段")
+    parser.add_argument("--image_root", type=str, default=None,
+                        help="LLaMA Factory 样本的 image 路径前缀，默认根据输入文件名推断")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(), help="重算记录时的进程数")
+    parser.add_argument("--force", action="store_true", help="忽略清单，全部重算")
+    args = parser.parse_args()
+
+    image_root = args.image_root
+    if image_root is None:
+        image_root = convert_to_llama_factory.infer_image_root(Path(args.input))
+        print(f"📁 自动检测 image 根目录：{image_root}")
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    t0 = time.time()
+    records = read_source(args.source, args.input)
+    print(f"[source] 读取 {len(records)} 条记录，耗时 {time.time() - t0:.2f}s")
+
+    stages = build_stages(args.source, args.field, image_root.rstrip("/"))
+    for stage in stages:
+        outputs = run_stage(stage, records, args.work_dir, args.num_workers, args.force)
+        if stage.name == "llama_factory":
+            outputs = assign_sample_ids(outputs, records, Path(args.input).stem)
+        records = outputs
+        write_atomic(os.path.join(args.work_dir, f"{stage.name}.jsonl"), records)
+
+    print(f"✅ 流水线完成，总耗时 {time.time() - t0:.2f}s，输出目录: {args.work_dir}")
+
+
+if __name__ == "__main__":
+    main()
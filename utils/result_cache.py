@@ -0,0 +1,170 @@
+"""
+推理结果的磁盘缓存（SQLite），供 eval.py 使用：
+- 键 = 图片内容 sha256 + prompt + GenerationConfig + 模型目录指纹 + 预处理参数，任一项变化即失效；
+- 值为后处理之前的原始输出与送入模型的图像尺寸，命中后重新执行后处理，修改后处理无需重新推理；
+- 按总字节数限制大小，超出时按最近访问时间淘汰（LRU）；总大小在内存中累加，只有超过上限时才查询全表核对；
+- 同时保存流式推理提前结束的原因（stop_reason），命中后恢复结果中的 truncated 字段；
+- WAL 模式 + busy timeout，多个推理进程可共享同一个缓存文件。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import dataclasses
+from typing import Any, Dict, Optional, Tuple
+
+# 淘汰时降到上限的该比例以下，避免每次写入都触发淘汰
+EVICT_TARGET = 0.9
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def model_fingerprint(model_dir: str) -> str:
+    """
+    模型目录指纹：各文件的名称、大小与修改时间（纳秒）。
+    不读取权重内容，重新合并或替换任一分片都会改变指纹；复制到别的机器后指纹也会变化（只会多算，不会误用）
+    """
+    entries = []
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if os.path.isfile(path):
+            st = os.stat(path)
+            entries.append([name, st.st_size, st.st_mtime_ns])
+    return hashlib.sha256(json.dumps(entries).encode("utf-8")).hexdigest()
+
+
+def config_dict(cfg: Any) -> Dict[str, Any]:
+    """GenerationConfig 等配置对象 → 可序列化的字典"""
+    if dataclasses.is_dataclass(cfg):
+        return dataclasses.asdict(cfg)
+    return dict(vars(cfg))
+
+
+class ResultCache:
+    """
+    线程安全的 SQLite 结果缓存。
+    context 为本次运行中与图片无关的部分（prompt、生成参数、模型指纹、预处理参数），
+    与图片 sha256 一起组成缓存键
+    """
+
+    def __init__(self, path: str, context: Dict[str, Any], max_bytes: int = 20 << 30):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.context = json.dumps(context, sort_keys=True, ensure_ascii=False, default=str)
+        self.hits = self.misses = self.stored = self.evicted = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, answer TEXT NOT NULL, "
+            "sent_w INTEGER, sent_h INTEGER, orig_w INTEGER, orig_h INTEGER, "
+            "latency REAL, size INTEGER NOT NULL, created REAL, last_access REAL, stop_reason TEXT)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        if "stop_reason" not in columns:
+            self._conn.execute("ALTER TABLE results ADD COLUMN stop_reason TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results(last_access)")
+        self._conn.commit()
+        # 总大小的本地估计：其他进程的写入不计入，超过上限时再查询全表得到准确值
+        self._total = self._query_total()
+
+    def key(self, image_sha256: str) -> str:
+        return hashlib.sha256(f"{image_sha256}\n{self.context}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """命中时返回 {answer, sent_size, orig_size, latency, stop_reason} 并刷新访问时间"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer, sent_w, sent_h, orig_w, orig_h, latency, stop_reason FROM results WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        answer, sent_w, sent_h, orig_w, orig_h, latency, stop_reason = row
+        return {
+            "answer": answer,
+            "sent_size": (sent_w, sent_h),
+            "orig_size": (orig_w, orig_h),
+            "latency": latency,
+            "stop_reason": stop_reason,
+        }
+
+    def put(
+        self,
+        key: str,
+        answer: str,
+        sent_size: Tuple[int, int],
+        orig_size: Tuple[int, int],
+        latency: Optional[float] = None,
+        stop_reason: Optional[str] = None,
+    ) -> None:
+        """写入后处理之前的原始输出（流式推理提前结束时附带原因）；空输出（推理失败）不缓存"""
+        if not answer:
+            return
+        now = time.time()
+        size = len(answer.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, answer, *sent_size, *orig_size, latency, size, now, now, stop_reason),
+            )
+            self._conn.commit()
+            self.stored += 1
+            self._total += size - (old[0] if old else 0)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _query_total(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._query_total()
+
+    def _evict(self) -> None:
+        """
+        本地估计的总大小超过上限时调用（调用方持有锁）：先查询全表得到准确值，仍超过上限时
+        按最近访问时间从旧到新删除，直到降到上限的 EVICT_TARGET 以下
+        """
+        self._total = self._query_total()
+        if self._total <= self.max_bytes:
+            return
+        excess = self._total - int(self.max_bytes * EVICT_TARGET)
+        freed, victims = 0, []
+        for key, size in self._conn.execute("SELECT key, size FROM results ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM results WHERE key = ?", victims)
+        self._conn.commit()
+        self.evicted += len(victims)
+        self._total -= freed
+
+    def report(self) -> None:
+        total = self.hits + self.misses
+        print(
+            f"[Cache] hits {self.hits}/{total} ({self.hits / max(total, 1):.1%})  stored {self.stored}  "
+            f"evicted {self.evicted}  size {self.total_bytes() / (1 << 20):.1f}MB  -> {self.path}"
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,291 @@
+"""
+流式生成的输出检查，供 eval.py 的 --stream 模式使用：
+- RepetitionDetector：增量检测输出尾部的重复循环（同一片段连续重复多次），检测到后可提前结束生成；
+- TagTracker：增量跟踪标签的开闭平衡，</html> 闭合后的输出视为多余；
+- repair_html：截断后去掉不完整的结尾标签，并按嵌套顺序补全未闭合的标签。
+不依赖推理引擎，可以在录制的输出流上离线回放：
+
+用法: python stream_guard.py --replay predict.jsonl [--chunk_size 8]
+      （每行含 "deltas"（逐段输出）或 "answer"（按 chunk_size 切段模拟流式））
+      python stream_guard.py --check [stream_guard_cases.jsonl]
+      （回放录制的输出流回归用例：真实循环须截断，含大量相同空行的正常表格须原样保留）
+"""
+
+import os
+import re
+import json
+import argparse
+from typing import List, Optional, Tuple
+
+# 与 bbox.py 相同的标签写法（本模块被 eval.py 以 utils.stream_guard 导入，不依赖同目录模块）
+TAG_RE = re.compile(r"<(/?)([A-Za-z][\w-]*)([^>]*?)(/?)>")
+VOID_TAGS = {"br", "hr", "img", "input", "meta", "link", "col", "area", "base", "wbr", "source"}
+# 超过该长度仍未闭合的 "<..." 不再当作标签等待
+MAX_PARTIAL_TAG = 256
+# 录制的输出流回归用例：每行 {name, deltas, finish_reason, expect_stop, expect_answer}
+CASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stream_guard_cases.jsonl")
+
+
+class RepetitionDetector:
+    """
+    增量检测重复循环：输出尾部由某个长度在 [min_period, max_period] 字符之间的片段连续重复至少 min_repeats 次，
+    且重复部分总长不少于 min_span 字符时判定为循环。
+    去掉标签后可见字符少于 min_text 个的片段（空表格行、"-" 占位行等）在正常表格中也会大量重复，
+    重复部分总长须达到 markup_min_span 才判定为循环。
+    每新增 check_every 个字符检查一次：取尾部 anchor 个字符，在之前的文本中反向查找其出现位置得到候选周期，
+    只校验最近的 max_candidates 个候选，代价与输出长度基本无关
+    """
+
+    def __init__(
+        self,
+        min_repeats: int = 10,
+        min_span: int = 1000,
+        min_text: int = 4,
+        markup_min_span: int = 16000,
+        min_period: int = 8,
+        max_period: int = 4000,
+        anchor: int = 16,
+        check_every: int = 64,
+        max_candidates: int = 8,
+    ):
+        self.min_repeats = min_repeats
+        self.min_span = min_span
+        self.min_text = min_text
+        self.markup_min_span = markup_min_span
+        self.min_period = min_period
+        self.max_period = max_period
+        self.anchor = anchor
+        self.check_every = check_every
+        self.max_candidates = max_candidates
+        self._parts: List[str] = []
+        self._text = ""
+        self._pending = 0
+        self.loop: Optional[Tuple[int, int]] = None  # (循环起点, 周期)
+
+    @property
+    def text(self) -> str:
+        if self._parts:
+            self._text += "".join(self._parts)
+            self._parts = []
+        return self._text
+
+    def feed(self, delta: str) -> bool:
+        """追加一段输出，检测到循环时返回 True（之后不再检查）"""
+        if self.loop is not None:
+            return True
+        self._parts.append(delta)
+        self._pending += len(delta)
+        if self._pending < self.check_every:
+            return False
+        self._pending = 0
+        return self._check()
+
+    def _check(self) -> bool:
+        text = self.text
+        n, a = len(text), self.anchor
+        if n < max(self.min_span, a + self.min_period):
+            return False
+        tail = text[n - a:]
+        lowest = max(0, n - a - self.max_period)
+        pos = n - a
+        for _ in range(self.max_candidates):
+            pos = text.rfind(tail, lowest, pos + a - 1)
+            if pos < 0:
+                return False
+            period = n - a - pos
+            if period < self.min_period:
+                continue
+            unit = text[n - period:]
+            span = self.min_span if self._has_text(unit) else self.markup_min_span
+            repeats = max(self.min_repeats, -(-span // period))
+            if repeats * period > n:
+                continue
+            if text[n - repeats * period:] == unit * repeats:
+                # 向前延伸到周期区间的最早起点
+                start = n - repeats * period
+                while start >= period and text[start - period:start] == unit:
+                    start -= period
+                while start > 0 and text[start - 1] == text[start - 1 + period]:
+                    start -= 1
+                self.loop = (start, period)
+                return True
+        return False
+
+    def _has_text(self, unit: str) -> bool:
+        """
+        片段去掉标签与空白后是否至少有 min_text 个字符：
+        先化为最短重复单元（两行空行组成的片段按一行算），再轮转到某个 "<" 处（片段可能从标签中间开始）
+        """
+        root = (unit + unit).find(unit, 1)
+        unit = unit[:root]
+        lt = unit.find("<")
+        if lt > 0:
+            unit = unit[lt:] + unit[:lt]
+        return len("".join(TAG_RE.sub("", unit).split())) >= self.min_text
+
+    def cut(self) -> str:
+        """
+        去掉循环后的文本，循环片段只保留一份：在第二个周期内选嵌套最浅的标签结束位置截断
+        （如表格行循环截在 </tr> 之后），没有标签时截在一个周期处；未检测到循环时返回全部文本
+        """
+        if self.loop is None:
+            return self.text
+        start, period = self.loop
+        text = self.text
+        best, best_depth, depth = start + period, None, 0
+        for m in TAG_RE.finditer(text, 0, start + 2 * period):
+            closing, tag, self_closing = m.group(1), m.group(2).lower(), m.group(4)
+            if not (tag in VOID_TAGS or self_closing):
+                depth += -1 if closing else 1
+            if m.end() >= start + period and (best_depth is None or depth < best_depth):
+                best, best_depth = m.end(), depth
+        return text[:best]
+
+
+class TagTracker:
+    """增量跟踪标签栈：跨段的不完整标签暂存到下一段再解析；记录 </html> 闭合的位置"""
+
+    def __init__(self):
+        self.stack: List[str] = []
+        self.root_closed_at: Optional[int] = None
+        self._carry = ""
+        self._offset = 0  # _carry 之前已消费的字符数
+
+    def feed(self, delta: str) -> None:
+        buf = self._carry + delta
+        last = 0
+        for m in TAG_RE.finditer(buf):
+            last = m.end()
+            closing, tag, self_closing = m.group(1), m.group(2).lower(), m.group(4)
+            if tag in VOID_TAGS or self_closing:
+                continue
+            if not closing:
+                self.stack.append(tag)
+                continue
+            if tag in self.stack:
+                del self.stack[len(self.stack) - 1 - self.stack[::-1].index(tag):]
+            if tag == "html" and self.root_closed_at is None:
+                self.root_closed_at = self._offset + m.end()
+        lt = buf.rfind("<", last)
+        keep = lt if lt >= 0 and len(buf) - lt <= MAX_PARTIAL_TAG else len(buf)
+        self._offset += keep
+        self._carry = buf[keep:]
+
+    @property
+    def balanced(self) -> bool:
+        return not self.stack and not self._carry
+
+
+def repair_html(text: str) -> str:
+    """去掉结尾不完整的标签，再按嵌套顺序补全未闭合的标签（多余的闭合标签忽略）"""
+    lt = text.rfind("<")
+    if lt > text.rfind(">"):
+        text = text[:lt]
+    stack = []
+    for m in TAG_RE.finditer(text):
+        closing, tag, self_closing = m.group(1), m.group(2).lower(), m.group(4)
+        if tag in VOID_TAGS or self_closing:
+            continue
+        if not closing:
+            stack.append(tag)
+        elif tag in stack:
+            del stack[len(stack) - 1 - stack[::-1].index(tag):]
+    return text + "".join(f"</{tag}>" for tag in reversed(stack))
+
+
+class StreamGuard:
+    """
+    组合重复检测与标签跟踪：feed 返回提前结束的原因（"repetition"、"closed"）或 None；
+    finish 按结束原因返回最终文本：循环截断后修复、</html> 之后的内容丢弃、达到长度上限时修复，正常结束原样返回
+    """
+
+    def __init__(self, **detector_kwargs):
+        self.detector = RepetitionDetector(**detector_kwargs)
+        self.tags = TagTracker()
+        self.stop_reason: Optional[str] = None
+
+    def feed(self, delta: str) -> Optional[str]:
+        if self.stop_reason is None:
+            self.tags.feed(delta)
+            if self.detector.feed(delta):
+                self.stop_reason = "repetition"
+            elif self.tags.root_closed_at is not None and len(self.detector.text) > self.tags.root_closed_at:
+                self.stop_reason = "closed"
+        return self.stop_reason
+
+    def finish(self, finish_reason: Optional[str] = None) -> str:
+        text = self.detector.text
+        if self.stop_reason == "repetition":
+            return repair_html(self.detector.cut())
+        if self.stop_reason == "closed":
+            return text[:self.tags.root_closed_at]
+        if finish_reason == "length":
+            return repair_html(text)
+        return text
+
+
+def replay(path: str, chunk_size: int = 8, **detector_kwargs) -> None:
+    """在录制的输出上回放，打印会被提前结束的页面与可省下的字符数"""
+    total = stopped = saved = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            deltas = rec.get("deltas")
+            if deltas is None:
+                answer = rec.get("answer") or ""
+                deltas = [answer[i:i + chunk_size] for i in range(0, len(answer), chunk_size)]
+            guard = StreamGuard(**detector_kwargs)
+            consumed = 0
+            for delta in deltas:
+                consumed += len(delta)
+                if guard.feed(delta):
+                    break
+            length = sum(len(d) for d in deltas)
+            total += 1
+            if guard.stop_reason:
+                stopped += 1
+                saved += length - consumed
+                print(f"[{guard.stop_reason}] {rec.get('image', '?')}: stop at {consumed}/{length} chars, "
+                      f"kept {len(guard.finish())}")
+    print(f"[Replay] {stopped}/{total} streams stopped early, {saved} chars not generated")
+
+
+def check_cases(path: str = CASES_PATH, **detector_kwargs) -> bool:
+    """回放回归用例，核对提前结束的原因与修复后的输出，返回是否全部通过"""
+    failed = 0
+    with open(path, "r", encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    for case in cases:
+        guard = StreamGuard(**detector_kwargs)
+        for delta in case["deltas"]:
+            if guard.feed(delta):
+                break
+        answer = guard.finish(case["finish_reason"])
+        ok = guard.stop_reason == case["expect_stop"] and answer == case["expect_answer"]
+        failed += not ok
+        print(f"[{'OK' if ok else 'FAIL'}] {case['name']}: stop {guard.stop_reason} "
+              f"(expect {case['expect_stop']}), kept {len(answer)}/{sum(len(d) for d in case['deltas'])} chars")
+    print(f"[Check] {len(cases) - failed}/{len(cases)} cases passed")
+    return failed == 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay recorded generations through the stream guard")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--replay", type=str, help="jsonl with 'deltas' lists or 'answer' strings")
+    group.add_argument("--check", nargs="?", const=CASES_PATH, help="Run the recorded regression cases")
+    parser.add_argument("--chunk_size", type=int, default=8, help="Characters per simulated delta for 'answer'")
+    parser.add_argument("--min_repeats", type=int, default=10, help="Repeats of one fragment that count as a loop")
+    parser.add_argument("--min_span", type=int, default=1000, help="Minimum repeated characters that count as a loop")
+    args = parser.parse_args()
+    if args.check:
+        if not check_cases(args.check, min_repeats=args.min_repeats, min_span=args.min_span):
+            raise SystemExit(1)
+        return
+    replay(args.replay, args.chunk_size, min_repeats=args.min_repeats, min_span=args.min_span)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+"""
+表格结构相似度 TEDS（Tree-Edit-Distance-based Similarity）与字符串编辑距离，供本地评测（score.py）使用。
+
+表格先规范化为 clean_jsonl.format_html_table 的形式（去掉 thead/tbody/tfoot，th 视为 td），
+再以 table → tr → td 树计算编辑距离：插入/删除代价为 1，td 的替换代价为单元格文本的归一化编辑距离，
+标签或 colspan/rowspan 不同时替换代价为 1。TEDS = 1 - 编辑距离 / max(两棵树的节点数)。
+
+大表格（数百个单元格）的加速，结果与朴素 Zhang-Shasha（tree_edit_distance_reference）完全一致：
+- 两棵树相同直接返回 0，首尾相同的行先剥离；
+- 单元格文本距离按文本对缓存；
+- 像 APTED 一样按子问题规模在左路径 / 右路径分解之间选择代价小的一种；
+- 以叶子为 keyroot 的子问题用闭式解，不再逐格动态规划；
+- 大的森林距离子问题沿较长的一维按行向量化（行内插入用累积最小值一次求出）。
+"""
+
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TABLE_SECTION_TAGS = {"thead", "tbody", "tfoot"}
+CELL_TAGS = {"td", "th"}
+
+# 不超过该长度的单元格文本用 NumPy 批量计算两两编辑距离，更长的逐对计算并缓存
+VECTOR_TEXT_LEN = 32
+# 批量计算时每块最多处理的文本对数，控制内存
+PAIR_BLOCK = 1 << 20
+# 森林距离子问题的任一维不小于该值时按行向量化，否则逐格计算
+VECTOR_FOREST_SIZE = 48
+
+
+def edit_distance(a: str, b: str) -> int:
+    """
+    Levenshtein 距离（Myers / Hyyrö 位并行算法）：较短的字符串编码为 Python 大整数位向量，
+    另一字符串的每个字符只需常数次整数运算；单元格短文本与整页长文本都比逐行 NumPy 动态规划快约一个数量级
+    """
+    if a == b:
+        return 0
+    if len(a) > len(b):
+        a, b = b, a
+    m = len(a)
+    if not m:
+        return len(b)
+
+    peq = {}
+    for i, ch in enumerate(a):
+        peq[ch] = peq.get(ch, 0) | (1 << i)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    for ch in b:
+        eq = peq.get(ch, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh <<= 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+    return score
+
+
+def normalized_edit_distance(a: str, b: str) -> float:
+    """编辑距离 / 较长字符串的长度，取值 [0, 1]，两者都为空时为 0"""
+    longest = max(len(a), len(b))
+    return edit_distance(a, b) / longest if longest else 0.0
+
+
+@lru_cache(maxsize=1 << 18)
+def _cell_cost(a: str, b: str) -> float:
+    # 调用方保证 a <= b，(a, b) 与 (b, a) 共用一条缓存
+    longest = max(len(a), len(b))
+    return edit_distance(a, b) / longest if longest else 0.0
+
+
+def _batch_edit_distance(texts_a: Sequence[str], texts_b: Sequence[str]) -> np.ndarray:
+    """
+    两组短文本的两两编辑距离矩阵：把文本补齐成码点数组，对所有文本对同时推进同一个 (i, j) 动态规划格子，
+    每个 (i, j) 只需一次向量运算；第 i 行结束时取出长度恰为 i 的文本在各自 j = len(b) 处的结果
+    """
+    na, nb = len(texts_a), len(texts_b)
+    la = np.array([len(t) for t in texts_a], dtype=np.int64)
+    lb = np.array([len(t) for t in texts_b], dtype=np.int64)
+    La, Lb = int(la.max(initial=0)), int(lb.max(initial=0))
+    A = np.zeros((na, max(La, 1)), dtype=np.uint32)
+    B = np.zeros((nb, max(Lb, 1)), dtype=np.uint32)
+    for k, t in enumerate(texts_a):
+        A[k, :len(t)] = np.frombuffer(t.encode("utf-32-le"), dtype=np.uint32)
+    for k, t in enumerate(texts_b):
+        B[k, :len(t)] = np.frombuffer(t.encode("utf-32-le"), dtype=np.uint32)
+
+    result = np.empty((na, nb), dtype=np.int64)
+    cols = np.arange(nb)
+    block = max(1, PAIR_BLOCK // max(nb, 1))
+    for start in range(0, na, block):
+        a, la_blk = A[start:start + block], la[start:start + block]
+        res = result[start:start + block]
+        n = len(a)
+        prev = np.broadcast_to(np.arange(Lb + 1, dtype=np.int16)[:, None, None], (Lb + 1, n, nb)).copy()
+        res[la_blk == 0] = lb
+        for i in range(1, La + 1):
+            cur = np.empty_like(prev)
+            cur[0] = i
+            ai = a[:, i - 1][:, None]
+            for j in range(1, Lb + 1):
+                np.minimum(prev[j], cur[j - 1], out=cur[j])
+                cur[j] += 1
+                np.minimum(cur[j], prev[j - 1] + (ai != B[:, j - 1]), out=cur[j])
+            prev = cur
+            done = la_blk == i
+            if done.any():
+                res[done] = cur[lb, :, cols][:, done].T
+    return result
+
+
+def pairwise_cell_costs(texts_a: Sequence[str], texts_b: Sequence[str]) -> np.ndarray:
+    """两组单元格文本的两两归一化编辑距离矩阵；短文本批量向量化计算，长文本逐对计算并缓存"""
+    costs = np.empty((len(texts_a), len(texts_b)))
+    short_a = [i for i, t in enumerate(texts_a) if len(t) <= VECTOR_TEXT_LEN]
+    short_b = [j for j, t in enumerate(texts_b) if len(t) <= VECTOR_TEXT_LEN]
+    if short_a and short_b:
+        sa = [texts_a[i] for i in short_a]
+        sb = [texts_b[j] for j in short_b]
+        longest = np.maximum.outer([len(t) for t in sa], [len(t) for t in sb])
+        dist = _batch_edit_distance(sa, sb)
+        costs[np.ix_(short_a, short_b)] = np.divide(dist, longest, out=np.zeros(dist.shape), where=longest > 0)
+
+    short_a, short_b = set(short_a), set(short_b)
+    for i, a in enumerate(texts_a):
+        for j, b in enumerate(texts_b):
+            if i not in short_a or j not in short_b:
+                costs[i, j] = _cell_cost(a, b) if a <= b else _cell_cost(b, a)
+    return costs
+
+
+class TableNode:
+    __slots__ = ("tag", "colspan", "rowspan", "text", "children")
+
+    def __init__(self, tag, colspan=1, rowspan=1):
+        self.tag = tag
+        self.colspan = colspan
+        self.rowspan = rowspan
+        self.text = ""
+        self.children: List["TableNode"] = []
+
+    def size(self) -> int:
+        return 1 + sum(c.size() for c in self.children)
+
+    def signature(self, structure_only: bool = False) -> Tuple:
+        """子树的规范形式，用于判断两棵子树是否完全相同"""
+        return (self.tag, self.colspan, self.rowspan, "" if structure_only else self.text,
+                tuple(c.signature(structure_only) for c in self.children))
+
+
+class _TableParser(HTMLParser):
+    """把 HTML 表格解析为 table → tr → td 树；单元格内的其它标签只保留文本"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root: Optional[TableNode] = None
+        self.stack: List[TableNode] = []
+        self.cell: Optional[TableNode] = None
+        self.cell_text: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in TABLE_SECTION_TAGS:
+            return
+        if tag == "table":
+            if self.root is None:
+                self.root = TableNode("table")
+                self.stack = [self.root]
+            return
+        if not self.stack:
+            return
+        if tag == "tr":
+            self._close_cell()
+            row = TableNode("tr")
+            self.stack[0].children.append(row)
+            self.stack[1:] = [row]
+        elif tag in CELL_TAGS:
+            self._close_cell()
+            attrs = dict(attrs)
+            if len(self.stack) == 1:
+                # 缺少 <tr> 时补一行
+                row = TableNode("tr")
+                self.stack[0].children.append(row)
+                self.stack.append(row)
+            self.cell = TableNode("td", _span(attrs.get("colspan")), _span(attrs.get("rowspan")))
+            self.stack[1].children.append(self.cell)
+
+    def handle_endtag(self, tag):
+        if tag in CELL_TAGS or tag == "tr" or tag == "table":
+            self._close_cell()
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell_text.append(data)
+
+    def _close_cell(self):
+        if self.cell is not None:
+            self.cell.text = "".join(self.cell_text).strip()
+            self.cell = None
+            self.cell_text = []
+
+
+def _span(value) -> int:
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def parse_table(html: str) -> Optional[TableNode]:
+    """解析 html 中的第一个表格，没有表格时返回 None"""
+    parser = _TableParser()
+    parser.feed(html)
+    parser.close()
+    parser._close_cell()
+    return parser.root
+
+
+def _postorder(root: TableNode, mirror: bool = False):
+    """后序遍历的节点列表与每个节点最左叶子的下标；mirror=True 时子节点逆序（用于右路径分解）"""
+    nodes, leftmost = [], []
+
+    def walk(node):
+        first = None
+        for child in (reversed(node.children) if mirror else node.children):
+            lm = walk(child)
+            if first is None:
+                first = lm
+        nodes.append(node)
+        leftmost.append(len(nodes) - 1 if first is None else first)
+        return leftmost[-1]
+
+    walk(root)
+    return nodes, leftmost
+
+
+def _keyroots(leftmost):
+    # 每个最左叶子对应的最高节点（后序下标最大）
+    highest = {}
+    for i, lm in enumerate(leftmost):
+        highest[lm] = i
+    return sorted(highest.values())
+
+
+def rename_cost(a: TableNode, b: TableNode, structure_only: bool = False) -> float:
+    if a.tag != b.tag or a.colspan != b.colspan or a.rowspan != b.rowspan:
+        return 1.0
+    if a.tag == "td" and not structure_only:
+        return normalized_edit_distance(a.text, b.text)
+    return 0.0
+
+
+def tree_edit_distance_reference(t1: TableNode, t2: TableNode, structure_only: bool = False) -> float:
+    """朴素 Zhang-Shasha 树编辑距离，作为 tree_edit_distance 的参照实现（bench_teds.py 逐表校验）"""
+    n1, l1 = _postorder(t1)
+    n2, l2 = _postorder(t2)
+    td = [[0.0] * len(n2) for _ in range(len(n1))]
+
+    for i in _keyroots(l1):
+        for j in _keyroots(l2):
+            li, lj = l1[i], l2[j]
+            rows, cols = i - li + 2, j - lj + 2
+            fd = [[0.0] * cols for _ in range(rows)]
+            for x in range(1, rows):
+                fd[x][0] = fd[x - 1][0] + 1
+            for y in range(1, cols):
+                fd[0][y] = fd[0][y - 1] + 1
+
+            for x in range(1, rows):
+                ni = li + x - 1
+                for y in range(1, cols):
+                    nj = lj + y - 1
+                    if l1[ni] == li and l2[nj] == lj:
+                        fd[x][y] = min(
+                            fd[x - 1][y] + 1,
+                            fd[x][y - 1] + 1,
+                            fd[x - 1][y - 1] + rename_cost(n1[ni], n2[nj], structure_only),
+                        )
+                        td[ni][nj] = fd[x][y]
+                    else:
+                        fd[x][y] = min(
+                            fd[x - 1][y] + 1,
+                            fd[x][y - 1] + 1,
+                            fd[l1[ni] - li][l2[nj] - lj] + td[ni][nj],
+                        )
+    return td[-1][-1]
+
+
+def teds(pred_html: str, gt_html: str, structure_only: bool = False) -> float:
+    """预测表格与标注表格的 TEDS，取值 [0, 1]；任一方没有表格时为 0（两者都没有时为 1）"""
+    pred = parse_table(pred_html) if pred_html else None
+    gt = parse_table(gt_html) if gt_html else None
+    if pred is None or gt is None:
+        return 1.0 if pred is None and gt is None else 0.0
+    distance = tree_edit_distance(pred, gt, structure_only)
+    return 1.0 - distance / max(pred.size(), gt.size())
+
+
+def _strip_common_rows(t1: TableNode, t2: TableNode, structure_only: bool):
+    """剥离两棵树根节点下首尾完全相同的子树（行），返回只含中间部分的新根节点"""
+    c1, c2 = t1.children, t2.children
+    s1 = [c.signature(structure_only) for c in c1]
+    s2 = [c.signature(structure_only) for c in c2]
+    head = 0
+    while head < min(len(s1), len(s2)) and s1[head] == s2[head]:
+        head += 1
+    tail = 0
+    while tail < min(len(s1), len(s2)) - head and s1[-1 - tail] == s2[-1 - tail]:
+        tail += 1
+    if not head and not tail:
+        return t1, t2
+    r1, r2 = TableNode(t1.tag, t1.colspan, t1.rowspan), TableNode(t2.tag, t2.colspan, t2.rowspan)
+    r1.text, r2.text = t1.text, t2.text
+    r1.children = c1[head:len(c1) - tail]
+    r2.children = c2[head:len(c2) - tail]
+    return r1, r2
+
+
+def _decomposition_cost(leftmost) -> int:
+    """非叶子 keyroot 的子树规模之和，两棵树相乘即动态规划的格子数"""
+    return sum(i - leftmost[i] + 1 for i in _keyroots(leftmost) if leftmost[i] != i)
+
+
+def _rename_matrix(n1, n2, structure_only) -> np.ndarray:
+    """全部节点对的替换代价矩阵；单元格文本先去重，再批量计算两两距离"""
+    key_ids = {}
+    k1 = np.array([key_ids.setdefault((a.tag, a.colspan, a.rowspan), len(key_ids)) for a in n1])
+    k2 = np.array([key_ids.setdefault((b.tag, b.colspan, b.rowspan), len(key_ids)) for b in n2])
+    ren = (k1[:, None] != k2[None, :]).astype(np.float64)
+    if structure_only:
+        return ren
+
+    cells1 = [i for i, a in enumerate(n1) if a.tag == "td"]
+    cells2 = [j for j, b in enumerate(n2) if b.tag == "td"]
+    if not cells1 or not cells2:
+        return ren
+    texts1 = sorted({n1[i].text for i in cells1})
+    texts2 = sorted({n2[j].text for j in cells2})
+    pos1 = {t: k for k, t in enumerate(texts1)}
+    pos2 = {t: k for k, t in enumerate(texts2)}
+    costs = pairwise_cell_costs(texts1, texts2)
+    text_costs = costs[np.ix_([pos1[n1[i].text] for i in cells1], [pos2[n2[j].text] for j in cells2])]
+    block = np.ix_(cells1, cells2)
+    ren[block] = np.where(ren[block] == 0, text_costs, ren[block])
+    return ren
+
+
+def tree_edit_distance(t1: TableNode, t2: TableNode, structure_only: bool = False) -> float:
+    """
+    与 tree_edit_distance_reference 结果相同的加速版本：
+    相同树提前返回，剥离首尾相同的行，按子问题规模选择左/右路径分解，叶子 keyroot 用闭式解
+    """
+    if t1.signature(structure_only) == t2.signature(structure_only):
+        return 0.0
+    t1, t2 = _strip_common_rows(t1, t2, structure_only)
+
+    # 左路径与右路径（镜像）分解中选择格子数更少的一种
+    best = None
+    for mirror in (False, True):
+        n1, l1 = _postorder(t1, mirror)
+        n2, l2 = _postorder(t2, mirror)
+        cost = _decomposition_cost(l1) * _decomposition_cost(l2)
+        if best is None or cost < best[0]:
+            best = (cost, n1, l1, n2, l2)
+    _, n1, l1, n2, l2 = best
+
+    N1, N2 = len(n1), len(n2)
+    ren_np = _rename_matrix(n1, n2, structure_only)
+
+    # 单个节点 a 与子树 T：a 映射到 T 中代价最小的节点、其余插入，或删除 a 并插入整棵 T
+    # 后序下子树 T(j) 恰为下标区间 [l(j), j]
+    td_np = np.zeros((N1, N2))
+    leaves1 = [i for i in range(N1) if l1[i] == i]
+    leaves2 = [j for j in range(N2) if l2[j] == j]
+    rows = ren_np[leaves1]
+    for j in range(N2):
+        td_np[leaves1, j] = j - l2[j] + np.minimum(2.0, rows[:, l2[j]:j + 1].min(axis=1))
+    cols = ren_np[:, leaves2]
+    for i in range(N1):
+        td_np[i, leaves2] = i - l1[i] + np.minimum(2.0, cols[l1[i]:i + 1].min(axis=0))
+    ren = ren_np.tolist()
+    td = td_np.tolist()
+
+    kr1 = [i for i in _keyroots(l1) if l1[i] != i]
+    kr2 = [j for j in _keyroots(l2) if l2[j] != j]
+    small1 = [i for i in kr1 if i - l1[i] + 1 < VECTOR_FOREST_SIZE]
+    small2 = [j for j in kr2 if j - l2[j] + 1 < VECTOR_FOREST_SIZE]
+
+    # 第一阶段：两边都较小的子问题逐格计算，它们只依赖更小的子问题
+    for i in small1:
+        li = l1[i]
+        rows = i - li + 2
+        for j in small2:
+            lj = l2[j]
+            cols = j - lj + 2
+            fd = [[0.0] * cols for _ in range(rows)]
+            fd0 = fd[0]
+            for y in range(1, cols):
+                fd0[y] = float(y)
+            for x in range(1, rows):
+                ni = li + x - 1
+                prev, cur = fd[x - 1], fd[x]
+                cur[0] = float(x)
+                ren_i, td_i = ren[ni], td[ni]
+                same_left_i = l1[ni] == li
+                base_row = fd[l1[ni] - li]
+                for y in range(1, cols):
+                    nj = lj + y - 1
+                    best_cost = prev[y] + 1
+                    ins = cur[y - 1] + 1
+                    if ins < best_cost:
+                        best_cost = ins
+                    if same_left_i and l2[nj] == lj:
+                        sub = prev[y - 1] + ren_i[nj]
+                        if sub < best_cost:
+                            best_cost = sub
+                        cur[y] = best_cost
+                        td_i[nj] = best_cost
+                    else:
+                        sub = base_row[l2[nj] - lj] + td_i[nj]
+                        cur[y] = sub if sub < best_cost else best_cost
+
+    # 第二阶段：其余子问题按 keyroot 顺序、沿较长的一维向量化（树编辑距离对两棵树对称，可转置计算）
+    small_pairs = (set(small1), set(small2))
+    td_np = np.array(td)
+    l1_np, l2_np = np.array(l1), np.array(l2)
+    for i in kr1:
+        for j in kr2:
+            if i in small_pairs[0] and j in small_pairs[1]:
+                continue
+            if j - l2[j] >= i - l1[i]:
+                _forest_rows(i, j, l1_np, l2_np, ren_np, td_np)
+            else:
+                _forest_rows(j, i, l2_np, l1_np, ren_np.T, td_np.T)
+    return float(td_np[-1, -1])
+
+
+def _forest_rows(i, j, l1, l2, ren, td):
+    """
+    keyroot 对 (i, j) 的森林距离，以子树 i 的节点为行、子树 j 的节点为列逐行向量化：
+    来自上一行的删除、替换与子树距离先整行算出，行内插入再用 “减下标 → 累积最小 → 加下标” 求出；
+    两个节点都在左路径上时把结果写回 td
+    """
+    li, lj = int(l1[i]), int(l2[j])
+    rows, cols = i - li + 2, j - lj + 2
+    idx = np.arange(cols, dtype=np.float64)
+    col_leftmost = l2[lj:j + 1]
+    on_left_path = col_leftmost == lj
+    base_cols = col_leftmost - lj
+
+    fd = np.empty((rows, cols))
+    fd[0] = idx
+    for x in range(1, rows):
+        ni = li + x - 1
+        prev, cur = fd[x - 1], fd[x]
+        td_row = td[ni, lj:j + 1]
+        candidate = fd[l1[ni] - li][base_cols] + td_row
+        same_left_i = l1[ni] == li
+        if same_left_i:
+            candidate = np.where(on_left_path, prev[:-1] + ren[ni, lj:j + 1], candidate)
+        np.minimum(prev[1:] + 1, candidate, out=cur[1:])
+        cur[0] = x
+        cur -= idx
+        np.minimum.accumulate(cur, out=cur)
+        cur += idx
+        if same_left_i:
+            td_row[on_left_path] = cur[1:][on_left_path]
@@ -1,10 +1,22 @@
-import difflib
+import os
+import re
 import json
+import time
+import hashlib
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from html import escape
 from pathlib import Path
 
 import gradio as gr
 from PIL import Image, ImageDraw, ImageFont
 
+from bbox import iter_tag_boxes
+from page_diff import align_page, rank_pages, text_diff_html
+from teds import normalized_edit_distance
+
 # ---------- 配置 ----------
 DATASET_ROOT = Path("../datasets/vlm-challenge-B-complete")
 IMAGE_FOLDERS = {
@@ -29,46 +41,287 @@ CLASS_COLOR = {
     "header": "yellow",
     "footer": "magenta",
 }
+SEARCH_LIMIT = 50  # 搜索结果最多显示条数
+ZOOM_LEVELS = [0.5, 1.0, 2.0]
+PREVIEW_SIDE = 1280  # 缩放为 1 时预览图的最长边（不超过原图）
+RENDER_CACHE_DIR = DATASET_ROOT / ".vis_cache"  # 渲染结果的磁盘缓存
+MEMORY_CACHE_SIZE = 64  # 内存中保留的渲染结果数
+DISK_CACHE_MAX_FILES = 5000  # 磁盘缓存文件数上限，超出时删除最久未访问的
+RENDER_VERSION = 1  # 修改绘制方式时递增，使旧的缓存失效
+COMPARE_FILES = {  # 对比模式：标注数据集 → 默认的预测文件（eval.py 在对应图片上的输出）
+    "train": DATASET_ROOT / "label" / "predict_train.jsonl",
+    "eval": DATASET_ROOT / "label" / "predict_eval.jsonl",
+}
+COMPARE_COLOR = {"matched": "green", "missed": "red", "spurious": "orange"}
+RANKING_TOP = 200  # 排名表最多显示的页面数
+IMAGE_FIELD_RE = re.compile(rb'"image"\s*:\s*"([^"\\]*)"')
+
+
+# ---------- 数据 ----------
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class _Split:
+    """单个数据集的行偏移索引：第 i 条记录位于 offsets[i]，names/lower 为图片名及其小写形式"""
+
+    def __init__(self, label_file):
+        st = os.stat(label_file)
+        self.version = (st.st_mtime_ns, st.st_size)
+        self.offsets, self.names = [], []
+        with open(label_file, "rb") as f:
+            pos = 0
+            for line in f:
+                if line.strip():
+                    # 只用正则取出图片名，不解析整条 suffix；含转义字符时才完整解析
+                    m = IMAGE_FIELD_RE.search(line)
+                    name = m.group(1).decode("utf-8") if m else json.loads(line)["image"]
+                    self.offsets.append(pos)
+                    self.names.append(name)
+                pos += len(line)
+        self.lower = [n.lower() for n in self.names]
+        self.index_of = {}
+        for i, name in enumerate(self.names):
+            self.index_of.setdefault(name, i)
+        self.postings = defaultdict(set)
+        for i, name in enumerate(self.lower):
+            for gram in trigrams(name):
+                self.postings[gram].add(i)
+
+
+class DatasetStore:
+    """
+    标注/预测文件的缓存：每个数据集首次访问时扫描一遍，记录每行的字节偏移、图片名、
+    文件名 → 索引的字典与文件名 trigram 倒排索引；之后按需 seek 读取单条记录。
+    每次访问检查文件 mtime 与大小，变化时自动重建
+    """
+
+    def __init__(self, label_files):
+        self.label_files = label_files
+        self._splits = {}
+        self._lock = threading.Lock()
+
+    def _split(self, dataset_type):
+        path = self.label_files[dataset_type]
+        if not os.path.exists(path):
+            return None
+        st = os.stat(path)
+        with self._lock:
+            split = self._splits.get(dataset_type)
+            if split is None or split.version != (st.st_mtime_ns, st.st_size):
+                split = self._splits[dataset_type] = _Split(path)
+        return split
+
+    def size(self, dataset_type):
+        split = self._split(dataset_type)
+        return len(split.offsets) if split else 0
+
+    def get(self, dataset_type, index):
+        split = self._split(dataset_type)
+        with open(self.label_files[dataset_type], "rb") as f:
+            f.seek(split.offsets[index])
+            return json.loads(f.readline())
+
+    def name(self, dataset_type, index):
+        return self._split(dataset_type).names[index]
+
+    def find(self, dataset_type, filename):
+        split = self._split(dataset_type)
+        return split.index_of.get(filename) if split else None
+
+    def search(self, dataset_type, query, limit=SEARCH_LIMIT):
+        """
+        按文件名搜索，返回 (索引列表, 是否为子串匹配)。
+        子串匹配：trigram 倒排索引取候选再校验，按 0.6 × 相似度 + 0.4 × 位置得分排序
+        （子串命中时 difflib 的相似度恰为 2|q| / (|q| + |f|)，直接用闭式计算）；
+        没有子串命中时退回近似匹配，按共有 trigram 的比例排序
+        """
+        split = self._split(dataset_type)
+        q = query.strip().lower()
+        if not split or not q:
+            return [], True
+
+        grams = trigrams(q)
+        if grams:
+            candidates = set.intersection(*(split.postings.get(g, set()) for g in grams))
+        else:
+            candidates = range(len(split.lower))
+        scored = []
+        for i in candidates:
+            fname = split.lower[i]
+            pos = fname.find(q)
+            if pos >= 0:
+                sim_score = 2 * len(q) / (len(q) + len(fname))
+                pos_score = 1 - pos / max(len(fname), 1)
+                scored.append((-(0.6 * sim_score + 0.4 * pos_score), i))
+        if scored:
+            return [i for _, i in sorted(scored)[:limit]], True
 
-
-# ---------- 工具 ----------
-def load_jsonl(label_file):
-    data = []
-    with open(label_file, "r", encoding="utf-8") as f:
-        for line in f:
-            data.append(json.loads(line.strip()))
-    return data
+        shared = Counter(i for g in grams for i in split.postings.get(g, ()))
+        threshold = len(grams) / 2
+        fuzzy = sorted((-n, i) for i, n in shared.items() if n >= threshold)
+        return [i for _, i in fuzzy[:limit]], False
 
 
-def parse_bbox(elem):
-    bbox_str = elem.get("data-bbox") or elem.get("db")
-    x1, y1, x2, y2 = map(int, bbox_str.strip().split())
-    return x1, y1, x2, y2
+STORE = DatasetStore(LABEL_FILES)
 
 
-def draw_annotations(image_path, suffix):
-    img = Image.open(image_path).convert("RGB")
-    draw = ImageDraw.Draw(img)
+# ---------- 渲染 ----------
+@lru_cache(maxsize=None)
+def get_font(size=15):
     try:
-        font = ImageFont.truetype("msyh.ttf", 15)
-    except:
-        font = ImageFont.load_default(15)
+        return ImageFont.truetype("msyh.ttf", size)
+    except OSError:
+        return ImageFont.load_default(size)
 
-    from bs4 import BeautifulSoup
-    soup = BeautifulSoup(suffix, "html.parser")
 
-    for tag in soup.find_all(["h2", "p", "div"]):
-        cls = tag.name
-        if cls == "div":
-            cls = tag.get("class")[0] if tag.get("class") else "div"
+def load_preview(image_path, max_side):
+    """解码并缩小到最长边不超过 max_side，JPEG 借助 draft 在解码时直接降采样；返回 (预览图, x 缩放比例, y 缩放比例)"""
+    with Image.open(image_path) as im:
+        orig_w, orig_h = im.size
+        scale = min(max_side / max(orig_w, orig_h), 1.0)
+        im.draft("RGB", (int(orig_w * scale) + 1, int(orig_h * scale) + 1))
+        img = im.convert("RGB")
+    img.thumbnail((max_side, max_side))
+    return img, img.width / orig_w, img.height / orig_h
+
+
+def draw_annotations(image_path, suffix, zoom=1.0):
+    """先把图片缩小到预览尺寸再画框，框坐标按比例换算；标签由轻量扫描器提取，不解析 DOM"""
+    img, sx, sy = load_preview(image_path, int(PREVIEW_SIDE * zoom))
+    draw = ImageDraw.Draw(img)
+    font = get_font(15)
+    for cls, (x1, y1, x2, y2), has_text in iter_tag_boxes(suffix):
         color = CLASS_COLOR.get(cls, "black")
-        x1, y1, x2, y2 = parse_bbox(tag.attrs)
+        x1, y1, x2, y2 = x1 * sx, y1 * sy, x2 * sx, y2 * sy
         draw.rectangle([x1, y1, x2, y2], outline=color, width=2)
-        if tag.get_text(strip=True):
+        if has_text:
             draw.text((x1, y1 - 20), cls, fill=color, font=font)
     return img
 
 
+class RenderCache:
+    """
+    渲染结果缓存：内存 LRU + 磁盘 PNG。键为 图片路径/修改时间/大小、标注内容、缩放等级、配色与绘制版本的哈希；
+    prefetch 在后台线程渲染相邻页面，同一个键正在渲染时 get 直接等待其结果
+    """
+
+    def __init__(self, cache_dir, capacity=MEMORY_CACHE_SIZE, max_files=DISK_CACHE_MAX_FILES, workers=2):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.capacity = capacity
+        self.max_files = max_files
+        self._memory = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(workers)
+        self._writes = 0
+
+    @staticmethod
+    def key(image_path, suffix, zoom):
+        st = os.stat(image_path)
+        head = f"{RENDER_VERSION}|{image_path}|{st.st_mtime_ns}|{st.st_size}|{zoom}|{json.dumps(CLASS_COLOR)}|"
+        return hashlib.sha1(head.encode("utf-8") + suffix.encode("utf-8")).hexdigest()
+
+    def get(self, image_path, suffix, zoom=1.0):
+        key = self.key(image_path, suffix, zoom)
+        future, owner = self._claim(key)
+        if owner:
+            self._fill(key, image_path, suffix, zoom, future)
+        return future.result()
+
+    def prefetch(self, image_path, suffix, zoom=1.0):
+        try:
+            key = self.key(image_path, suffix, zoom)
+        except OSError:
+            return
+        future, owner = self._claim(key)
+        if owner:
+            self._executor.submit(self._fill, key, image_path, suffix, zoom, future)
+
+    def _claim(self, key):
+        """返回 (future, 是否由调用方负责渲染)；已在内存中时返回已完成的 future"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                future = Future()
+                future.set_result(self._memory[key])
+                return future, False
+            if key in self._pending:
+                return self._pending[key], False
+            future = self._pending[key] = Future()
+            return future, True
+
+    def _fill(self, key, image_path, suffix, zoom, future):
+        try:
+            img = self._read_disk(key)
+            if img is None:
+                img = draw_annotations(image_path, suffix, zoom)
+                self._write_disk(key, img)
+        except Exception as exc:
+            with self._lock:
+                self._pending.pop(key, None)
+            future.set_exception(exc)
+            return
+        with self._lock:
+            self._memory[key] = img
+            while len(self._memory) > self.capacity:
+                self._memory.popitem(last=False)
+            self._pending.pop(key, None)
+        future.set_result(img)
+
+    def _read_disk(self, key):
+        path = self.cache_dir / f"{key}.png"
+        try:
+            with Image.open(path) as im:
+                img = im.convert("RGB")
+            os.utime(path)  # 磁盘缓存按修改时间做 LRU
+        except OSError:
+            return None
+        return img
+
+    def _write_disk(self, key, img):
+        path = self.cache_dir / f"{key}.png"
+        tmp = path.with_name(f"{key}.{threading.get_ident()}.tmp")
+        img.save(tmp, format="PNG", compress_level=1)
+        os.replace(tmp, path)
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % 100 == 0
+        if prune:
+            self._prune()
+
+    def _prune(self):
+        files = []
+        for path in self.cache_dir.glob("*.png"):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        files.sort()
+        for _, path in files[:max(len(files) - self.max_files, 0)]:
+            path.unlink(missing_ok=True)
+
+
+RENDER_CACHE = RenderCache(RENDER_CACHE_DIR)
+
+
+# ---------- 工具 ----------
+def page_content(dataset_type, sample):
+    """train/eval 显示标注，test/test_B 显示预测"""
+    if dataset_type in ["train", "eval"]:
+        return sample.get("suffix", "")
+    return sample.get("answer", "")
+
+
+def prefetch_neighbors(dataset_type, index, zoom):
+    """后台预渲染前后两页，翻页时直接命中缓存"""
+    for i in (index + 1, index - 1):
+        if 0 <= i < STORE.size(dataset_type):
+            sample = STORE.get(dataset_type, i)
+            RENDER_CACHE.prefetch(IMAGE_FOLDERS[dataset_type] / sample["image"], page_content(dataset_type, sample), zoom)
+
+
 def get_legend():
     html = "<div style='line-height:1.8em'>"
     for cls, color in CLASS_COLOR.items():
@@ -77,48 +330,191 @@ def get_legend():
     return html
 
 
-def visualize(dataset_type="train", index=0):
-    data = load_jsonl(LABEL_FILES[dataset_type])
-    total = len(data)
+def visualize(dataset_type="train", index=0, zoom=1.0):
+    total = STORE.size(dataset_type)
     if total == 0:
         return None, "<p style='color:red;'>⚠️ 当前数据集为空</p>", get_legend(), f"{dataset_type}（空）"
+    index = int(index)
     if index >= total:
         index = 0
-    sample = data[index]
+    sample = STORE.get(dataset_type, index)
     image_path = IMAGE_FOLDERS[dataset_type] / sample["image"]
 
+    html_content = page_content(dataset_type, sample)
     if dataset_type in ["train", "eval"]:
-        html_content = sample.get("suffix", "")
         title = "<h3 style='margin:5px 0;color:green;'>标注 HTML</h3>"
     else:
-        html_content = sample.get("answer", "")
         title = "<h3 style='margin:5px 0;color:blue;'>预测 HTML</h3>"
 
-    img_with_ann = draw_annotations(image_path, html_content)
+    img_with_ann = RENDER_CACHE.get(image_path, html_content, zoom)
+    prefetch_neighbors(dataset_type, index, zoom)
     filename_title = f"**{dataset_type}[{index + 1}/{total}] - 文件名：** {sample['image']}"
     html_display = f"{title}<pre style='white-space: pre-wrap; word-break: break-word;'>{html_content}</pre>"
     return img_with_ann, html_display, get_legend(), filename_title
 
 
+# ---------- 对比 ----------
+PRED_STORE = DatasetStore({})
+
+
+def prediction_record(pred_path, image):
+    """按图片名取出预测文件中的一条记录（按路径建索引，文件修改后自动重建）"""
+    PRED_STORE.label_files.setdefault(pred_path, Path(pred_path))
+    index = PRED_STORE.find(pred_path, image)
+    return PRED_STORE.get(pred_path, index) if index is not None else {}
+
+
+def draw_blocks(image_path, blocks, status, zoom=1.0):
+    """按对齐状态画框，status 为 块下标 → (状态, 标签)"""
+    img, sx, sy = load_preview(image_path, int(PREVIEW_SIDE * zoom))
+    draw = ImageDraw.Draw(img)
+    font = get_font(15)
+    for k, block in enumerate(blocks):
+        if not block["bbox"] or k not in status:
+            continue
+        state, label = status[k]
+        color = COMPARE_COLOR[state]
+        x1, y1, x2, y2 = block["bbox"]
+        x1, y1, x2, y2 = x1 * sx, y1 * sy, x2 * sx, y2 * sy
+        draw.rectangle([x1, y1, x2, y2], outline=color, width=2)
+        draw.text((x1, y1 - 20), f"{label} {block['category']}", fill=color, font=font)
+    return img
+
+
+def diff_report(aligned, has_pred=True):
+    """页面指标 + 逐块文本差异（匹配块按标注顺序编号，与图上的 #k 对应），其后列出漏检与误检块"""
+    gt_blocks, pred_blocks = aligned["gt_blocks"], aligned["pred_blocks"]
+    teds_text = ", ".join(f"{v:.3f}" for v in aligned["table_teds"]) or "-"
+    rows = [
+        f"<p><b>页面分数 {aligned['score']:.4f}</b>：文本 NED {aligned['text_ned']:.4f}，"
+        f"版面 F1 {aligned['layout_f1']:.4f}，表格 TEDS {teds_text}；"
+        f"匹配 {len(aligned['matches'])} / 漏检 {len(aligned['missed'])} / 误检 {len(aligned['spurious'])}</p>"
+    ]
+    if not has_pred:
+        rows.append("<p style='color:red;'>⚠️ 预测文件中没有这张图片</p>")
+    for k, (i, j, iou) in enumerate(aligned["matches"]):
+        gt, pred = gt_blocks[j], pred_blocks[i]
+        title = f"#{k + 1} {gt['category']}"
+        if pred["category"] != gt["category"]:
+            title += f" → {pred['category']}"
+        ned = normalized_edit_distance(pred["text"], gt["text"])
+        rows.append(
+            f"<div style='margin:6px 0;'><b style='color:{COMPARE_COLOR['matched']};'>{escape(title)}</b> "
+            f"IoU {iou:.2f}  NED {ned:.3f}"
+            f"<div style='white-space:pre-wrap;'>{text_diff_html(pred['text'], gt['text'])}</div></div>"
+        )
+    for state, label, indices, blocks in [("missed", "漏检", aligned["missed"], gt_blocks),
+                                          ("spurious", "误检", aligned["spurious"], pred_blocks)]:
+        for k in indices:
+            rows.append(
+                f"<div style='margin:6px 0;'><b style='color:{COMPARE_COLOR[state]};'>{label} "
+                f"{escape(blocks[k]['category'])}</b>"
+                f"<div style='white-space:pre-wrap;'>{escape(blocks[k]['text'])}</div></div>"
+            )
+    return "".join(rows)
+
+
+def compare_page(dataset_type, pred_path, image, zoom=1.0):
+    """对齐一页并渲染：标注图（绿：匹配，红：漏检）、预测图（绿：匹配，橙：误检）与逐块文本差异"""
+    if not image or not pred_path:
+        return None, None, ""
+    index = STORE.find(dataset_type, image)
+    if index is None:
+        return None, None, f"<p style='color:red;'>❌ {dataset_type} 中没有 {escape(image)}</p>"
+    gt_html = STORE.get(dataset_type, index).get("suffix", "")
+    pred_html = prediction_record(pred_path, image).get("answer", "")
+    aligned = align_page(pred_html, gt_html)
+
+    gt_status = {j: ("matched", f"#{k + 1}") for k, (_, j, _) in enumerate(aligned["matches"])}
+    pred_status = {i: ("matched", f"#{k + 1}") for k, (i, _, _) in enumerate(aligned["matches"])}
+    gt_status.update({j: ("missed", "漏检") for j in aligned["missed"]})
+    pred_status.update({i: ("spurious", "误检") for i in aligned["spurious"]})
+    image_path = IMAGE_FOLDERS[dataset_type] / image
+    gt_img = draw_blocks(image_path, aligned["gt_blocks"], gt_status, zoom)
+    pred_img = draw_blocks(image_path, aligned["pred_blocks"], pred_status, zoom)
+    return gt_img, pred_img, diff_report(aligned, bool(pred_html))
+
+
+class RankingJobs:
+    """
+    后台计算整个数据集的逐页对齐与排名：工作线程调用 page_diff.rank_pages（内部多进程），界面不阻塞；
+    结果按 (标注文件, 预测文件, 两者的修改时间) 缓存，失败的任务可重新提交
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(1)
+
+    @staticmethod
+    def key(label_path, pred_path):
+        return tuple((str(p), os.stat(p).st_mtime_ns) for p in (label_path, pred_path))
+
+    def start(self, label_path, pred_path):
+        key = self.key(label_path, pred_path)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or (job[1].done() and job[1].exception() is not None):
+                future = self._executor.submit(rank_pages, str(label_path), str(pred_path), progress=False)
+                job = self._jobs[key] = (time.time(), future)
+        return job
+
+    def get(self, label_path, pred_path):
+        with self._lock:
+            return self._jobs.get(self.key(label_path, pred_path))
+
+
+RANKINGS = RankingJobs()
+
+
+def start_ranking(dataset_type, pred_path):
+    if not pred_path or not os.path.exists(pred_path):
+        return f"❌ 预测文件不存在：{pred_path}"
+    RANKINGS.start(LABEL_FILES[dataset_type], pred_path)
+    return "⏳ 已在后台开始计算，稍后点击“刷新”查看排名"
+
+
+def refresh_ranking(dataset_type, pred_path):
+    """返回 (状态, 最差页面表, 页面下拉框)"""
+    if not pred_path or not os.path.exists(pred_path):
+        return f"❌ 预测文件不存在：{pred_path}", gr.update(), gr.update()
+    job = RANKINGS.get(LABEL_FILES[dataset_type], pred_path)
+    if job is None:
+        return "尚未计算，点击“计算排名”", gr.update(), gr.update()
+    started, future = job
+    if not future.done():
+        return f"⏳ 计算中，已用时 {time.time() - started:.0f}s", gr.update(), gr.update()
+    if future.exception() is not None:
+        return f"❌ 计算失败：{future.exception()}", gr.update(), gr.update()
+
+    pages = future.result()
+    rows = [
+        [p["image"], round(p["score"], 4), round(p["text_ned"], 4), round(p["layout_f1"], 4),
+         "-" if p["table_teds"] is None else round(p["table_teds"], 4), p["missed"], p["spurious"]]
+        for p in pages[:RANKING_TOP]
+    ]
+    mean_score = sum(p["score"] for p in pages) / max(len(pages), 1)
+    status = f"✅ 共 {len(pages)} 页，平均分 {mean_score:.4f}，以下为最差的 {len(rows)} 页"
+    names = [r[0] for r in rows]
+    return status, rows, gr.update(choices=names, value=names[0] if names else None)
+
+
 # ---------- 辅助 ----------
 def clear_all(dataset_type):
-    data = load_jsonl(LABEL_FILES[dataset_type])
-    max_index = max(len(data) - 1, 0)
+    max_index = max(STORE.size(dataset_type) - 1, 0)
     return None, "", get_legend(), "", gr.update(value=0, maximum=max_index), gr.update(choices=[], value=None)
 
 
-def change_index(dataset_type, current_index, step):
-    data = load_jsonl(LABEL_FILES[dataset_type])
-    new_index = max(0, min(len(data) - 1, current_index + step))
-    img, html, legend, filename = visualize(dataset_type, new_index)
+def change_index(dataset_type, current_index, step, zoom=1.0):
+    new_index = max(0, min(STORE.size(dataset_type) - 1, int(current_index) + step))
+    img, html, legend, filename = visualize(dataset_type, new_index, zoom)
     return img, html, new_index, legend, filename
 
 
 # ---------- 初始化 ----------
 dataset_options = ["train", "eval", "test", "test_B"]
 default_dataset = "train"
-default_data = load_jsonl(LABEL_FILES[default_dataset])
-default_max_index = max(len(default_data) - 1, 0)
+default_max_index = max(STORE.size(default_dataset) - 1, 0)
 default_img, default_html, default_legend, default_filename = visualize(default_dataset, 0)
 
 # ---------- 界面 ----------
@@ -140,6 +536,7 @@ with gr.Blocks() as demo:
         clear_btn = gr.Button("清空", scale=0, min_width=100)
         prev_btn = gr.Button("上一张", scale=0, min_width=100)
         next_btn = gr.Button("下一张", scale=0, min_width=100)
+        zoom_radio = gr.Radio(ZOOM_LEVELS, value=1.0, label="缩放", scale=0, min_width=160)
 
     with gr.Row():
         with gr.Column(scale=8):
@@ -153,7 +550,13 @@ with gr.Blocks() as demo:
     # ---------- 功能 ----------
     submit_btn.click(
         fn=visualize,
-        inputs=[dataset_dropdown, index_slider],
+        inputs=[dataset_dropdown, index_slider, zoom_radio],
+        outputs=[img_out, html_out, legend_out, filename_out]
+    )
+
+    zoom_radio.change(
+        fn=visualize,
+        inputs=[dataset_dropdown, index_slider, zoom_radio],
         outputs=[img_out, html_out, legend_out, filename_out]
     )
 
@@ -164,83 +567,111 @@ with gr.Blocks() as demo:
     )
 
     prev_btn.click(
-        fn=lambda d, i: change_index(d, i, -1),
-        inputs=[dataset_dropdown, index_slider],
+        fn=lambda d, i, z: change_index(d, i, -1, z),
+        inputs=[dataset_dropdown, index_slider, zoom_radio],
         outputs=[img_out, html_out, index_slider, legend_out, filename_out]
     )
     next_btn.click(
-        fn=lambda d, i: change_index(d, i, 1),
-        inputs=[dataset_dropdown, index_slider],
+        fn=lambda d, i, z: change_index(d, i, 1, z),
+        inputs=[dataset_dropdown, index_slider, zoom_radio],
         outputs=[img_out, html_out, index_slider, legend_out, filename_out]
     )
 
 
     # ---------- 搜索 ----------
-    def search_file(dataset_type, query):
+    def search_file(dataset_type, query, zoom):
         if not query or not query.strip():
             return None, "", 0, get_legend(), "❌ 请输入文件名关键词", gr.update(choices=[], value=None)
-        data = load_jsonl(LABEL_FILES[dataset_type])
-        filenames = [s["image"] for s in data]
-        scored = []
-        for i, fname in enumerate(filenames):
-            if query.lower() in fname.lower():
-                pos_score = 1 - (fname.lower().find(query.lower()) / max(len(fname), 1))
-                sim_score = difflib.SequenceMatcher(None, query.lower(), fname.lower()).ratio()
-                score = 0.6 * sim_score + 0.4 * pos_score
-                scored.append((score, i))
-        if not scored:
+        matches, exact = STORE.search(dataset_type, query)
+        if not matches:
             return None, "", 0, get_legend(), f"❌ 未找到包含 '{query}' 的文件", gr.update(choices=[], value=None)
-        scored.sort(key=lambda x: x[0], reverse=True)
-        matches = [i for _, i in scored[:50]]
-        if len(matches) == 1:
+        if len(matches) == 1 and exact:
             index = matches[0]
-            img, html, legend, filename = visualize(dataset_type, index)
+            img, html, legend, filename = visualize(dataset_type, index, zoom)
             filename = f"🔍 搜索结果：{filename}"
             return img, html, index, legend, filename, gr.update(choices=[], value=None)
-        matched_files = [filenames[i] for i in matches]
-        filename = f"🔍 找到 {len(matches)} 个匹配结果（已按相关度排序）"
+        matched_files = [STORE.name(dataset_type, i) for i in matches]
+        if exact:
+            filename = f"🔍 找到 {len(matches)} 个匹配结果（已按相关度排序）"
+        else:
+            filename = f"🔍 未找到包含 '{query}' 的文件，{len(matches)} 个近似结果（已按相似度排序）"
         return None, "", 0, get_legend(), filename, gr.update(choices=matched_files, value=matched_files[0])
 
 
-    def select_file(dataset_type, filename):
+    def select_file(dataset_type, filename, zoom):
         if not filename:
             return None, "", 0, get_legend(), ""
-        data = load_jsonl(LABEL_FILES[dataset_type])
-        index = next((i for i, s in enumerate(data) if s["image"] == filename), 0)
-        img, html, legend, fname = visualize(dataset_type, index)
+        index = STORE.find(dataset_type, filename) or 0
+        img, html, legend, fname = visualize(dataset_type, index, zoom)
         fname = f"🔎 选中：{fname}"
         return img, html, index, legend, fname
 
 
     search_btn.click(
         fn=search_file,
-        inputs=[dataset_dropdown, search_input],
+        inputs=[dataset_dropdown, search_input, zoom_radio],
         outputs=[img_out, html_out, index_slider, legend_out, filename_out, search_input]
     )
 
     search_input.change(
         fn=select_file,
-        inputs=[dataset_dropdown, search_input],
+        inputs=[dataset_dropdown, search_input, zoom_radio],
         outputs=[img_out, html_out, index_slider, legend_out, filename_out]
     )
 
 
     # ---------- 数据集切换自动加载 ----------
-    def on_dataset_change(dataset_type):
-        data = load_jsonl(LABEL_FILES[dataset_type])
-        if not data:
+    def on_dataset_change(dataset_type, zoom):
+        total = STORE.size(dataset_type)
+        if not total:
             return None, "<p style='color:red;'>⚠️ 当前数据集为空</p>", get_legend(), f"{dataset_type}（空）", gr.update(
                 maximum=0, value=0)
-        img, html, legend, filename = visualize(dataset_type, 0)
-        max_index = max(len(data) - 1, 0)
+        img, html, legend, filename = visualize(dataset_type, 0, zoom)
+        max_index = max(total - 1, 0)
         return img, html, legend, filename, gr.update(maximum=max_index, value=0)
 
 
     dataset_dropdown.change(
         fn=on_dataset_change,
-        inputs=dataset_dropdown,
+        inputs=[dataset_dropdown, zoom_radio],
         outputs=[img_out, html_out, legend_out, filename_out, index_slider]
     )
 
+    # ---------- 预测与标注对比 ----------
+    gr.Markdown("## 🔀 预测与标注对比（按 bbox IoU 对齐，按页面分数从低到高排名）")
+
+    with gr.Row():
+        cmp_dataset = gr.Dropdown(list(COMPARE_FILES), value="eval", label="标注数据集")
+        cmp_pred = gr.Textbox(value=str(COMPARE_FILES["eval"]), label="预测文件（eval.py 输出的 predict.jsonl）")
+        cmp_start_btn = gr.Button("计算排名", variant="primary", scale=0, min_width=100)
+        cmp_refresh_btn = gr.Button("刷新", scale=0, min_width=100)
+    cmp_status = gr.Markdown("")
+    cmp_table = gr.Dataframe(
+        headers=["文件名", "分数", "文本NED", "版面F1", "表格TEDS", "漏检", "误检"],
+        interactive=False,
+    )
+    cmp_page = gr.Dropdown(label="选择页面（可输入文件名）", choices=[], value=None, allow_custom_value=True)
+
+    with gr.Row():
+        with gr.Column(scale=4):
+            cmp_gt_img = gr.Image(type="pil", label="标注（绿：匹配，红：漏检）")
+        with gr.Column(scale=4):
+            cmp_pred_img = gr.Image(type="pil", label="预测（绿：匹配，橙：误检）")
+        with gr.Column(scale=4):
+            cmp_diff_out = gr.HTML(label="逐块文本差异")
+
+    cmp_dataset.change(fn=lambda d: str(COMPARE_FILES.get(d, "")), inputs=cmp_dataset, outputs=cmp_pred)
+    cmp_start_btn.click(fn=start_ranking, inputs=[cmp_dataset, cmp_pred], outputs=cmp_status)
+    cmp_refresh_btn.click(
+        fn=refresh_ranking,
+        inputs=[cmp_dataset, cmp_pred],
+        outputs=[cmp_status, cmp_table, cmp_page]
+    )
+    cmp_page.change(
+        fn=compare_page,
+        inputs=[cmp_dataset, cmp_pred, cmp_page, zoom_radio],
+        outputs=[cmp_gt_img, cmp_pred_img, cmp_diff_out]
+    )
+
 if __name__ == "__main__":
     demo.launch(share=True)